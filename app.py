@@ -1,12 +1,24 @@
+from startup_timing import step, report as report_startup
 
-from flask import Flask, jsonify, request, make_response
-from flask_jwt_extended import JWTManager
+with step('framework'):
+    from flask import Flask, jsonify, request, make_response, g, Response
+    from flask_jwt_extended import JWTManager
+    import psycopg2
 from datetime import timedelta
 import os
+import time
+import uuid
+import threading
+import logging
 from dotenv import load_dotenv
 
-if os.getenv('RENDER') is None:
-    load_dotenv()
+with step('config'):
+    if os.getenv('RENDER') is None:
+        load_dotenv()
+    
+    from app_logging import configure_logging, request_id_var
+    configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
@@ -18,18 +30,16 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=8)
 # Initialize JWT
 jwt = JWTManager(app)
 
-# Initialize database
-from database.db import init_db
-print("📡 Connecting to database...")
-init_db()
-print("✅ Database connected")
+# The database is not touched at import: pools open on the first query,
+# or in gunicorn's post_fork (gunicorn.conf.py) before a worker takes traffic.
 
 # MANUAL CORS - Add headers to every response
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Profile'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Request-ID, X-Profile-ID'
     response.headers['Access-Control-Max-Age'] = '3600'
     return response
 
@@ -40,30 +50,134 @@ def handle_options():
         response = make_response('', 200)
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Profile'
         response.headers['Access-Control-Max-Age'] = '3600'
         return response
 
+with step('metrics'):
+    import metrics
+    import tracing
+    import profiling
+    import compression
+
+# Per-request DB accounting (see database/query_budget.py) and request ids for the logs
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    request_id_var.set(g.request_id)
+    tracing.start_trace(g.request_id, tracing.trace_name(request))
+
+# Opt-in cProfile (see profiling.py): X-Profile from an admin, or PROFILE_SAMPLE_RATE
+@app.before_request
+def start_profile():
+    if request.method != 'OPTIONS':
+        g.profile = profiling.start(request, g.request_id)
+
+@app.after_request
+def add_server_timing(response):
+    from database.query_budget import server_timing_header, request_stats, DB_QUERY_BUDGET
+    started = g.get('request_started')
+    if started is None:
+        return response
+    
+    elapsed = time.perf_counter() - started
+    response.headers['Server-Timing'] = server_timing_header(elapsed * 1000)
+    response.headers['X-Request-ID'] = g.request_id
+    metrics.observe_request(request.method, request.endpoint, response.status_code, elapsed)
+    
+    trace = tracing.end_trace(response.status_code)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response.headers['X-Profile-ID'] = profiling.finish(profile, request, response.status_code, trace)
+    
+    stats = request_stats()
+    if stats['queries'] > DB_QUERY_BUDGET:
+        logger.warning("Query budget exceeded", extra={
+            'method': request.method, 'path': request.path,
+            'queries': stats['queries'], 'db_ms': round(stats['ms'], 1), 'budget': DB_QUERY_BUDGET
+        })
+    return response
+
+@app.teardown_request
+def discard_trace(error):
+    tracing.discard()
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiling.discard(profile)
+
+# gzip/br (see compression.py). Registered last so it runs before the hooks
+# above, which then count the compression time.
+compression.init_app(app)
+
+# Resume background event jobs (e.g. chunked deletions) left over by a restart.
+# Done on the first request so it runs inside the serving worker process.
+# A failed resume (e.g. the database is still starting) is retried on later
+# requests, backing off from 5s up to 5 minutes.
+_jobs_resumed = False
+_jobs_resume_lock = threading.Lock()
+_jobs_resume_failures = 0
+_jobs_resume_retry_at = 0.0
+
+@app.before_request
+def resume_event_jobs():
+    global _jobs_resumed, _jobs_resume_failures, _jobs_resume_retry_at
+    if _jobs_resumed or time.monotonic() < _jobs_resume_retry_at:
+        return
+    # One request per worker does the resume; the others carry on
+    if not _jobs_resume_lock.acquire(blocking=False):
+        return
+    try:
+        if _jobs_resumed:
+            return
+        import event_jobs
+        event_jobs.resume_pending_jobs()
+        _jobs_resumed = True
+    except Exception as e:
+        _jobs_resume_failures += 1
+        delay = min(5 * 2 ** (_jobs_resume_failures - 1), 300)
+        _jobs_resume_retry_at = time.monotonic() + delay
+        logger.warning("Could not resume event jobs (attempt %d), retrying in %ds: %s",
+                       _jobs_resume_failures, delay, e)
+    finally:
+        _jobs_resume_lock.release()
+
 # Import and register routes AFTER CORS setup
-from routes.auth import auth_bp
-from routes.events import events_bp
-from routes.tickets import tickets_bp
-from routes.scanner import scanner_bp
+with step('routes'):
+    from routes.auth import auth_bp
+    from routes.events import events_bp
+    from routes.tickets import tickets_bp
+    from routes.scanner import scanner_bp
+    from routes.admin import admin_bp
 
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(events_bp, url_prefix='/api/events')
 app.register_blueprint(tickets_bp, url_prefix='/api/tickets')
 app.register_blueprint(scanner_bp, url_prefix='/api/scanner')
+app.register_blueprint(admin_bp, url_prefix='/api/admin')
 
 # Health check
 @app.route('/health', methods=['GET'])
 def health_check():
+    from database.db import replica_status
     return jsonify({
         'status': 'healthy',
         'version': '1.0.0',
-        'cors': 'enabled (manual)'
+        'cors': 'enabled (manual)',
+        'readReplica': replica_status(),
+        'startupMs': startup_ms
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Optional shared secret for scrapers when /metrics is reachable from outside
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    body, content_type = metrics.render()
+    return Response(body, mimetype=content_type)
+
 @app.route('/api', methods=['GET'])
 def api_info():
     return jsonify({
@@ -76,6 +190,10 @@ def api_info():
 def not_found(error):
     return jsonify({'success': False, 'error': 'Endpoint not found'}), 404
 
+@app.errorhandler(psycopg2.errors.QueryCanceled)
+def query_timeout(error):
+    return jsonify({'success': False, 'error': 'The database took too long to answer, please retry'}), 503
+
 @app.errorhandler(500)
 def internal_error(error):
     return jsonify({'success': False, 'error': 'Internal server error'}), 500
@@ -90,11 +208,11 @@ def setup_database():
         
         # Seed database
         from database.db import execute_query
-        import bcrypt
+        from password_hashing import hash_password
         
         # Create admin user
-        admin_password = bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        scanner_password = bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        admin_password = hash_password('password123')
+        scanner_password = hash_password('password123')
         
         execute_query('''
             INSERT INTO users (email, password_hash, full_name, role, created_at)
@@ -112,6 +230,11 @@ def setup_database():
                 role = EXCLUDED.role
         ''', ('scanner@ticket9ja.com', scanner_password, 'Scanner User', 'scanner'), fetch=False)
         
+        # Scanner/creator joins on the other shards need the same users
+        from database.shards import replicate_user
+        for user in execute_query('SELECT id FROM users WHERE email IN (%s, %s)', ('admin@ticket9ja.com', 'scanner@ticket9ja.com')):
+            replicate_user(user['id'])
+        
         return jsonify({
             'success': True,
             'message': 'Database setup completed!',
@@ -120,12 +243,15 @@ def setup_database():
         
     except Exception as e:
         import traceback
+        logger.exception("Database setup failed")
         return jsonify({
             'success': False,
             'error': str(e),
             'traceback': traceback.format_exc()
         }), 500
 
+startup_ms = report_startup()
+
 if __name__ == '__main__':
     port = 5000
     
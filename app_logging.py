@@ -0,0 +1,149 @@
+"""
+Logging setup: leveled, structured, and off the request thread.
+
+configure_logging() points the root logger at a QueueHandler. Request
+threads only format the message and put the record on an in-memory
+queue; a QueueListener thread does the actual writing to stdout, as one
+JSON object per line (LOG_FORMAT=json, the default) or as plain text
+(LOG_FORMAT=text, easier to read locally).
+
+Every record carries the request id of the request that logged it. The id
+comes from the X-Request-ID header when a proxy set one, otherwise it is
+generated, and app.py sends it back on the response.
+
+Per-scan logs are high volume, so the scanner logs them through
+sampled_logger(): INFO records there are kept at LOG_SCAN_SAMPLE_RATE,
+while warnings and errors are always kept.
+
+Use it like the standard library:
+
+    logger = logging.getLogger(__name__)
+    logger.info("Ticket created", extra={'ticket_id': ticket_id})
+
+Keys passed in extra= become fields of the JSON line.
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_SCAN_SAMPLE_RATE = float(os.getenv('LOG_SCAN_SAMPLE_RATE', '0.05'))
+
+# Set per request by app.py; background threads log with request_id None
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+_listener = None
+_handler = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Keep a fraction of records below WARNING"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s')
+
+
+class _QueueHandler(QueueHandler):
+    """Hands records to the listener thread with the message and traceback already rendered"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def configure_logging():
+    """Install the queue handler on the root logger (once per process)"""
+    global _handler
+
+    if _listener is not None:
+        return
+
+    _handler = _QueueHandler(queue.SimpleQueue())
+    _handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    # The listener thread does not survive fork(); gunicorn workers with
+    # preload_app would otherwise queue records nobody writes
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _start_listener():
+    global _listener
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+    _listener = QueueListener(_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    # Fresh queue: anything the parent had not written yet is the parent's to write
+    _handler.queue = queue.SimpleQueue()
+    _start_listener()
+
+
+def sampled_logger(name, rate=None):
+    """Logger whose INFO/DEBUG records are kept at LOG_SCAN_SAMPLE_RATE (or rate)"""
+    logger = logging.getLogger(name)
+    if not any(isinstance(f, SampleFilter) for f in logger.filters):
+        logger.addFilter(SampleFilter(LOG_SCAN_SAMPLE_RATE if rate is None else rate))
+    return logger
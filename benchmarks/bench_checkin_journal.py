@@ -0,0 +1,155 @@
+"""
+Compare per-scan transactions against the write-behind check-in journal.
+
+Run against a scratch database (never production):
+
+    DATABASE_URL=postgresql://localhost/ticket9ja_bench python benchmarks/bench_checkin_journal.py --tickets 5000
+
+Creates a throwaway event with N tickets, checks every ticket in once with
+the classic INSERT + UPDATE + COMMIT per scan, then resets and checks them
+in again through checkin_journal, and prints scans/sec and commits/scan for
+both modes. The event is deleted afterwards.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['CHECKIN_WRITE_BEHIND'] = 'true'
+os.environ.setdefault('CHECKIN_JOURNAL_PATH', os.path.join(tempfile.mkdtemp(), 'bench_journal.log'))
+
+from psycopg2.extras import execute_values
+from database.db import init_db, get_db_connection, release_db_connection, execute_query
+import checkin_journal
+
+
+def create_fixture(ticket_count):
+    """Create a scanner user, an event and N active tickets"""
+    scanner = execute_query('''
+        INSERT INTO users (email, password_hash, full_name, role)
+        VALUES ('bench-scanner@ticket9ja.local', 'x', 'Bench Scanner', 'scanner')
+        ON CONFLICT (email) DO UPDATE SET full_name = EXCLUDED.full_name
+        RETURNING id
+    ''')[0]['id']
+
+    event_id = execute_query('''
+        INSERT INTO events (name, event_date, location, capacity, status)
+        VALUES ('Journal benchmark', NOW(), 'Bench', %s, 'active')
+        RETURNING id
+    ''', (ticket_count,))[0]['id']
+
+    type_id = execute_query('''
+        INSERT INTO ticket_types (event_id, name, quantity)
+        VALUES (%s, 'Bench', %s)
+        RETURNING id
+    ''', (event_id, ticket_count))[0]['id']
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            rows = []
+            for i in range(ticket_count):
+                number = f"BENCH-{uuid.uuid4().hex[:12].upper()}"
+                rows.append((event_id, type_id, f"{number}|{event_id}|bench{i}@example.com",
+                             number, f"Guest {i}", f"bench{i}@example.com"))
+            execute_values(cur, '''
+                INSERT INTO tickets (event_id, ticket_type_id, qr_code, ticket_number, recipient_name, recipient_email)
+                VALUES %s
+            ''', rows, page_size=1000)
+            cur.execute('SELECT id FROM tickets WHERE event_id = %s ORDER BY id', (event_id,))
+            ticket_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
+    return scanner, event_id, ticket_ids
+
+
+def reset(event_id):
+    execute_query('DELETE FROM check_ins WHERE ticket_id IN (SELECT id FROM tickets WHERE event_id = %s)',
+                  (event_id,), fetch=False)
+    execute_query("UPDATE tickets SET status = 'active' WHERE event_id = %s", (event_id,), fetch=False)
+    checkin_journal.forget_event(event_id)
+
+
+def run_direct(event_id, scanner_id, ticket_ids):
+    """One transaction and commit per scan, as validate_ticket does today"""
+    commits = 0
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            for ticket_id in ticket_ids:
+                cur.execute('SELECT 1 FROM check_ins WHERE ticket_id = %s', (ticket_id,))
+                cur.fetchone()
+                cur.execute('''
+                    INSERT INTO check_ins (ticket_id, event_id, scanner_id, check_in_time)
+                    VALUES (%s, %s, %s, NOW())
+                ''', (ticket_id, event_id, scanner_id))
+                cur.execute("UPDATE tickets SET status = 'used' WHERE id = %s", (ticket_id,))
+                conn.commit()
+                commits += 1
+    finally:
+        release_db_connection(conn)
+    return commits
+
+
+def run_journal(event_id, scanner_id, ticket_ids):
+    """Journal every scan, then drain the flusher"""
+    if not checkin_journal.is_enabled():
+        raise SystemExit("Set CHECKIN_WRITE_BEHIND=true to benchmark the journal")
+
+    commits_before = checkin_journal.stats['commits']
+    for ticket_id in ticket_ids:
+        checkin_journal.record_check_in(event_id, ticket_id, scanner_id)
+    scan_done = time.perf_counter()
+    checkin_journal.flush()
+    return checkin_journal.stats['commits'] - commits_before, scan_done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, default=2000)
+    args = parser.parse_args()
+
+    init_db()
+    scanner_id, event_id, ticket_ids = create_fixture(args.tickets)
+
+    try:
+        start = time.perf_counter()
+        direct_commits = run_direct(event_id, scanner_id, ticket_ids)
+        direct_elapsed = time.perf_counter() - start
+
+        reset(event_id)
+
+        start = time.perf_counter()
+        journal_commits, scan_done = run_journal(event_id, scanner_id, ticket_ids)
+        journal_answer = scan_done - start
+        journal_elapsed = time.perf_counter() - start
+
+        stored = execute_query('''
+            SELECT COUNT(*) AS count FROM check_ins c
+            JOIN tickets t ON c.ticket_id = t.id WHERE t.event_id = %s
+        ''', (event_id,))[0]['count']
+
+        n = len(ticket_ids)
+        print("=" * 60)
+        print(f"Scans: {n}")
+        print(f"Direct : {n / direct_elapsed:10.0f} scans/sec  {direct_commits / n:.3f} commits/scan")
+        print(f"Journal: {n / journal_answer:10.0f} scans/sec answered, "
+              f"{n / journal_elapsed:.0f} scans/sec incl. flush  {journal_commits / n:.3f} commits/scan")
+        print(f"Journal rows in check_ins after flush: {stored}")
+        print("=" * 60)
+    finally:
+        execute_query('DELETE FROM check_ins WHERE ticket_id IN (SELECT id FROM tickets WHERE event_id = %s)',
+                      (event_id,), fetch=False)
+        execute_query('DELETE FROM tickets WHERE event_id = %s', (event_id,), fetch=False)
+        execute_query('DELETE FROM ticket_types WHERE event_id = %s', (event_id,), fetch=False)
+        execute_query('DELETE FROM events WHERE id = %s', (event_id,), fetch=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Ticket listing payload size, build time and row memory: objects vs ?format=rows / columnar.
+
+    python benchmarks/bench_listing.py --tickets 2000 --tickets 20000
+    DATABASE_URL=postgresql://localhost/ticket9ja_bench python benchmarks/bench_listing.py --event-id 42
+
+Without --event-id nothing touches the database. Synthetic rows shaped like
+get_event_tickets' output are held as dicts (what RealDictCursor returns)
+or as tuples (what execute_rows returns), and each form is serialized the
+way the route does it. The report shows the memory the rows take
+(tracemalloc), the time to build the JSON response, and the payload size
+raw and gzipped.
+
+With --event-id the real route is timed end to end against that event
+through Flask's test client, fetch included. Use a scratch database (seed.py
+--scale can fill one), never production.
+"""
+import os
+import sys
+import gzip
+import time
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+FORMATS = ('objects', 'rows', 'columnar')
+
+
+def build_rows(source, fmt):
+    """Rebuild the fetched rows the way each cursor would hand them over"""
+    if fmt == 'objects':
+        return [dict(row) for row in source]
+    return [tuple(row.values()) for row in source]
+
+
+def row_memory(source, fmt):
+    tracemalloc.start()
+    rows = build_rows(source, fmt)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return size
+
+
+def respond(app, rows, columns, fmt):
+    import listings
+    from flask import jsonify
+
+    with app.app_context():
+        if fmt == 'objects':
+            data = {'tickets': rows, 'total': len(rows)}
+        else:
+            data = dict(listings.compact(columns, rows, fmt), format=fmt, total=len(rows))
+        return jsonify({'success': True, 'data': data}).get_data()
+
+
+def best_of(fn, repeats):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def offline(app, counts, repeats):
+    from microbench import ticket_rows
+
+    print(f"{'tickets':>8} {'format':9} {'row memory':>12} {'build JSON':>11} {'payload':>11} {'gzipped':>10}")
+    print("=" * 66)
+    for count in counts:
+        source = ticket_rows(count)
+        columns = list(source[0])
+        for fmt in FORMATS:
+            memory = row_memory(source, fmt)
+            rows = build_rows(source, fmt)
+            seconds, body = best_of(lambda: respond(app, rows, columns, fmt), repeats)
+            print(f"{count:>8} {fmt:9} {memory / 1024:>9.0f} KB {seconds * 1000:>8.1f} ms "
+                  f"{len(body) / 1024:>8.0f} KB {len(gzip.compress(body)) / 1024:>7.0f} KB")
+        print("-" * 66)
+
+
+def online(app, event_id, repeats):
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        token = create_access_token(identity='1')
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    print(f"{'format':9} {'request':>10} {'payload':>11}")
+    print("=" * 32)
+    for fmt in FORMATS:
+        url = f'/api/tickets/event/{event_id}?format={fmt}'
+
+        def fetch():
+            response = client.get(url, headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)[:200]
+            return response.get_data()
+
+        seconds, body = best_of(fetch, repeats)
+        print(f"{fmt:9} {seconds * 1000:>7.1f} ms {len(body) / 1024:>8.0f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, action='append', help='synthetic listing size (repeatable)')
+    parser.add_argument('--event-id', type=int, help='time the real route for this event instead')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    from app import app
+
+    if args.event_id is not None:
+        online(app, args.event_id, args.repeats)
+    else:
+        offline(app, args.tickets or [2000, 20000], args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Login throughput against concurrent scan latency (the gate-open rush).
+
+Start the app against a scratch database (never production), e.g.
+
+    gunicorn app:app -b 127.0.0.1:5000 --threads 8
+
+then, with a scanner account and a scanner token from /api/auth/login:
+
+    python benchmarks/bench_login.py --email scanner@test.com --password password123 \\
+        --token $TOKEN --logins 400 --login-concurrency 50 --scan-concurrency 20
+
+Phase 1 measures scan latency (GET /api/scanner/stats, or lookup with
+--ticket-number) on its own. Phase 2 repeats it while --login-concurrency
+virtual users hammer /api/auth/login. Compare the scan percentiles between
+the two phases, and the login req/s and 503s (PASSWORD_HASH_QUEUE shedding)
+across BCRYPT_ROUNDS / PASSWORD_HASH_WORKERS settings.
+"""
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from bench_scanner_async import Client, percentile
+
+
+async def scan_loop(base_url, path, headers, concurrency, stop):
+    latencies = []
+    failures = 0
+
+    async def user():
+        nonlocal failures
+        client = Client(base_url)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                if await client.request('GET', path, headers) >= 500:
+                    failures += 1
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                failures += 1
+                client.close()
+            latencies.append((time.perf_counter() - start) * 1000)
+        client.close()
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, failures
+
+
+async def login_storm(base_url, body, concurrency, total):
+    statuses = {}
+    remaining = [total]
+
+    async def user():
+        client = Client(base_url)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            try:
+                status = await client.request('POST', '/api/auth/login', {'Content-Type': 'application/json'}, body)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                status = 'error'
+                client.close()
+            statuses[status] = statuses.get(status, 0) + 1
+        client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return statuses, time.perf_counter() - started
+
+
+async def run(args):
+    headers = {'Authorization': f'Bearer {args.token}'}
+    path = f'/api/scanner/lookup/{args.ticket_number}' if args.ticket_number else '/api/scanner/stats'
+    body = json.dumps({'email': args.email, 'password': args.password}).encode()
+
+    # Phase 1: scans alone, for as long as the baseline window
+    stop = asyncio.Event()
+    scans = asyncio.create_task(scan_loop(args.url, path, headers, args.scan_concurrency, stop))
+    await asyncio.sleep(args.baseline_seconds)
+    stop.set()
+    baseline = await scans
+
+    # Phase 2: the same scans while the login storm runs
+    stop = asyncio.Event()
+    scans = asyncio.create_task(scan_loop(args.url, path, headers, args.scan_concurrency, stop))
+    statuses, elapsed = await login_storm(args.url, body, args.login_concurrency, args.logins)
+    stop.set()
+    during = await scans
+
+    return baseline, during, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--token', required=True, help='scanner access token for the scan stream')
+    parser.add_argument('--ticket-number', help='scan with lookup instead of stats')
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--login-concurrency', type=int, default=50)
+    parser.add_argument('--scan-concurrency', type=int, default=20)
+    parser.add_argument('--baseline-seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    baseline, during, statuses, elapsed = asyncio.run(run(args))
+
+    print(f"logins: {args.logins} at {args.login_concurrency} concurrent, "
+          f"scans at {args.scan_concurrency} concurrent")
+    print("=" * 72)
+    print(f"login throughput: {args.logins / elapsed:.1f} req/s over {elapsed:.1f} s")
+    print("login statuses:   " + ", ".join(f"{k}: {v}" for k, v in sorted(statuses.items(), key=str)))
+    print()
+    print(f"{'scans':12} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'failed':>8}")
+    for name, (latencies, failures), seconds in (
+        ('alone', baseline, args.baseline_seconds),
+        ('with logins', during, elapsed),
+    ):
+        if not latencies:
+            print(f"{name:12} no completed scans")
+            continue
+        print(f"{name:12} {len(latencies) / seconds:9.0f} {percentile(latencies, 0.50):9.1f} "
+              f"{percentile(latencies, 0.95):9.1f} {percentile(latencies, 0.99):9.1f} "
+              f"{statistics.mean(latencies):9.1f} {failures:8}")
+    print("=" * 72)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Listing and deletion cost with and without partitioning by event_id.
+
+Run against a scratch database (never production):
+
+    DATABASE_URL=postgresql://localhost/ticket9ja_bench python benchmarks/bench_partitioning.py --events 300 --tickets-per-event 2000
+
+Builds the same synthetic tickets/check_ins data three times in throwaway
+schemas (plain tables, LIST partitions per event, HASH partitions), then
+times a per-event ticket listing for a sample of events and the removal of
+a few whole events (row-by-row DELETE vs DROP of the event's partitions).
+The schemas are dropped at the end.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db import init_db, get_db_connection, release_db_connection
+
+LAYOUTS = ('plain', 'list', 'hash')
+
+
+def build(cur, layout, events, per_event, hash_partitions):
+    schema = f'bench_part_{layout}'
+    cur.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cur.execute(f'CREATE SCHEMA {schema}')
+    cur.execute(f'SET search_path = {schema}')
+
+    clause = {
+        'plain': '',
+        'list': 'PARTITION BY LIST (event_id)',
+        'hash': 'PARTITION BY HASH (event_id)',
+    }[layout]
+
+    cur.execute(f'''
+        CREATE TABLE tickets (
+            id BIGINT NOT NULL,
+            event_id INTEGER NOT NULL,
+            ticket_number VARCHAR(50) NOT NULL,
+            recipient_name VARCHAR(255) NOT NULL,
+            recipient_email VARCHAR(255) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (event_id, id)
+        ) {clause}
+    ''')
+    cur.execute(f'''
+        CREATE TABLE check_ins (
+            id BIGINT NOT NULL,
+            ticket_id BIGINT NOT NULL,
+            event_id INTEGER NOT NULL,
+            check_in_time TIMESTAMP NOT NULL,
+            PRIMARY KEY (event_id, id)
+        ) {clause}
+    ''')
+
+    if layout == 'list':
+        for table in ('tickets', 'check_ins'):
+            for event_id in range(1, events + 1):
+                cur.execute(f'CREATE TABLE {table}_e{event_id} PARTITION OF {table} FOR VALUES IN ({event_id})')
+    elif layout == 'hash':
+        for table in ('tickets', 'check_ins'):
+            for r in range(hash_partitions):
+                cur.execute(f'''
+                    CREATE TABLE {table}_p{r} PARTITION OF {table}
+                    FOR VALUES WITH (MODULUS {hash_partitions}, REMAINDER {r})
+                ''')
+
+    cur.execute('''
+        INSERT INTO tickets
+        SELECT g, ((g - 1) / %s) + 1, 'TKT-' || g, 'Guest ' || g, 'guest' || g || '@example.com',
+               CASE WHEN g %% 3 = 0 THEN 'used' ELSE 'active' END,
+               NOW() - (g || ' seconds')::interval
+        FROM generate_series(1, %s) g
+    ''', (per_event, events * per_event))
+    cur.execute('''
+        INSERT INTO check_ins
+        SELECT id, id, event_id, created_at + interval '1 day'
+        FROM tickets WHERE status = 'used'
+    ''')
+    cur.execute('CREATE INDEX ON check_ins (event_id, ticket_id)')
+    cur.execute('ANALYZE tickets')
+    cur.execute('ANALYZE check_ins')
+
+
+def time_listing(cur, sample):
+    timings = []
+    for event_id in sample:
+        start = time.perf_counter()
+        cur.execute('''
+            SELECT t.*, c.check_in_time
+            FROM tickets t
+            LEFT JOIN check_ins c ON c.event_id = t.event_id AND c.ticket_id = t.id
+            WHERE t.event_id = %s
+            ORDER BY t.created_at DESC
+        ''', (event_id,))
+        cur.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_delete(cur, conn, layout, victims):
+    timings = []
+    for event_id in victims:
+        start = time.perf_counter()
+        if layout == 'list':
+            cur.execute(f'DROP TABLE check_ins_e{event_id}')
+            cur.execute(f'DROP TABLE tickets_e{event_id}')
+        else:
+            cur.execute('DELETE FROM check_ins WHERE event_id = %s', (event_id,))
+            cur.execute('DELETE FROM tickets WHERE event_id = %s', (event_id,))
+        conn.commit()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--tickets-per-event', type=int, default=1000)
+    parser.add_argument('--hash-partitions', type=int, default=16)
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sample = rng.sample(range(1, args.events + 1), min(args.samples, args.events))
+    victims = sample[:5]
+
+    init_db()
+    conn = get_db_connection()
+    conn.autocommit = False
+
+    results = {}
+    try:
+        with conn.cursor() as cur:
+            for layout in LAYOUTS:
+                print(f"Building {layout} layout ({args.events} events x {args.tickets_per_event} tickets)...")
+                build(cur, layout, args.events, args.tickets_per_event, args.hash_partitions)
+                conn.commit()
+
+                cur.execute(f'SET search_path = bench_part_{layout}')
+                listing = time_listing(cur, sample)
+                conn.rollback()
+                cur.execute(f'SET search_path = bench_part_{layout}')
+                deleting = time_delete(cur, conn, layout, victims)
+                results[layout] = (listing, deleting)
+
+        print("=" * 60)
+        print(f"{'layout':8} {'list p50 ms':>12} {'list p95 ms':>12} {'delete avg ms':>14}")
+        for layout, (listing, deleting) in results.items():
+            p95 = sorted(listing)[int(len(listing) * 0.95) - 1] if len(listing) > 1 else listing[0]
+            print(f"{layout:8} {statistics.median(listing):12.2f} {p95:12.2f} {statistics.mean(deleting):14.2f}")
+        print("=" * 60)
+
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            for layout in LAYOUTS:
+                cur.execute(f'DROP SCHEMA IF EXISTS bench_part_{layout} CASCADE')
+        conn.commit()
+        release_db_connection(conn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Ticket PDF throughput for one event: PDFs per second.
+
+    python benchmarks/bench_pdf.py --tickets 5000 --workers 4
+
+Renders a synthetic event (one large background shared by every ticket)
+three ways:
+  naive   the old per-ticket path: decode the base64 background, re-encode
+          it as full-size JPEG and a QR PNG for every PDF, ASCII85 streams.
+          Only --naive-sample tickets are rendered.
+  cached  background prepared once (pdf_generator.prepare_background),
+          vector QR, one process
+  pool    the same in ticket_pdfs' spawn process pool, PDF_CHUNK_SIZE
+          tickets per task, as the render_pdfs job runs it
+
+PDFs are written to a scratch directory that is removed at the end.
+Nothing here touches the database.
+"""
+import os
+import sys
+import time
+import base64
+import shutil
+import argparse
+import tempfile
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+def make_background(width, height):
+    """A noisy photo-like image, as the base64 PNG an admin upload would be stored as"""
+    from PIL import Image
+
+    noise = Image.effect_noise((width, height), 40)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_TOP_BOTTOM)))
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def tickets(count, out_dir, background):
+    return [{
+        'ticket_number': f'TKT-{i:08X}',
+        'recipient_name': f'Guest {i}',
+        'event_name': 'Lagos Tech Night',
+        'event_date': 'January 01, 2030 at 08:00 PM',
+        'event_location': 'Eko Convention Centre',
+        'ticket_type': 'Early bird',
+        'qr_payload': f'TKT-{i:08X}|4242|guest{i}@example.com',
+        'background': background,
+        'path': os.path.join(out_dir, f'TKT-{i:08X}.pdf'),
+    } for i in range(count)]
+
+
+def naive_pdf(ticket, image_data):
+    """The pre-cache renderer: every PDF decodes and re-encodes the background and a QR PNG"""
+    import qrcode
+    from PIL import Image
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    background = Image.open(BytesIO(base64.b64decode(image_data.split('base64,', 1)[1]))).convert('RGB')
+    jpeg = BytesIO()
+    background.save(jpeg, format='JPEG')
+    jpeg.seek(0)
+    c.drawImage(ImageReader(jpeg), 0, 0, width=width, height=height)
+
+    png = BytesIO()
+    qrcode.make(ticket['qr_payload']).save(png)
+    png.seek(0)
+    c.drawImage(ImageReader(png), (width - 200) / 2, height / 2, width=200, height=200)
+
+    c.setFont('Helvetica-Bold', 18)
+    c.drawCentredString(width / 2, height / 2 - 40, ticket['ticket_number'])
+    c.save()
+    return buffer.getvalue()
+
+
+def report(name, count, seconds, out_dir):
+    sizes = [entry.stat().st_size for entry in os.scandir(out_dir) if entry.name.endswith('.pdf')]
+    average = sum(sizes) / len(sizes) / 1024 if sizes else 0
+    print(f"{name:8} {count:>7} {seconds:>9.2f} s {count / seconds:>10.1f} {average:>10.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--naive-sample', type=int, default=100)
+    parser.add_argument('--background', default='3000x4000', help='background size WxH in pixels')
+    parser.add_argument('--skip', action='append', default=[], choices=('naive', 'cached', 'pool'))
+    args = parser.parse_args()
+
+    import pdf_generator
+    import ticket_pdfs
+    from reportlab import rl_config
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    width, height = (int(side) for side in args.background.split('x'))
+    image_data = make_background(width, height)
+    print(f"{args.tickets} tickets, {width}x{height} background "
+          f"({len(image_data) / 1024 / 1024:.1f} MB base64), {args.workers} workers")
+
+    scratch = tempfile.mkdtemp(prefix='bench-pdf-')
+    try:
+        started = time.perf_counter()
+        background = pdf_generator.prepare_background(image_data, os.path.join(scratch, 'backgrounds'))
+        print(f"background prepared once in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        print(f"\n{'mode':8} {'PDFs':>7} {'time':>11} {'PDFs/s':>10} {'avg size':>13}")
+        print("=" * 54)
+
+        if 'naive' not in args.skip:
+            out_dir = os.path.join(scratch, 'naive')
+            os.makedirs(out_dir)
+            sample = tickets(args.naive_sample, out_dir, None)
+            rl_config.useA85 = 1
+            started = time.perf_counter()
+            for ticket in sample:
+                pdf_generator.store(ticket['path'], naive_pdf(ticket, image_data))
+            report('naive', len(sample), time.perf_counter() - started, out_dir)
+            rl_config.useA85 = 0
+
+        if 'cached' not in args.skip:
+            out_dir = os.path.join(scratch, 'cached')
+            batch = tickets(args.tickets, out_dir, background)
+            started = time.perf_counter()
+            count = ticket_pdfs.render_tickets(batch)
+            report('cached', count, time.perf_counter() - started, out_dir)
+
+        if 'pool' not in args.skip:
+            out_dir = os.path.join(scratch, 'pool')
+            batch = tickets(args.tickets, out_dir, background)
+            # Pool start-up is part of a job's cost, so it is timed too
+            started = time.perf_counter()
+            with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                count = ticket_pdfs.render_tickets(batch, executor)
+            report('pool', count, time.perf_counter() - started, out_dir)
+
+        print("=" * 54)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
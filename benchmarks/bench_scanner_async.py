@@ -0,0 +1,149 @@
+"""
+Load-test the sync (Flask) and async (scanner_asgi) scanner endpoints side by side.
+
+Start both servers against the same scratch database (never production):
+
+    gunicorn app:app -b 127.0.0.1:5000 --threads 8
+    uvicorn scanner_asgi:app --host 127.0.0.1 --port 5001
+
+then, with a scanner token from /api/auth/login:
+
+    python benchmarks/bench_scanner_async.py --token $TOKEN --concurrency 500 --requests 20000 \\
+        --endpoint lookup --ticket-number TKT-1A2B3C4D
+
+Every virtual user keeps one keep-alive connection open and fires requests
+back to back, so the server sees `--concurrency` requests in flight at all
+times. Prints throughput, latency percentiles and non-2xx/4xx failures for
+each target. `--endpoint validate --qr ...` works too; after the first scan
+every answer is "already used", which still runs the full lookup path.
+"""
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from urllib.parse import urlsplit
+
+
+class Client:
+    """Minimal HTTP/1.1 keep-alive client, so the benchmark needs nothing beyond the stdlib"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, headers, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}', f'Content-Length: {len(body)}']
+        lines += [f'{k}: {v}' for k, v in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        status = int(status_line.split()[1])
+
+        length = 0
+        close = False
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                close = True
+
+        await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_target(base_url, method, path, headers, body, concurrency, total):
+    latencies = []
+    failures = 0
+    remaining = [total]
+
+    async def user():
+        nonlocal failures
+        client = Client(base_url)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                status = await client.request(method, path, headers, body)
+                if status >= 500:
+                    failures += 1
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                failures += 1
+                client.close()
+            latencies.append((time.perf_counter() - start) * 1000)
+        client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return latencies, failures, elapsed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--endpoint', choices=('stats', 'lookup', 'validate'), default='stats')
+    parser.add_argument('--ticket-number')
+    parser.add_argument('--qr')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    headers = {'Authorization': f'Bearer {args.token}'}
+    body = b''
+    if args.endpoint == 'stats':
+        method, path = 'GET', '/api/scanner/stats'
+    elif args.endpoint == 'lookup':
+        if not args.ticket_number:
+            parser.error('--endpoint lookup needs --ticket-number')
+        method, path = 'GET', f'/api/scanner/lookup/{args.ticket_number}'
+    else:
+        if not args.qr:
+            parser.error('--endpoint validate needs --qr')
+        method, path = 'POST', '/api/scanner/validate'
+        headers['Content-Type'] = 'application/json'
+        body = json.dumps({'qrCode': args.qr}).encode()
+
+    print(f"{args.endpoint}: {args.requests} requests, {args.concurrency} concurrent")
+    print("=" * 72)
+    print(f"{'target':8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'failed':>8}")
+    for name, url in (('sync', args.sync_url), ('async', args.async_url)):
+        latencies, failures, elapsed = asyncio.run(
+            run_target(url, method, path, headers, body, args.concurrency, args.requests)
+        )
+        print(f"{name:8} {len(latencies) / elapsed:9.0f} {percentile(latencies, 0.50):9.1f} "
+              f"{percentile(latencies, 0.95):9.1f} {percentile(latencies, 0.99):9.1f} "
+              f"{statistics.mean(latencies):9.1f} {failures:8}")
+    print("=" * 72)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Attendee search latency (GET /api/scanner/search) on one event.
+
+    DATABASE_URL=postgresql://localhost/ticket9ja_bench python benchmarks/bench_search.py --event-id 42
+    DATABASE_URL=... python benchmarks/bench_search.py --event-id 42 -q adebayo -q 0803 --explain
+
+Needs a scratch database migrated with database/migrate.py (for the
+pg_trgm index) and a large event in it (seed.py --scale can fill one).
+Never point it at production. Without -q, the queries are taken from the
+event's own tickets: a name prefix, a mid-email substring, the last phone
+digits, a ticket number, and a misspelt name for the fuzzy path.
+
+Each query runs --repeats times through Flask's test client, auth and
+JSON included. The report shows p50 / p95 / max and how many tickets came
+back. --explain also prints EXPLAIN ANALYZE for the substring statement,
+to check that idx_tickets_search is used.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+def sample_queries(event_id):
+    from database.db import execute_query
+    from database.shards import shard_for_event
+
+    rows = execute_query('''
+        SELECT recipient_name, recipient_email, recipient_phone, ticket_number
+        FROM tickets
+        WHERE event_id = %s
+        ORDER BY id
+        LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM tickets WHERE event_id = %s)
+    ''', (event_id, event_id), shard=shard_for_event(event_id))
+    if not rows:
+        sys.exit(f"Event {event_id} has no tickets")
+
+    ticket = rows[0]
+    name = ticket['recipient_name'].split()[0]
+    queries = [
+        name[:4],
+        ticket['recipient_email'].split('@')[0][2:8],
+        ticket['ticket_number'],
+        # One letter swapped, for the fuzzy statement
+        name[:2] + name[3:4] + name[2:3] + name[4:] if len(name) > 4 else name + 'x',
+    ]
+    digits = ''.join(c for c in (ticket['recipient_phone'] or '') if c.isdigit())
+    if len(digits) >= 4:
+        queries.append(digits[-4:])
+    return queries
+
+
+def explain(event_id, q):
+    from database.db import get_db_connection, release_db_connection
+    from database.search import parse_search, search_params, SEARCH_QUERY
+    from database.shards import shard_for_event
+
+    search = parse_search(event_id, q)
+    conn = get_db_connection(shard=shard_for_event(event_id))
+    try:
+        with conn.cursor() as cur:
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + SEARCH_QUERY, search_params(search))
+            print('\n'.join(row[0] for row in cur.fetchall()))
+        conn.rollback()
+    finally:
+        release_db_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--event-id', type=int, required=True)
+    parser.add_argument('-q', '--query', action='append', help='search text (repeatable)')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--explain', action='store_true')
+    args = parser.parse_args()
+
+    from app import app
+    from flask_jwt_extended import create_access_token
+    from database.db import execute_query
+
+    admin = execute_query("SELECT id FROM users WHERE role = 'admin' ORDER BY id LIMIT 1")
+    if not admin:
+        sys.exit("No admin user to sign the requests as")
+    with app.app_context():
+        token = create_access_token(identity=str(admin[0]['id']))
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    queries = args.query or sample_queries(args.event_id)
+
+    print(f"{'query':24} {'p50':>8} {'p95':>8} {'max':>8} {'found':>6}")
+    print("=" * 58)
+    for q in queries:
+        timings = []
+        found = 0
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            response = client.get('/api/scanner/search', query_string={'eventId': args.event_id, 'q': q},
+                                  headers=headers)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.get_data(as_text=True)[:200]
+            found = response.get_json()['data']['total']
+
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{q[:24]:24} {statistics.median(timings):>5.1f} ms {p95:>5.1f} ms "
+              f"{timings[-1]:>5.1f} ms {found:>6}")
+
+        if args.explain:
+            explain(args.event_id, q)
+            print("-" * 58)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Cold-start cost of the Flask app: wall time to `import app` and where it goes.
+
+    python benchmarks/bench_startup.py --runs 5 --top 15
+
+Each run is a fresh interpreter with `python -X importtime -c "import app"`.
+Importing the app no longer connects to the database, so no server is needed.
+Prints the median wall time, the app's own step breakdown (the "Startup
+complete" log line from startup_timing.py) and the slowest imports by
+cumulative time. Modules that should stay deferred (qrcode, requests,
+email_service, PIL, reportlab, pdf_generator) are flagged if they show up.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ('qrcode', 'requests', 'email_service', 'PIL', 'reportlab', 'pdf_generator')
+
+
+def run_once():
+    env = dict(os.environ, LOG_FORMAT='json')
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    wall = (time.perf_counter() - started) * 1000
+
+    imports = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        imports[name] = int(cumulative) / 1000
+
+    steps = None
+    for line in proc.stdout.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry.get('msg') == 'Startup complete':
+            steps = entry
+    return wall, imports, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    walls = [wall for wall, _, _ in results]
+    _, imports, steps = results[-1]
+
+    print(f"import app: median {statistics.median(walls):.0f} ms, "
+          f"min {min(walls):.0f} ms over {args.runs} cold runs (interpreter start included)")
+    print("=" * 72)
+    if steps:
+        print(f"app steps ({steps['startup_ms']:.0f} ms): "
+              + ", ".join(f"{name} {ms:.0f}" for name, ms in steps['steps'].items()))
+        print("-" * 72)
+    print(f"{'module':48} {'cumulative ms':>14}")
+    for name, ms in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:48} {ms:14.1f}")
+    print("=" * 72)
+
+    loaded = [name for name in DEFERRED if name in imports]
+    if loaded:
+        print("imported at startup but meant to be deferred: " + ", ".join(loaded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Microbenchmarks for the CPU-bound pieces of the request path.
+
+    python benchmarks/microbench.py            # run and compare with benchmarks/baselines.json
+    python benchmarks/microbench.py --save     # run and record new baselines
+    python benchmarks/microbench.py --only qr_render --only email_html
+
+Covered: QR generation (qrcode.make, PNG encode, base64, and the whole of
+ticket_codes.render_qr_base64), the ticket email HTML, jsonify over a
+large ticket list (objects and ?format=rows), compressing that list
+(gzip and br at the configured levels), bcrypt verify, JWT decode
+(flask_jwt_extended for the Flask app, PyJWT for scanner_asgi) and the
+tracing overhead: a span
+outside any trace, and a whole traced request with ten spans and ten
+statement records. Fixtures are fixed, so runs only differ by the code
+under test and the machine.
+
+Each benchmark is calibrated to ~0.2 s per repeat; the best of --repeats
+is reported per call. Against a saved baseline the run exits 1 when any
+benchmark is more than --threshold slower (default 25%). Baselines are
+per machine: the file records where it was made, and the run warns when
+that differs. Nothing here touches the database.
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import platform
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+QR_PAYLOAD = 'TKT-1A2B3C4D|4242|guest@example.com'
+TICKET_COUNT = 2000
+
+
+def ticket_rows(count):
+    """Rows shaped like get_event_tickets' SELECT t.*, tt.name ... output"""
+    rng = random.Random(42)
+    created = datetime(2030, 1, 1, 18, 0, 0)
+    rows = []
+    for i in range(count):
+        rows.append({
+            'id': 100000 + i,
+            'event_id': 4242,
+            'ticket_type_id': rng.randint(1, 5),
+            'ticket_number': f'TKT-{rng.getrandbits(32):08X}',
+            'qr_code': f'TKT-{i:08X}|4242|guest{i}@example.com',
+            'recipient_name': f'Guest {i}',
+            'recipient_email': f'guest{i}@example.com',
+            'recipient_phone': '+2348000000000',
+            'ticket_bg_image': None,
+            'status': rng.choice(('active', 'active', 'active', 'used', 'cancelled')),
+            'email_sent': True,
+            'created_by': 1,
+            'created_at': created + timedelta(seconds=i),
+            'ticket_type_name': 'Early bird',
+            'price': Decimal('50.00'),
+        })
+    return rows
+
+
+def build_benchmarks():
+    """name -> zero-argument callable, with fixtures prepared up front"""
+    import qrcode
+    import jwt as pyjwt
+    from flask import jsonify
+    from flask_jwt_extended import create_access_token, decode_token
+    from app import app
+    from ticket_codes import render_qr_base64
+    from email_service import render_ticket_email_html
+    import password_hashing
+    import tracing
+    import listings
+    import compression
+
+    qr_image = qrcode.make(QR_PAYLOAD)
+    png_buffer = io.BytesIO()
+    qr_image.save(png_buffer)
+    png_bytes = png_buffer.getvalue()
+
+    def qr_png_encode():
+        buffer = io.BytesIO()
+        qr_image.save(buffer)
+        return buffer.getvalue()
+
+    rows = ticket_rows(TICKET_COUNT)
+
+    def jsonify_tickets():
+        with app.app_context():
+            return jsonify({'success': True, 'data': {'tickets': rows}}).get_data()
+
+    columns = list(rows[0])
+    tuples = [tuple(row.values()) for row in rows]
+
+    def jsonify_tickets_rows():
+        with app.app_context():
+            return jsonify({'success': True, 'data': listings.compact(columns, tuples, 'rows')}).get_data()
+
+    listing_body = jsonify_tickets()
+
+    password_hash = password_hashing._hash('correct horse battery staple')
+
+    with app.app_context():
+        token = create_access_token(identity='1')
+    secret = app.config['JWT_SECRET_KEY']
+
+    def jwt_decode_flask():
+        with app.app_context():
+            return decode_token(token)
+
+    def trace_span_off():
+        with tracing.span('bench'):
+            pass
+
+    def trace_request():
+        tracing.start_trace('bench', 'GET /bench', force=True)
+        for _ in range(10):
+            with tracing.span('bench'):
+                tracing.record('db.statement', 'db', 0.001, sql='SELECT ?', rows=1)
+        return tracing.end_trace(200)
+
+    return {
+        'qr_make': lambda: qrcode.make(QR_PAYLOAD),
+        'qr_png_encode': qr_png_encode,
+        'qr_base64': lambda: base64.b64encode(png_bytes).decode(),
+        'qr_render': lambda: render_qr_base64(QR_PAYLOAD),
+        'email_html': lambda: render_ticket_email_html(
+            'Ada Lovelace', 'Lagos Tech Night', 'January 01, 2030 at 08:00 PM',
+            'Eko Convention Centre', 'TKT-1A2B3C4D', 'VIP'
+        ),
+        f'jsonify_{TICKET_COUNT}_tickets': jsonify_tickets,
+        f'jsonify_{TICKET_COUNT}_tickets_rows': jsonify_tickets_rows,
+        f'gzip_{TICKET_COUNT}_tickets': lambda: compression.compress(listing_body, 'gzip'),
+        f'brotli_{TICKET_COUNT}_tickets': lambda: compression.compress(listing_body, 'br'),
+        f'bcrypt_verify_r{password_hashing.BCRYPT_ROUNDS}': lambda: password_hashing.verify_password(
+            'correct horse battery staple', password_hash
+        ),
+        'jwt_decode_flask': jwt_decode_flask,
+        'jwt_decode_asgi': lambda: pyjwt.decode(token, secret, algorithms=['HS256']),
+        'trace_span_off': trace_span_off,
+        'trace_request': trace_request,
+    }
+
+
+def measure(fn, repeats, target=0.2):
+    """Best per-call seconds over `repeats` runs of an auto-sized loop"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= target or loops >= 1_000_000:
+            break
+        loops = max(loops * 2, int(loops * target / max(elapsed, 1e-9)))
+
+    best = elapsed / loops
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', action='store_true', help='write the results as the new baselines')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown before failing')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', action='append', help='run just this benchmark (repeatable)')
+    args = parser.parse_args()
+
+    benchmarks = build_benchmarks()
+    if args.only:
+        unknown = set(args.only) - set(benchmarks)
+        if unknown:
+            parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+        benchmarks = {name: fn for name, fn in benchmarks.items() if name in args.only}
+
+    saved = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            saved = json.load(f)
+    baseline = {} if args.save else saved.get('results', {})
+    if baseline and saved.get('machine') != machine():
+        print(f"note: baselines were recorded on {saved.get('machine')}, "
+              f"comparisons across machines are rough")
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':28} {'per call':>12} {'baseline':>12} {'change':>8}")
+    print("=" * 64)
+    for name, fn in benchmarks.items():
+        seconds = measure(fn, args.repeats)
+        results[name] = seconds
+        line = f"{name:28} {_fmt(seconds):>12}"
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            flag = ''
+            if change > args.threshold:
+                regressions.append(name)
+                flag = '  REGRESSION'
+            line += f" {_fmt(baseline[name]):>12} {change:+8.1%}{flag}"
+        print(line)
+    print("=" * 64)
+
+    if args.save:
+        # --only updates just those entries; the rest of the file is kept
+        merged = dict(saved.get('results', {}) if saved.get('machine') == machine() else {}, **results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'machine': machine(), 'results': merged}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"saved {len(results)} baselines to {os.path.relpath(BASELINE_PATH, ROOT)}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def _fmt(seconds):
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.2f} ms'
+    return f'{seconds * 1e6:.1f} us'
+
+
+if __name__ == '__main__':
+    main()
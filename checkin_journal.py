@@ -0,0 +1,501 @@
+"""
+Write-behind check-in journal for gate rushes.
+
+When CHECKIN_WRITE_BEHIND=true, validate_ticket stops opening a write
+transaction per scan. Instead each check-in is appended to a local
+append-only journal (fsync'd before the scanner gets an answer) and a
+background flusher writes journal entries to check_ins / tickets.status in
+multi-row batches.
+
+Every worker process on the host scans through the same journal file, so
+one ticket can't be admitted twice by two workers:
+
+  * appends are serialized with an exclusive flock on <journal>.lock
+  * before deciding, a worker reads every entry other workers appended
+    since its last look and applies it to its per-event map of used
+    tickets. The decision and the append happen under the same lock.
+
+Admin changes (a ticket re-activated or deleted, an event deleted or
+archived) are journaled as well, so every worker's map follows them.
+
+Only one process flushes at a time. It holds <journal>.owner, and any
+worker takes over when the owner goes away. The flushed position is
+checkpointed, so after a crash the next owner writes everything after the
+checkpoint again; a crash between "answered the scanner" and "flushed to
+Postgres" loses nothing. Check-ins the flush can't write (already in
+Postgres, or for a ticket deleted or archived since the scan) are logged
+and counted in stats['dropped'], never silently skipped.
+
+The journal is local to a host. With several app hosts, send each event's
+scanners to the same host, or leave write-behind off.
+"""
+import os
+import json
+import fcntl
+import atexit
+import logging
+import threading
+from datetime import datetime
+from psycopg2.extras import RealDictCursor, execute_values
+from database.db import get_db_connection, release_db_connection
+from database.shards import shard_for_event
+
+JOURNAL_ENABLED = os.getenv('CHECKIN_WRITE_BEHIND', 'false').lower() == 'true'
+JOURNAL_PATH = os.getenv('CHECKIN_JOURNAL_PATH', 'checkin_journal.log')
+JOURNAL_FSYNC = os.getenv('CHECKIN_JOURNAL_FSYNC', 'true').lower() == 'true'
+FLUSH_INTERVAL = float(os.getenv('CHECKIN_FLUSH_INTERVAL', '0.5'))
+FLUSH_BATCH_SIZE = int(os.getenv('CHECKIN_FLUSH_BATCH_SIZE', '1000'))
+COMPACT_BYTES = int(os.getenv('CHECKIN_JOURNAL_COMPACT_BYTES', str(16 * 1024 * 1024)))
+# Entries kept in memory before the ones already in Postgres are dropped
+PRUNE_ENTRIES = 4 * FLUSH_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()        # this process's state; always taken before the file lock
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+
+_journal = None          # journal opened for reading and appending (None = not set up here)
+_append_lock = None      # <journal>.lock, held around catch-up + decide + append
+_owner = None            # <journal>.owner while this process is the flusher
+_read_offset = 0         # journal bytes applied to this process's state
+_log = []                # (end offset, entry) for every entry in the current journal file
+_flush_index = 0         # owner: first entry of _log not yet flushed
+_flushed_offset = 0      # owner: journal byte offset covered by the last checkpoint
+_used = {}               # event_id -> {ticket_id: entry}
+_flusher = None
+
+stats = {'scans': 0, 'duplicates': 0, 'flushed': 0, 'commits': 0, 'flush_errors': 0, 'dropped': 0}
+
+
+class _Locked:
+    """The cross-process append lock, taken after the in-process one"""
+
+    def __enter__(self):
+        _lock.acquire()
+        try:
+            fcntl.flock(_append_lock.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            _lock.release()
+            raise
+
+    def __exit__(self, *exc):
+        fcntl.flock(_append_lock.fileno(), fcntl.LOCK_UN)
+        _lock.release()
+
+
+def _checkpoint_path():
+    return JOURNAL_PATH + '.ckpt'
+
+
+def _read_checkpoint():
+    try:
+        with open(_checkpoint_path()) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_checkpoint(offset):
+    tmp = _checkpoint_path() + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _checkpoint_path())
+
+
+def is_enabled():
+    """True when scans should go through the journal"""
+    global _journal, _append_lock
+
+    if not JOURNAL_ENABLED:
+        return False
+
+    if _journal is not None:
+        return True
+
+    with _lock:
+        if _journal is None:
+            _append_lock = open(JOURNAL_PATH + '.lock', 'a')
+            _journal = open(JOURNAL_PATH, 'ab+')
+
+    _start_flusher()
+    return True
+
+
+def _catch_up():
+    """Apply entries other workers appended since the last look (caller holds _Locked)"""
+    global _journal, _read_offset, _log, _flush_index
+
+    # The owner compacts by swapping in a new file; everything in the old one is in Postgres
+    if os.stat(JOURNAL_PATH).st_ino != os.fstat(_journal.fileno()).st_ino:
+        _journal.close()
+        _journal = open(JOURNAL_PATH, 'ab+')
+        _read_offset = 0
+        _log = []
+        _flush_index = 0
+
+    _journal.seek(_read_offset)
+    data = _journal.read()
+    # A line without its newline is still being written or was torn by a crash
+    complete = data[:data.rfind(b'\n') + 1]
+
+    offset = _read_offset
+    for line in complete.splitlines(keepends=True):
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            logger.warning("Skipping corrupt journal line: %s", line[:80])
+            continue
+        _apply(offset, entry)
+    _read_offset = offset
+
+    if len(_log) > PRUNE_ENTRIES:
+        _prune()
+
+
+def _prune():
+    """Forget entries that are in Postgres; loading an event reads them from there (caller holds _Locked)"""
+    global _flush_index
+
+    flushed = _flushed_offset if _owner is not None else _read_checkpoint()
+    keep_from = next((i for i, (end, _) in enumerate(_log) if end > flushed), len(_log))
+    if _owner is not None:
+        keep_from = min(keep_from, _flush_index)
+    del _log[:keep_from]
+    _flush_index = max(0, _flush_index - keep_from)
+
+
+def _apply(end_offset, entry):
+    _log.append((end_offset, entry))
+
+    kind = entry.get('forget')
+    if kind == 'event':
+        _used.pop(entry['event_id'], None)
+        return
+
+    event_used = _used.get(entry['event_id'])
+    if kind == 'ticket':
+        if event_used is not None:
+            event_used.pop(entry['ticket_id'], None)
+        # A re-activated or deleted ticket's unflushed check-in must not reach Postgres
+        for _, earlier in _log[_flush_index:-1]:
+            if earlier.get('ticket_id') == entry['ticket_id'] and not earlier.get('forget'):
+                earlier['cancelled'] = True
+    elif event_used is not None:
+        event_used[entry['ticket_id']] = entry
+
+
+def _append(entry):
+    """Append an entry and apply it here (caller holds _Locked, after _catch_up)"""
+    global _read_offset
+
+    size = os.fstat(_journal.fileno()).st_size
+    data = json.dumps(entry).encode() + b'\n'
+    if size > _read_offset:
+        # Bytes after the last complete line: a write torn by a crash. End it so it is skipped.
+        logger.warning("Skipping torn journal write of %d byte(s)", size - _read_offset)
+        data = b'\n' + data
+
+    _journal.write(data)
+    _journal.flush()
+    if JOURNAL_FSYNC:
+        os.fsync(_journal.fileno())
+
+    _read_offset = size + len(data)
+    _apply(_read_offset, entry)
+
+
+def _load_event(event_id):
+    """The used-ticket map of an event in Postgres"""
+    conn = get_db_connection(shard=shard_for_event(event_id))
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute('''
+                SELECT c.ticket_id, c.scanner_id, c.check_in_time
+                FROM check_ins c
+                JOIN tickets t ON t.event_id = c.event_id AND t.id = c.ticket_id
+                WHERE c.event_id = %s AND t.status = 'used'
+            ''', (event_id,))
+            rows = cur.fetchall()
+        conn.rollback()
+    finally:
+        release_db_connection(conn)
+
+    return {
+        row['ticket_id']: {
+            'ticket_id': row['ticket_id'],
+            'scanner_id': row['scanner_id'],
+            'check_in_time': row['check_in_time'].isoformat()
+        }
+        for row in rows
+    }
+
+
+def record_check_in(event_id, ticket_id, scanner_id):
+    """
+    Check a ticket in through the journal.
+
+    Returns (accepted, entry). When accepted is False the entry describes
+    the earlier check-in that made this scan a duplicate.
+    """
+    while True:
+        if event_id not in _used:
+            _load_into_used(event_id)
+
+        with _Locked():
+            _catch_up()
+            event_used = _used.get(event_id)
+            if event_used is None:
+                # Another worker journaled forget_event since the load
+                continue
+
+            previous = event_used.get(ticket_id)
+            if previous:
+                stats['duplicates'] += 1
+                return False, previous
+
+            entry = {
+                'event_id': event_id,
+                'ticket_id': ticket_id,
+                'scanner_id': scanner_id,
+                'check_in_time': datetime.now().isoformat()
+            }
+            _append(entry)
+            stats['scans'] += 1
+            unflushed = len(_log) - _flush_index
+            break
+
+    if _owner is not None and unflushed >= FLUSH_BATCH_SIZE:
+        _wakeup.set()
+
+    return True, entry
+
+
+def _load_into_used(event_id):
+    """
+    Build an event's used map from Postgres plus the journal. Runs under the
+    append lock: an entry only leaves the journal (pruned or compacted)
+    after its checkpoint, which is written under the same lock, so every
+    entry is either in _log here or committed before the Postgres snapshot.
+    Other scans on the host wait for the query, once per event per worker.
+    """
+    with _Locked():
+        if event_id in _used:
+            return
+        _catch_up()
+        loaded = _load_event(event_id)
+        # Journal entries are newer than, or already in, the Postgres snapshot
+        for _, entry in _log:
+            if entry['event_id'] != event_id or entry.get('forget') == 'event':
+                continue
+            if entry.get('forget') == 'ticket':
+                loaded.pop(entry['ticket_id'], None)
+            else:
+                loaded[entry['ticket_id']] = entry
+        _used[event_id] = loaded
+
+
+def forget_ticket(event_id, ticket_id):
+    """Drop a ticket from every worker's used map (ticket deleted or re-activated by an admin)"""
+    if not is_enabled():
+        return
+    with _Locked():
+        _catch_up()
+        _append({'forget': 'ticket', 'event_id': event_id, 'ticket_id': ticket_id})
+
+
+def forget_event(event_id):
+    """Drop an event's used map everywhere so it is reloaded on the next scan"""
+    if not is_enabled():
+        return
+    with _Locked():
+        _catch_up()
+        _append({'forget': 'event', 'event_id': event_id})
+
+
+def _take_ownership():
+    """Become the flusher if no other process is. Returns True if this process is it."""
+    global _owner, _flushed_offset, _flush_index
+
+    if _owner is not None:
+        return True
+
+    owner = open(JOURNAL_PATH + '.owner', 'a')
+    try:
+        fcntl.flock(owner.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        owner.close()
+        return False
+
+    with _Locked():
+        _catch_up()
+        _owner = owner
+        _flushed_offset = _read_checkpoint()
+        _flush_index = next((i for i, (end, _) in enumerate(_log) if end > _flushed_offset), len(_log))
+        unflushed = len(_log) - _flush_index
+
+    logger.info("Took over flushing the check-in journal %s", JOURNAL_PATH)
+    if unflushed:
+        logger.info("Replaying %d unflushed journal entr(ies) from %s", unflushed, JOURNAL_PATH)
+        _wakeup.set()
+    return True
+
+
+def flush():
+    """Write unflushed journal entries to Postgres in batches. Returns check-ins written."""
+    global _flushed_offset, _flush_index
+
+    if not is_enabled() or not _take_ownership():
+        return 0
+
+    total = 0
+    with _flush_lock:
+        while True:
+            with _Locked():
+                _catch_up()
+                batch = _log[_flush_index:_flush_index + FLUSH_BATCH_SIZE]
+            if not batch:
+                break
+
+            check_ins = [entry for _, entry in batch if not entry.get('forget') and not entry.get('cancelled')]
+            if check_ins:
+                _write_batch(check_ins)
+                total += len(check_ins)
+
+            with _Locked():
+                _flush_index += len(batch)
+                _flushed_offset = batch[-1][0]
+                _write_checkpoint(_flushed_offset)
+
+        with _Locked():
+            _catch_up()
+            _maybe_compact()
+
+    return total
+
+
+def _write_batch(batch):
+    """
+    Write a batch, one transaction per shard. If a later shard fails the
+    whole batch is retried; entries already written are skipped then.
+    """
+    by_shard = {}
+    for entry in batch:
+        by_shard.setdefault(shard_for_event(entry['event_id']), []).append(entry)
+
+    for shard, entries in by_shard.items():
+        _write_shard_batch(shard, entries)
+
+
+def _write_shard_batch(shard, batch):
+    """
+    Insert check-ins with one multi-row statement, then mark the tickets
+    that got one used, one statement per event. Every lookup carries
+    event_id so partitioned tables prune to the event's partition.
+    """
+    conn = get_db_connection(shard=shard)
+    try:
+        with conn.cursor() as cur:
+            # Replays can see entries that already reached Postgres, and tickets
+            # deleted or archived since the scan must not fail the whole batch
+            inserted = execute_values(cur, '''
+                INSERT INTO check_ins (ticket_id, event_id, scanner_id, check_in_time)
+                SELECT v.ticket_id, v.event_id, v.scanner_id, v.check_in_time
+                FROM (VALUES %s) AS v(ticket_id, event_id, scanner_id, check_in_time)
+                WHERE NOT EXISTS (
+                        SELECT 1 FROM check_ins c WHERE c.event_id = v.event_id AND c.ticket_id = v.ticket_id
+                      )
+                  AND EXISTS (SELECT 1 FROM tickets t WHERE t.event_id = v.event_id AND t.id = v.ticket_id)
+                RETURNING ticket_id, event_id
+            ''', [
+                (e['ticket_id'], e['event_id'], e['scanner_id'], e['check_in_time']) for e in batch
+            ], template='(%s::integer, %s::integer, %s::integer, %s::timestamp)',
+               page_size=len(batch), fetch=True)
+
+            # Only tickets whose check-in was written; a dropped one keeps its status
+            by_event = {}
+            for ticket_id, event_id in inserted:
+                by_event.setdefault(event_id, []).append(ticket_id)
+            for event_id, ticket_ids in by_event.items():
+                cur.execute('''
+                    UPDATE tickets
+                    SET status = 'used'
+                    WHERE event_id = %s AND id = ANY(%s) AND status = 'active'
+                ''', (event_id, ticket_ids))
+
+        conn.commit()
+        stats['commits'] += 1
+        stats['flushed'] += len(inserted)
+    except Exception:
+        conn.rollback()
+        stats['flush_errors'] += 1
+        raise
+    finally:
+        release_db_connection(conn)
+
+    written = {row[0] for row in inserted}
+    dropped = [e for e in batch if e['ticket_id'] not in written]
+    if dropped:
+        stats['dropped'] += len(dropped)
+        logger.warning(
+            "Flush dropped %d check-in(s) already in Postgres or for deleted/archived tickets",
+            len(dropped),
+            extra={'shard': shard, 'ticket_ids': [e['ticket_id'] for e in dropped[:50]]}
+        )
+
+
+def _maybe_compact():
+    """Start a fresh journal once everything in it is safely in Postgres (caller holds _Locked)"""
+    global _journal, _read_offset, _log, _flush_index, _flushed_offset
+
+    if _flushed_offset < COMPACT_BYTES or _flush_index < len(_log) or _read_offset != _flushed_offset:
+        return
+
+    # Checkpoint first: a crash before the swap replays flushed entries, which the flush skips
+    _write_checkpoint(0)
+    tmp = JOURNAL_PATH + '.tmp'
+    with open(tmp, 'wb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, JOURNAL_PATH)
+
+    _journal.close()
+    _journal = open(JOURNAL_PATH, 'ab+')
+    _read_offset = 0
+    _log = []
+    _flush_index = 0
+    _flushed_offset = 0
+
+
+def _flush_loop():
+    while True:
+        _wakeup.wait(FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception as e:
+            logger.warning("Check-in flush failed, will retry: %s", e)
+
+
+def _start_flusher():
+    global _flusher
+
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_flush_loop, name='checkin-journal-flusher', daemon=True)
+        _flusher.start()
+    atexit.register(_flush_at_exit)
+
+
+def _flush_at_exit():
+    if _owner is None:
+        return
+    try:
+        flush()
+    except Exception as e:
+        logger.error("Final check-in flush failed, entries stay in the journal: %s", e)
@@ -0,0 +1,60 @@
+"""
+asyncpg connection pools for the async scanner app (scanner_asgi.py).
+
+Uses the same DATABASE_URL / SHARD_DATABASE_URLS as database/db.py, one
+pool per shard. There is no replica routing here: every scanner query must
+see the latest check-ins. Queries use asyncpg's $1, $2 placeholders.
+"""
+import os
+import asyncio
+import logging
+import asyncpg
+from database.db import SHARD_DATABASE_URLS
+
+ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', '2'))
+ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', '20'))
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+
+
+async def init_pools():
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise Exception("DATABASE_URL not found")
+
+    for shard, url in enumerate([database_url] + SHARD_DATABASE_URLS):
+        _pools[shard] = await asyncpg.create_pool(
+            url,
+            min_size=ASYNC_DB_POOL_MIN,
+            max_size=ASYNC_DB_POOL_MAX,
+        )
+    logger.info("Async database pools created", extra={'shards': len(_pools)})
+
+
+async def close_pools():
+    pools = list(_pools.values())
+    _pools.clear()
+    await asyncio.gather(*(pool.close() for pool in pools))
+
+
+def get_pool(shard=0):
+    pool = _pools.get(shard or 0)
+    if pool is None:
+        raise Exception(f"Async pool for shard {shard or 0} not initialized")
+    return pool
+
+
+async def fetch(query, *args, shard=0):
+    return await get_pool(shard).fetch(query, *args)
+
+
+async def fetchrow(query, *args, shard=0):
+    return await get_pool(shard).fetchrow(query, *args)
+
+
+async def fan_out(query, *args):
+    """Run the same query on every shard concurrently and concatenate the rows"""
+    results = await asyncio.gather(*(pool.fetch(query, *args) for pool in _pools.values()))
+    return [row for rows in results for row in rows]
@@ -2,15 +2,62 @@ import psycopg2
 from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 import os
+import time
+import logging
+import threading
 from dotenv import load_dotenv
 
+try:
+    from database.query_budget import InstrumentedConnection, apply_statement_timeout, normalize_sql
+except ImportError:  # migrate.py runs from inside database/
+    from query_budget import InstrumentedConnection, apply_statement_timeout, normalize_sql
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 connection_pool = None
+# Pools open on first use (or in gunicorn's post_fork), not at import
+_init_lock = threading.Lock()
+
+# Per-process pool bounds, shared by every pool below. DB_POOL_MIN connections
+# are opened up front (and kept when idle), so they double as the warm set
+# gunicorn workers start with (see gunicorn.conf.py).
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+
+# Optional read replica (DATABASE_REPLICA_URL). Only queries that ask for
+# intent='read' go there, and only when the caller has not written in the
+# last REPLICA_STICKY_SECONDS and the replica is less than
+# REPLICA_MAX_LAG_SECONDS behind. To try it locally, run two Postgres
+# instances (ideally the second as a streaming standby of the first) and
+# point DATABASE_URL / DATABASE_REPLICA_URL at them.
+replica_pool = None
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '2'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '1'))
+
+# Event-level sharding (see database/shards.py): SHARD_DATABASE_URLS lists
+# extra Postgres nodes as shards 1, 2, ...; DATABASE_URL is shard 0, which
+# also holds users and the event -> shard directory.
+SHARD_DATABASE_URLS = [url.strip() for url in os.getenv('SHARD_DATABASE_URLS', '').split(',') if url.strip()]
+shard_pools = {}
+
+_replica_lag = {'checked_at': 0.0, 'seconds': None}
+_lag_lock = threading.Lock()
+_last_write = {}      # session key -> time.monotonic() of its last write
+_checked_out = {}     # id(conn) -> (pool it came from, perf_counter at checkout)
+_pool_names = {}      # pool -> 'primary' / 'replica' / 'shard1' ...
+
+# Callbacks (event, pool name, seconds) on every checkout and release:
+# seconds waited for a checkout, seconds the connection was held for a
+# release. metrics.py and tracing.py subscribe so this module does not
+# depend on them
+pool_observers = []
 
 def init_db():
     """Initialize database connection pool"""
-    global connection_pool
+    global connection_pool, replica_pool
     
     try:
         database_url = os.getenv('DATABASE_URL')
@@ -18,35 +65,227 @@ def init_db():
         if not database_url:
             raise Exception("DATABASE_URL not found")
         
-        print(f"📡 Connecting to database...")
+        logger.info("Connecting to database")
+        started = time.perf_counter()
         
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1, 20,
-            database_url
+        # Threaded: gthread/gevent workers check out from several threads at once
+        primary_pool = psycopg2.pool.ThreadedConnectionPool(
+            DB_POOL_MIN, DB_POOL_MAX,
+            database_url,
+            connection_factory=InstrumentedConnection
         )
         
-        if connection_pool:
-            print("✅ Database connection pool created")
+        if primary_pool:
+            _pool_names[primary_pool] = 'primary'
+            logger.info("Database connection pool created", extra={
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            })
         
     except Exception as e:
-        print(f"❌ Database connection failed: {e}")
+        logger.error("Database connection failed: %s", e)
+        raise
+    
+    for shard, shard_url in enumerate(SHARD_DATABASE_URLS, start=1):
+        try:
+            shard_pools[shard] = psycopg2.pool.ThreadedConnectionPool(
+                DB_POOL_MIN, DB_POOL_MAX, shard_url, connection_factory=InstrumentedConnection
+            )
+            _pool_names[shard_pools[shard]] = f'shard{shard}'
+            logger.info("Shard %s pool created", shard)
+        except Exception as e:
+            logger.error("Shard %s connection failed: %s", shard, e)
+            raise
+    
+    replica_url = os.getenv('DATABASE_REPLICA_URL')
+    if replica_url:
+        try:
+            replica_pool = psycopg2.pool.ThreadedConnectionPool(
+                DB_POOL_MIN, DB_POOL_MAX, replica_url, connection_factory=InstrumentedConnection
+            )
+            _pool_names[replica_pool] = 'replica'
+            logger.info("Read replica pool created")
+        except Exception as e:
+            # The primary can serve everything; a missing replica is not fatal
+            replica_pool = None
+            logger.warning("Read replica unavailable, reads go to primary: %s", e)
+    
+    # Published last: get_db_connection() treats a set primary pool as "all pools ready"
+    connection_pool = primary_pool
+
+def close_db():
+    """
+    Close every pool and forget it, so the next init_db() starts clean.
+    
+    gunicorn calls this in the master before forking: a connection
+    inherited across fork() would share one socket between processes.
+    """
+    global connection_pool, replica_pool
+    
+    for db_pool in [connection_pool, replica_pool] + list(shard_pools.values()):
+        if db_pool is not None and not db_pool.closed:
+            db_pool.closeall()
+    
+    connection_pool = None
+    replica_pool = None
+    shard_pools.clear()
+    _pool_names.clear()
+    _checked_out.clear()
+    _replica_lag.update(checked_at=0.0, seconds=None)
+
+def warm_pools():
+    """Check that every idle pooled connection answers, so a fresh worker's first requests don't pay for it"""
+    for db_pool in [connection_pool, replica_pool] + list(shard_pools.values()):
+        if db_pool is None:
+            continue
+        conns = [db_pool.getconn() for _ in range(db_pool.minconn)]
+        for conn in conns:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+                db_pool.putconn(conn)
+            except psycopg2.Error as e:
+                # Dropped; the pool opens a replacement on demand
+                logger.warning("Discarding dead pooled connection: %s", e)
+                db_pool.putconn(conn, close=True)
+
+def _session_key():
+    """Who 'the same session' is for read-your-writes: the JWT user, else the client address"""
+    try:
+        from flask import has_request_context, request
+        if not has_request_context():
+            return None
+        from flask_jwt_extended import get_jwt_identity
+        try:
+            identity = get_jwt_identity()
+        except Exception:
+            identity = None
+        return f"user:{identity}" if identity else f"addr:{request.remote_addr}"
+    except ImportError:
+        return None
+
+def mark_write():
+    """Remember that the current session just wrote, so its reads stay on the primary"""
+    key = _session_key()
+    if key:
+        now = time.monotonic()
+        _last_write[key] = now
+        if len(_last_write) > 10000:
+            for stale in [k for k, t in list(_last_write.items()) if now - t > REPLICA_STICKY_SECONDS]:
+                _last_write.pop(stale, None)
+
+def _replica_lag_seconds():
+    """Replication lag, cached for REPLICA_LAG_CHECK_SECONDS"""
+    now = time.monotonic()
+    if now - _replica_lag['checked_at'] < REPLICA_LAG_CHECK_SECONDS:
+        return _replica_lag['seconds']
+    
+    if not _lag_lock.acquire(blocking=False):
+        return _replica_lag['seconds']  # someone else is checking
+    
+    try:
+        conn = replica_pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                # 0 when fully replayed. The pg_last_* functions return NULL on a
+                # server that is not in recovery, so check that first: a
+                # promoted or misconfigured replica URL is not a replica.
+                cur.execute('''
+                    SELECT pg_is_in_recovery(),
+                           CASE
+                               WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                               ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                           END
+                ''')
+                in_recovery, lag = cur.fetchone()
+            conn.rollback()
+            if not in_recovery:
+                logger.warning("Replica is not in recovery (not a standby); reads stay on the primary")
+                _replica_lag['seconds'] = None
+            else:
+                # NULL on a standby that has not replayed anything yet
+                _replica_lag['seconds'] = float(lag) if lag is not None else None
+        finally:
+            replica_pool.putconn(conn)
+    except Exception as e:
+        logger.warning("Replica lag check failed: %s", e)
+        _replica_lag['seconds'] = None
+    finally:
+        _replica_lag['checked_at'] = now
+        _lag_lock.release()
+    
+    return _replica_lag['seconds']
+
+def _use_replica():
+    if replica_pool is None:
+        return False
+    
+    key = _session_key()
+    if key:
+        last = _last_write.get(key)
+        if last and time.monotonic() - last < REPLICA_STICKY_SECONDS:
+            return False
+    
+    lag = _replica_lag_seconds()
+    return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+
+def replica_status():
+    """Replica routing state for the health check"""
+    if replica_pool is None:
+        return {'enabled': False}
+    return {'enabled': True, 'lagSeconds': _replica_lag['seconds']}
+
+def _checkout(source):
+    started = time.perf_counter()
+    conn = source.getconn()
+    for observer in pool_observers:
+        observer('checkout', _pool_names.get(source, 'primary'), time.perf_counter() - started)
+    # IMPORTANT: Set autocommit to False for explicit transaction control
+    conn.autocommit = False
+    _checked_out[id(conn)] = (source, time.perf_counter())
+    try:
+        apply_statement_timeout(conn)
+    except Exception:
+        release_db_connection(conn)
         raise
+    return conn
 
-def get_db_connection():
-    """Get a connection from the pool"""
+def get_db_connection(intent='write', shard=None):
+    """
+    Get a connection from the pool.
+    
+    intent='read' may return a replica connection; anything else is the
+    primary, and checking out a primary connection for writing inside a
+    request pins that session's reads to the primary for a short while.
+    shard picks another node when sharding is on (None/0 is the home node).
+    """
     global connection_pool
     
     if connection_pool is None:
-        init_db()
+        with _init_lock:
+            if connection_pool is None:
+                init_db()
+    
+    if shard:
+        shard_pool = shard_pools.get(shard)
+        if shard_pool is None:
+            raise Exception(f"Unknown shard {shard}")
+        return _checkout(shard_pool)
+    
+    if intent == 'read' and _use_replica():
+        try:
+            return _checkout(replica_pool)
+        except Exception as e:
+            logger.warning("Replica checkout failed, using primary: %s", e)
     
     if connection_pool:
         try:
-            conn = connection_pool.getconn()
-            # IMPORTANT: Set autocommit to False for explicit transaction control
-            conn.autocommit = False
+            conn = _checkout(connection_pool)
+            if intent == 'write':
+                mark_write()
             return conn
         except Exception as e:
-            print(f"❌ Failed to get connection: {e}")
+            logger.error("Failed to get connection: %s", e)
             raise
     else:
         raise Exception("Connection pool not initialized")
@@ -55,19 +294,34 @@ def release_db_connection(conn):
     """Return connection to the pool"""
     global connection_pool
     
-    if connection_pool and conn:
-        connection_pool.putconn(conn)
+    if not conn:
+        return
+    
+    owner, checked_out_at = _checked_out.pop(id(conn), (connection_pool, None))
+    if owner:
+        owner.putconn(conn)
+        held = time.perf_counter() - checked_out_at if checked_out_at is not None else 0.0
+        for observer in pool_observers:
+            observer('release', _pool_names.get(owner, 'primary'), held)
 
-def execute_query(query, params=None, fetch=True):
-    """Execute a query and return results"""
-    conn = get_db_connection()
+def execute_query(query, params=None, fetch=True, intent='write', shard=None):
+    """
+    Execute a query and return results.
+    
+    Pass intent='read' for reads that can tolerate replica lag (listings,
+    reports); the default runs on the primary. shard runs it on another
+    node (see database/shards.py).
+    """
+    is_write = query.strip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))
+    conn = get_db_connection('read' if intent == 'read' and not is_write else 'primary', shard=shard)
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(query, params or ())
             
             # Determine if we should commit
-            if query.strip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            if is_write:
                 conn.commit()
+                mark_write()
             
             if fetch:
                 if query.strip().upper().startswith('SELECT') or 'RETURNING' in query.upper():
@@ -80,7 +334,27 @@ def execute_query(query, params=None, fetch=True):
             return result
     except Exception as e:
         conn.rollback()
-        print(f"❌ Query error: {e}")
+        logger.error("Query error: %s", e, extra={'sql': normalize_sql(query)})
+        raise e
+    finally:
+        release_db_connection(conn)
+
+def execute_rows(query, params=None, intent='read', shard=None):
+    """
+    Run a SELECT and return (column names, rows as plain tuples).
+    
+    For big listings: RealDictCursor builds a dict per row, which costs more
+    memory than the values themselves and repeats every key in the JSON.
+    Reads default to intent='read' here.
+    """
+    conn = get_db_connection('read' if intent == 'read' else 'primary', shard=shard)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params or ())
+            return [column.name for column in cur.description], cur.fetchall()
+    except Exception as e:
+        conn.rollback()
+        logger.error("Query error: %s", e, extra={'sql': normalize_sql(query)})
         raise e
     finally:
         release_db_connection(conn)
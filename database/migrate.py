@@ -1,12 +1,15 @@
 import os
 from dotenv import load_dotenv
 from db import get_db_connection, release_db_connection  # ← FIXED: Remove "database."
+from partitions import partition_strategy, reset_strategy_cache
+from search import create_search_indexes
+from psycopg2.extras import execute_values
 
 load_dotenv()
 
-def create_tables():
-    """Create all database tables"""
-    conn = get_db_connection()
+def create_tables(shard=None):
+    """Create all database tables (on the home database, or on the given shard)"""
+    conn = get_db_connection(shard=shard)
     conn.autocommit = False
     
     try:
@@ -35,7 +38,7 @@ def create_tables():
                 event_date TIMESTAMP NOT NULL,
                 location VARCHAR(255) NOT NULL,
                 capacity INTEGER NOT NULL,
-                status VARCHAR(50) DEFAULT 'draft' CHECK (status IN ('draft', 'active', 'closed')),
+                status VARCHAR(50) DEFAULT 'draft' CHECK (status IN ('draft', 'active', 'closed', 'deleting')),
                 banner_image TEXT,
                 created_by INTEGER REFERENCES users(id),
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -66,6 +69,7 @@ def create_tables():
                 event_id INTEGER REFERENCES events(id) ON DELETE CASCADE,
                 ticket_type_id INTEGER REFERENCES ticket_types(id),
                 qr_code TEXT NOT NULL,
+                qr_digest BYTEA,
                 ticket_number VARCHAR(50) UNIQUE NOT NULL,
                 recipient_name VARCHAR(255) NOT NULL,
                 recipient_email VARCHAR(255) NOT NULL,
@@ -84,11 +88,123 @@ def create_tables():
             CREATE TABLE IF NOT EXISTS check_ins (
                 id SERIAL PRIMARY KEY,
                 ticket_id INTEGER REFERENCES tickets(id) ON DELETE CASCADE,
+                event_id INTEGER,
                 scanner_id INTEGER REFERENCES users(id),
                 check_in_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
+        # Background jobs over a whole event (chunked deletion)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS event_jobs (
+                id SERIAL PRIMARY KEY,
+                event_id INTEGER NOT NULL,
+                event_name VARCHAR(255),
+                job_type VARCHAR(50) NOT NULL,
+                status VARCHAR(50) DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'completed', 'failed')),
+                checkins_done INTEGER DEFAULT 0,
+                tickets_done INTEGER DEFAULT 0,
+                ticket_types_done INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_event_jobs_event ON event_jobs (event_id, job_type)')
+        cur.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_event_jobs_one_active
+            ON event_jobs (event_id, job_type) WHERE status IN ('pending', 'running')
+        ''')
+        
+        # Older databases: allow the 'deleting' event status
+        cur.execute('ALTER TABLE events DROP CONSTRAINT IF EXISTS events_status_check')
+        cur.execute('''
+            ALTER TABLE events ADD CONSTRAINT events_status_check
+            CHECK (status IN ('draft', 'active', 'closed', 'deleting'))
+        ''')
+        
+        # Fixed-width QR digest for scan lookups (older databases get the column here).
+        # Partitioned tables already carry UNIQUE (event_id, qr_digest) instead.
+        cur.execute('ALTER TABLE tickets ADD COLUMN IF NOT EXISTS qr_digest BYTEA')
+        if partition_strategy(cur) is None:
+            cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_tickets_qr_digest ON tickets (qr_digest)')
+        
+        # Check-ins carry their event so they can be partitioned by it
+        cur.execute('ALTER TABLE check_ins ADD COLUMN IF NOT EXISTS event_id INTEGER')
+        # Check-ins from before the column; lookups filter on it to prune partitions
+        cur.execute('''
+            UPDATE check_ins c SET event_id = t.event_id
+            FROM tickets t
+            WHERE c.event_id IS NULL AND t.id = c.ticket_id
+        ''')
+        
+        # Cold storage for closed events (no per-ticket background image, no FKs)
+        cur.execute('ALTER TABLE events ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP')
+        
+        # Small banner variant for listings (image_pipeline.py)
+        cur.execute('ALTER TABLE events ADD COLUMN IF NOT EXISTS banner_thumb TEXT')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS tickets_archive (
+                id INTEGER PRIMARY KEY,
+                event_id INTEGER NOT NULL,
+                ticket_type_id INTEGER,
+                qr_code TEXT NOT NULL,
+                qr_digest BYTEA,
+                ticket_number VARCHAR(50) UNIQUE NOT NULL,
+                recipient_name VARCHAR(255) NOT NULL,
+                recipient_email VARCHAR(255) NOT NULL,
+                recipient_phone VARCHAR(50),
+                status VARCHAR(50),
+                email_sent BOOLEAN,
+                created_by INTEGER,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_tickets_archive_event ON tickets_archive (event_id)')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS check_ins_archive (
+                id INTEGER PRIMARY KEY,
+                ticket_id INTEGER NOT NULL,
+                event_id INTEGER NOT NULL,
+                scanner_id INTEGER,
+                check_in_time TIMESTAMP
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_check_ins_archive_event ON check_ins_archive (event_id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_check_ins_archive_ticket ON check_ins_archive (ticket_id)')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS event_archive_stats (
+                event_id INTEGER PRIMARY KEY,
+                total_tickets_issued INTEGER DEFAULT 0,
+                tickets_used INTEGER DEFAULT 0,
+                tickets_active INTEGER DEFAULT 0,
+                tickets_cancelled INTEGER DEFAULT 0,
+                total_revenue DECIMAL(12, 2) DEFAULT 0
+            )
+        ''')
+        # Revenue of cancelled tickets, which the admin dashboard leaves out
+        cur.execute('ALTER TABLE event_archive_stats ADD COLUMN IF NOT EXISTS cancelled_revenue DECIMAL(12, 2)')
+        cur.execute('''
+            UPDATE event_archive_stats s
+            SET cancelled_revenue = (
+                SELECT COALESCE(SUM(tt.price), 0)
+                FROM tickets_archive t
+                JOIN ticket_types tt ON t.ticket_type_id = tt.id
+                WHERE t.event_id = s.event_id AND t.status = 'cancelled'
+            )
+            WHERE s.cancelled_revenue IS NULL
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_check_ins_archive_scanner ON check_ins_archive (scanner_id, check_in_time)')
+        create_read_views(cur)
+        track_ticket_changes(cur)
+        index_ticket_ids(cur, partitioned=partition_strategy(cur) is not None)
+        
+        # Attendee search at the door (database/search.py)
+        if not create_search_indexes(cur):
+            print("⚠️  pg_trgm / btree_gin could not be enabled; /api/scanner/search needs them")
+        
         # Commit
         conn.commit()
         cur.close()
@@ -106,7 +222,339 @@ def create_tables():
     finally:
         release_db_connection(conn)
 
+def track_ticket_changes(cur):
+    """Keep tickets.updated_at current on every update; validation_index refreshes by it"""
+    cur.execute('''
+        CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = clock_timestamp();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    cur.execute('DROP TRIGGER IF EXISTS tickets_touch_updated_at ON tickets')
+    cur.execute('''
+        CREATE TRIGGER tickets_touch_updated_at BEFORE UPDATE ON tickets
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_tickets_event_updated ON tickets (event_id, updated_at)')
+
+def index_ticket_ids(cur, partitioned):
+    """
+    Indexes for lookups by ticket id alone (admin routes only get the id from
+    the URL). A partitioned tickets table is keyed on (event_id, id), so it
+    needs its own index on id; queries that know the event should still pass
+    event_id so they prune to one partition.
+    """
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_check_ins_ticket_id ON check_ins (ticket_id)')
+    if partitioned:
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_tickets_id ON tickets (id)')
+
+def create_read_views(cur):
+    """
+    Read-through views over hot + archived rows, used by per-event read paths.
+    qr_digest is only a scan lookup key, so it stays out of them (and out of API responses).
+    """
+    cur.execute('DROP VIEW IF EXISTS tickets_all')
+    cur.execute('''
+        CREATE VIEW tickets_all AS
+        SELECT id, event_id, ticket_type_id, qr_code, ticket_number,
+               recipient_name, recipient_email, recipient_phone, ticket_bg_image,
+               status, email_sent, created_by, created_at, updated_at
+        FROM tickets
+        UNION ALL
+        SELECT id, event_id, ticket_type_id, qr_code, ticket_number,
+               recipient_name, recipient_email, recipient_phone, NULL,
+               status, email_sent, created_by, created_at, updated_at
+        FROM tickets_archive
+    ''')
+    cur.execute('DROP VIEW IF EXISTS check_ins_all')
+    cur.execute('''
+        CREATE VIEW check_ins_all AS
+        SELECT id, ticket_id, scanner_id, check_in_time FROM check_ins
+        UNION ALL
+        SELECT id, ticket_id, scanner_id, check_in_time FROM check_ins_archive
+    ''')
+
+def backfill_qr_digest(batch_size=5000):
+    """Fill qr_digest for existing tickets in id-ordered batches, committing after each"""
+    conn = get_db_connection()
+    conn.autocommit = False
+    
+    try:
+        cur = conn.cursor()
+        last_id = 0
+        total = 0
+        
+        print("🔧 Backfilling tickets.qr_digest...")
+        
+        while True:
+            cur.execute('''
+                SELECT MAX(id) FROM (
+                    SELECT id FROM tickets WHERE id > %s ORDER BY id LIMIT %s
+                ) batch
+            ''', (last_id, batch_size))
+            batch_end = cur.fetchone()[0]
+            
+            if batch_end is None:
+                break
+            
+            # Same digest as ticket_codes.qr_digest: md5 of the UTF-8 payload
+            cur.execute('''
+                UPDATE tickets
+                SET qr_digest = decode(md5(qr_code), 'hex')
+                WHERE id > %s AND id <= %s AND qr_digest IS NULL
+            ''', (last_id, batch_end))
+            total += cur.rowcount
+            conn.commit()
+            
+            last_id = batch_end
+            print(f"   ...up to ticket {last_id} ({total} updated)")
+        
+        cur.close()
+        print(f"✅ Backfilled qr_digest for {total} tickets")
+        return total
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Backfill failed: {e}")
+        raise e
+        
+    finally:
+        release_db_connection(conn)
+
+def partition_tables(strategy='list', partitions=16):
+    """
+    Convert tickets and check_ins into tables partitioned by event_id.
+    
+    list: one partition per existing event plus a default partition; new
+          events get their own partitions from create_event.
+    hash: `partitions` buckets, for very many small events.
+    
+    Runs in a single transaction and takes exclusive locks, so run it in a
+    maintenance window. The old tables are kept as *_unpartitioned until
+    you drop them.
+    """
+    if strategy not in ('list', 'hash'):
+        raise ValueError("strategy must be 'list' or 'hash'")
+    
+    conn = get_db_connection()
+    conn.autocommit = False
+    
+    try:
+        cur = conn.cursor()
+        
+        if partition_strategy(cur) is not None:
+            print("ℹ️  tickets is already partitioned")
+            return False
+        
+        print(f"🔧 Partitioning tickets and check_ins by event_id ({strategy})...")
+        
+        # Keep the sequences alive when the old tables are dropped later
+        cur.execute('ALTER SEQUENCE tickets_id_seq OWNED BY NONE')
+        cur.execute('ALTER SEQUENCE check_ins_id_seq OWNED BY NONE')
+        
+        cur.execute('ALTER TABLE check_ins RENAME TO check_ins_unpartitioned')
+        cur.execute('ALTER TABLE tickets RENAME TO tickets_unpartitioned')
+        cur.execute('ALTER INDEX IF EXISTS idx_tickets_qr_digest RENAME TO idx_tickets_unpartitioned_qr_digest')
+        cur.execute('ALTER INDEX IF EXISTS idx_tickets_search RENAME TO idx_tickets_unpartitioned_search')
+        cur.execute('ALTER INDEX IF EXISTS idx_tickets_event_updated RENAME TO idx_tickets_unpartitioned_event_updated')
+        cur.execute('ALTER INDEX IF EXISTS idx_check_ins_ticket_id RENAME TO idx_check_ins_unpartitioned_ticket_id')
+        
+        partition_clause = 'LIST (event_id)' if strategy == 'list' else 'HASH (event_id)'
+        
+        # Unique constraints on a partitioned table must include event_id
+        cur.execute(f'''
+            CREATE TABLE tickets (
+                id INTEGER NOT NULL DEFAULT nextval('tickets_id_seq'),
+                event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+                ticket_type_id INTEGER REFERENCES ticket_types(id),
+                qr_code TEXT NOT NULL,
+                qr_digest BYTEA,
+                ticket_number VARCHAR(50) NOT NULL,
+                recipient_name VARCHAR(255) NOT NULL,
+                recipient_email VARCHAR(255) NOT NULL,
+                recipient_phone VARCHAR(50),
+                ticket_bg_image TEXT,
+                status VARCHAR(50) DEFAULT 'active' CHECK (status IN ('active', 'used', 'cancelled')),
+                email_sent BOOLEAN DEFAULT FALSE,
+                created_by INTEGER REFERENCES users(id),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (event_id, id),
+                UNIQUE (event_id, ticket_number),
+                UNIQUE (event_id, qr_digest)
+            ) PARTITION BY {partition_clause}
+        ''')
+        cur.execute(f'''
+            CREATE TABLE check_ins (
+                id INTEGER NOT NULL DEFAULT nextval('check_ins_id_seq'),
+                ticket_id INTEGER NOT NULL,
+                event_id INTEGER NOT NULL,
+                scanner_id INTEGER REFERENCES users(id),
+                check_in_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (event_id, id),
+                FOREIGN KEY (event_id, ticket_id) REFERENCES tickets (event_id, id) ON DELETE CASCADE
+            ) PARTITION BY {partition_clause}
+        ''')
+        cur.execute('CREATE INDEX idx_tickets_ticket_number ON tickets (ticket_number)')
+        cur.execute('CREATE INDEX idx_check_ins_ticket ON check_ins (event_id, ticket_id)')
+        cur.execute('CREATE INDEX idx_check_ins_scanner ON check_ins (scanner_id, check_in_time)')
+        track_ticket_changes(cur)
+        index_ticket_ids(cur, partitioned=True)
+        create_search_indexes(cur)
+        
+        if strategy == 'list':
+            cur.execute('SELECT id FROM events ORDER BY id')
+            event_ids = [row[0] for row in cur.fetchall()]
+            for table in ('tickets', 'check_ins'):
+                for event_id in event_ids:
+                    cur.execute(f'CREATE TABLE {table}_e{event_id} PARTITION OF {table} FOR VALUES IN ({event_id})')
+                cur.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+            print(f"   ...created partitions for {len(event_ids)} events")
+        else:
+            for table in ('tickets', 'check_ins'):
+                for remainder in range(partitions):
+                    cur.execute(f'''
+                        CREATE TABLE {table}_p{remainder} PARTITION OF {table}
+                        FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})
+                    ''')
+            print(f"   ...created {partitions} hash partitions")
+        
+        cur.execute('''
+            INSERT INTO tickets (
+                id, event_id, ticket_type_id, qr_code, qr_digest, ticket_number,
+                recipient_name, recipient_email, recipient_phone, ticket_bg_image,
+                status, email_sent, created_by, created_at, updated_at
+            )
+            SELECT id, event_id, ticket_type_id, qr_code, qr_digest, ticket_number,
+                   recipient_name, recipient_email, recipient_phone, ticket_bg_image,
+                   status, email_sent, created_by, created_at, updated_at
+            FROM tickets_unpartitioned
+            WHERE event_id IS NOT NULL
+        ''')
+        print(f"   ...copied {cur.rowcount} tickets")
+        
+        cur.execute('''
+            INSERT INTO check_ins (id, ticket_id, event_id, scanner_id, check_in_time)
+            SELECT c.id, c.ticket_id, t.event_id, c.scanner_id, c.check_in_time
+            FROM check_ins_unpartitioned c
+            JOIN tickets_unpartitioned t ON c.ticket_id = t.id
+            WHERE t.event_id IS NOT NULL
+        ''')
+        print(f"   ...copied {cur.rowcount} check-ins")
+        
+        cur.execute("ALTER SEQUENCE tickets_id_seq OWNED BY tickets.id")
+        cur.execute("ALTER SEQUENCE check_ins_id_seq OWNED BY check_ins.id")
+        
+        # The views still point at the renamed tables
+        create_read_views(cur)
+        
+        conn.commit()
+        cur.close()
+        reset_strategy_cache()
+        
+        print("✅ Partitioning complete")
+        print("   Old data kept in tickets_unpartitioned / check_ins_unpartitioned; drop them once verified")
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        reset_strategy_cache()
+        print(f"❌ Partitioning failed: {e}")
+        raise e
+        
+    finally:
+        release_db_connection(conn)
+
+def create_shard_directory():
+    """
+    event_id -> shard directory on the home database. Its sequence hands out
+    event ids for every shard; events that already exist stay on shard 0.
+    """
+    conn = get_db_connection()
+    conn.autocommit = False
+    
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS event_shards (
+                event_id SERIAL PRIMARY KEY,
+                shard INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_event_shards_shard ON event_shards (shard)')
+        cur.execute('INSERT INTO event_shards (event_id, shard) SELECT id, 0 FROM events ON CONFLICT DO NOTHING')
+        cur.execute('''
+            SELECT setval(pg_get_serial_sequence('event_shards', 'event_id'),
+                          GREATEST((SELECT COALESCE(MAX(event_id), 0) FROM event_shards),
+                                   (SELECT COALESCE(MAX(id), 0) FROM events), 1))
+        ''')
+        conn.commit()
+        cur.close()
+        print("✅ Shard directory ready")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Shard directory failed: {e}")
+        raise e
+        
+    finally:
+        release_db_connection(conn)
+
+def prepare_shard(shard):
+    """
+    Create the schema on a shard, move its tickets id sequence into the
+    shard's own id range and copy the users table over from home.
+    """
+    from shards import SHARD_ID_SPAN
+    
+    create_tables(shard=shard)
+    
+    home = get_db_connection()
+    conn = get_db_connection(shard=shard)
+    
+    try:
+        with home.cursor() as home_cur:
+            home_cur.execute('SELECT id, email, password_hash, full_name, role, created_at FROM users')
+            users = home_cur.fetchall()
+        home.rollback()
+        
+        cur = conn.cursor()
+        cur.execute("SELECT pg_get_serial_sequence('tickets', 'id')")
+        sequence = cur.fetchone()[0]
+        cur.execute(f'SELECT setval(%s, GREATEST((SELECT last_value FROM {sequence}), %s))',
+                    (sequence, shard * SHARD_ID_SPAN))
+        if users:
+            execute_values(cur, '''
+                INSERT INTO users (id, email, password_hash, full_name, role, created_at)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE SET
+                    email = EXCLUDED.email,
+                    password_hash = EXCLUDED.password_hash,
+                    full_name = EXCLUDED.full_name,
+                    role = EXCLUDED.role
+            ''', users)
+        conn.commit()
+        cur.close()
+        print(f"✅ Shard {shard} ready ({len(users)} users copied)")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Preparing shard {shard} failed: {e}")
+        raise e
+        
+    finally:
+        release_db_connection(home)
+        release_db_connection(conn)
+
 if __name__ == '__main__':
+    import sys
+    import logging
+    
+    # Pool and query messages from db.py come through logging
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     # Print database URL for verification (first 50 chars only)
     db_url = os.getenv('DATABASE_URL', '')
     if db_url:
@@ -116,3 +564,21 @@ if __name__ == '__main__':
         exit(1)
     
     create_tables()
+    
+    if '--backfill-qr-digest' in sys.argv:
+        backfill_qr_digest()
+    
+    # e.g. --partition list   or   --partition hash --partitions 32
+    if '--partition' in sys.argv:
+        strategy = sys.argv[sys.argv.index('--partition') + 1]
+        partitions = 16
+        if '--partitions' in sys.argv:
+            partitions = int(sys.argv[sys.argv.index('--partitions') + 1])
+        partition_tables(strategy, partitions)
+    
+    # Run again whenever SHARD_DATABASE_URLS grows or users change outside the app
+    if '--shards' in sys.argv:
+        from db import SHARD_DATABASE_URLS
+        create_shard_directory()
+        for shard in range(1, len(SHARD_DATABASE_URLS) + 1):
+            prepare_shard(shard)
@@ -0,0 +1,145 @@
+"""
+Helpers for tickets / check_ins partitioned by event_id.
+
+database/migrate.py --partition converts the two tables into LIST (one
+partition per event plus a default) or HASH (fixed number of buckets)
+partitioned tables. With LIST partitioning an event's rows live in their
+own tables, so deleting or archiving an event drops two small tables
+instead of deleting rows one by one.
+
+Everything here works on a cursor handed in by the caller, so it can run
+inside the caller's transaction and be imported both by the app and by
+migrate.py when that is run as a script.
+
+The strategy is cached per server for PARTITION_STRATEGY_TTL_SECONDS, so a
+running app notices a later `migrate.py --partition` within that time.
+
+Creating or dropping a partition takes ACCESS EXCLUSIVE on the parent
+tickets / check_ins, and every scanner query queues behind a DDL statement
+that waits for it. So partition DDL runs under a short lock_timeout and is
+retried with backoff (retry_on_lock_timeout) instead of waiting.
+"""
+import os
+import time
+import random
+import psycopg2.errors
+
+PARTITIONED_TABLES = ('tickets', 'check_ins')
+STRATEGY_TTL_SECONDS = float(os.getenv('PARTITION_STRATEGY_TTL_SECONDS', '60'))
+# create_event runs inside an admin request, so it gives up sooner than the drop jobs
+CREATE_LOCK_TIMEOUT = os.getenv('PARTITION_CREATE_LOCK_TIMEOUT', '100ms')
+CREATE_LOCK_ATTEMPTS = int(os.getenv('PARTITION_CREATE_LOCK_ATTEMPTS', '5'))
+
+_strategy_cache = {}
+
+
+class PartitionLockBusy(Exception):
+    """The parent tables stayed locked through every attempt; retry later"""
+
+
+def partition_strategy(cur, table='tickets'):
+    """'list', 'hash' or None if the table is not partitioned"""
+    # Keyed by server as well: shards are migrated independently
+    key = (cur.connection.dsn, table)
+    cached = _strategy_cache.get(key)
+    if cached is not None and time.monotonic() - cached[1] < STRATEGY_TTL_SECONDS:
+        return cached[0]
+
+    cur.execute('''
+        SELECT p.partstrat
+        FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace
+    ''', (table,))
+    row = cur.fetchone()
+    if row is None:
+        strategy = None
+    else:
+        value = row['partstrat'] if isinstance(row, dict) else row[0]
+        strategy = {'l': 'list', 'h': 'hash'}.get(value)
+
+    _strategy_cache[key] = (strategy, time.monotonic())
+    return strategy
+
+
+def reset_strategy_cache():
+    _strategy_cache.clear()
+
+
+def event_partition_name(table, event_id):
+    return f"{table}_e{int(event_id)}"
+
+
+def _table_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (f'public.{name}',))
+    row = cur.fetchone()
+    return row['present'] if isinstance(row, dict) else row[0]
+
+
+def retry_on_lock_timeout(cur, action, attempts, max_pause=2.0):
+    """
+    Run action() in a savepoint, under the lock_timeout the caller has set,
+    retrying with jittered exponential backoff while it times out. Returns
+    what action returns. Raises PartitionLockBusy after the last attempt,
+    with the caller's transaction still usable.
+    """
+    for attempt in range(attempts):
+        cur.execute('SAVEPOINT partition_lock')
+        try:
+            result = action()
+        except psycopg2.errors.LockNotAvailable:
+            cur.execute('ROLLBACK TO SAVEPOINT partition_lock')
+            if attempt + 1 < attempts:
+                time.sleep(min(max_pause, 0.05 * 2 ** attempt) * random.uniform(0.5, 1))
+            continue
+        cur.execute('RELEASE SAVEPOINT partition_lock')
+        return result
+    raise PartitionLockBusy()
+
+
+def create_event_partitions(cur, event_id):
+    """
+    Give a new event its own tickets/check_ins partitions (LIST partitioning
+    only). Waits at most CREATE_LOCK_TIMEOUT per attempt for the parent
+    locks; raises PartitionLockBusy when they stay busy.
+    """
+    if partition_strategy(cur) != 'list':
+        return False
+
+    def create():
+        for table in PARTITIONED_TABLES:
+            cur.execute(f'''
+                CREATE TABLE IF NOT EXISTS {event_partition_name(table, event_id)}
+                PARTITION OF {table} FOR VALUES IN ({int(event_id)})
+            ''')
+
+    cur.execute('SET LOCAL lock_timeout = %s', (CREATE_LOCK_TIMEOUT,))
+    retry_on_lock_timeout(cur, create, CREATE_LOCK_ATTEMPTS)
+    # The rest of the caller's transaction waits as usual
+    cur.execute('SET LOCAL lock_timeout TO DEFAULT')
+    return True
+
+
+def has_event_partitions(cur, event_id):
+    if partition_strategy(cur) != 'list':
+        return False
+    return _table_exists(cur, event_partition_name('tickets', event_id))
+
+
+def drop_event_partitions(cur, event_id):
+    """
+    Drop an event's partitions in the caller's transaction. check_ins goes
+    first because its foreign key points at the tickets partition.
+    Returns (check_ins dropped, tickets dropped) row counts.
+    """
+    counts = []
+    for table in ('check_ins', 'tickets'):
+        name = event_partition_name(table, event_id)
+        if not _table_exists(cur, name):
+            counts.append(0)
+            continue
+        cur.execute(f'SELECT COUNT(*) AS count FROM {name}')
+        row = cur.fetchone()
+        counts.append(row['count'] if isinstance(row, dict) else row[0])
+        cur.execute(f'DROP TABLE {name}')
+    return tuple(counts)
@@ -0,0 +1,150 @@
+"""
+Per-request query accounting, statement timeouts and the slow-query log.
+
+Every pool in database/db.py opens its connections as
+InstrumentedConnection, so every cursor (execute_query and the hand-rolled
+cursor code in the routes alike) times its execute() calls. Inside a
+request the totals go on flask.g and come back out as a Server-Timing
+header (see app.py); outside a request only the slow-query log applies.
+
+Statement timeouts are per request: connections checked out inside a
+request get DB_STATEMENT_TIMEOUT_MS unless the route asks for something
+else with @statement_timeout(ms). Scripts and background jobs run without
+one, as before.
+"""
+import os
+import re
+import time
+import logging
+from functools import wraps
+from flask import g, has_request_context
+from psycopg2.extensions import connection as _pg_connection, cursor as _pg_cursor
+
+logger = logging.getLogger(__name__)
+
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '10000'))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+# Requests issuing more queries than this get logged (think N+1)
+DB_QUERY_BUDGET = int(os.getenv('DB_QUERY_BUDGET', '50'))
+
+# Callbacks (query, seconds, rows) for every timed statement; metrics.py
+# and profiling.py subscribe
+query_observers = []
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(query):
+    """One-line SQL with literals and placeholders replaced by ?, so similar queries group together"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    query = _STRING_LITERAL.sub('?', query)
+    query = _NUMBER_LITERAL.sub('?', query)
+    query = _PLACEHOLDER.sub('?', query)
+    return _WHITESPACE.sub(' ', query).strip()[:500]
+
+
+def record_query(query, seconds, rows):
+    ms = seconds * 1000
+
+    for observer in query_observers:
+        observer(query, seconds, rows)
+
+    if has_request_context():
+        stats = g.get('db_stats')
+        if stats is None:
+            stats = g.db_stats = {'queries': 0, 'rows': 0, 'ms': 0.0}
+        stats['queries'] += 1
+        stats['rows'] += max(rows, 0)
+        stats['ms'] += ms
+
+    if ms >= SLOW_QUERY_MS:
+        logger.warning("Slow query", extra={
+            'duration_ms': round(ms, 1), 'rows': max(rows, 0), 'sql': normalize_sql(query)
+        })
+
+
+def request_stats():
+    """Query totals for the current request"""
+    return g.get('db_stats') or {'queries': 0, 'rows': 0, 'ms': 0.0}
+
+
+_timed_cursor_classes = {}
+
+
+def _timed(factory):
+    """Subclass of a cursor class whose execute/executemany report to record_query"""
+    cls = _timed_cursor_classes.get(factory)
+    if cls is not None:
+        return cls
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return factory.execute(self, query, vars)
+        finally:
+            record_query(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return factory.executemany(self, query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - start, self.rowcount)
+
+    cls = type(f'Timed{factory.__name__}', (factory,), {'execute': execute, 'executemany': executemany})
+    _timed_cursor_classes[factory] = cls
+    return cls
+
+
+class InstrumentedConnection(_pg_connection):
+    """psycopg2 connection whose cursors are timed; pass as connection_factory"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statement_timeout_ms = 0
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or _pg_cursor
+        kwargs['cursor_factory'] = _timed(factory)
+        return super().cursor(*args, **kwargs)
+
+
+def statement_timeout(ms):
+    """Route decorator: statement timeout for connections checked out by this request"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            g.statement_timeout_ms = ms
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def apply_statement_timeout(conn):
+    """Bring a freshly checked-out connection's statement_timeout in line with the current request"""
+    if has_request_context():
+        wanted = g.get('statement_timeout_ms', DB_STATEMENT_TIMEOUT_MS)
+    else:
+        wanted = 0
+
+    if getattr(conn, 'statement_timeout_ms', wanted) == wanted:
+        return
+
+    with conn.cursor() as cur:
+        cur.execute('SET statement_timeout = %s', (int(wanted),))
+    conn.commit()
+    conn.statement_timeout_ms = wanted
+
+
+def server_timing_header(total_ms):
+    stats = request_stats()
+    return (
+        f'db;dur={stats["ms"]:.1f};desc="{stats["queries"]} queries, {stats["rows"]} rows", '
+        f'app;dur={total_ms:.1f}'
+    )
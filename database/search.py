@@ -0,0 +1,209 @@
+"""
+Attendee search for the door: partial name, email, phone or ticket number.
+
+Door staff use it when a guest has no QR code to show. All four fields go
+into one lower-cased search document per ticket. The phone number goes in
+as digits only, so "0803 123 4567", "+234 803 123 4567" and "803-123-4567"
+all reach the same text. A GIN trigram index (pg_trgm) covers that document,
+together with event_id (btree_gin), so a search never leaves its event:
+
+    idx_tickets_search ON tickets USING gin (event_id, (<document>) gin_trgm_ops)
+
+A search for an event runs two statements:
+
+  1. an exact ticket number, up to SEARCH_CANDIDATES word-prefix matches
+     (LIKE 'q%' or LIKE '% q%'), and up to SEARCH_CANDIDATES substring
+     matches (LIKE '%q%'). Ranked by exact number, then word prefix, then
+     substring, then trigram word_similarity. The word-prefix branch has its
+     own limit because the substring branch reads the index in no particular
+     order: on a large event, the best hits could otherwise fall outside it.
+  2. only when 1 found fewer than the limit: typo-tolerant matches with the
+     pg_trgm `<%` operator (word_similarity above
+     pg_trgm.word_similarity_threshold, 0.6 by default). Ranked by
+     similarity.
+
+Both statements read a bounded number of index matches before ranking, so
+their cost does not grow with the size of the event. Only the hot tickets
+table is searched, because archived events are not scanned any more.
+
+The queries are written for psycopg2 (%(name)s). as_asyncpg() rewrites them
+for the async scanner app. Like partitions.py, the index helper works on a
+cursor handed in by the caller, so migrate.py can use it as a script.
+"""
+import re
+from collections import namedtuple
+
+MIN_QUERY_LENGTH = 3
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+# Substring / fuzzy matches read from the index before ranking
+SEARCH_CANDIDATES = 200
+
+SEARCH_DOCUMENT = (
+    "lower(recipient_name || ' ' || recipient_email || ' ' || ticket_number || ' ' || "
+    "coalesce(regexp_replace(recipient_phone, '[^0-9]', '', 'g'), ''))"
+)
+
+_PHONE_LIKE = re.compile(r'^[0-9+()\-.\s]+$')
+
+Search = namedtuple('Search', 'event_id text ticket_number limit')
+
+_RESULT_COLUMNS = '''
+    t.id, t.ticket_number, t.recipient_name, t.recipient_email, t.recipient_phone,
+    t.status, t.ticket_type_id, tt.name as ticket_type
+'''
+
+SEARCH_QUERY = f'''
+    SELECT {_RESULT_COLUMNS}
+    FROM (
+        SELECT DISTINCT ON (id) id, tier, score
+        FROM (
+            (SELECT id, 0 AS tier, 1.0::real AS score
+             FROM tickets
+             WHERE event_id = %(event_id)s AND ticket_number = %(ticket_number)s)
+            UNION ALL
+            SELECT id, 1, word_similarity(%(text)s, document)
+            FROM (
+                SELECT id, {SEARCH_DOCUMENT} AS document
+                FROM tickets
+                WHERE event_id = %(event_id)s
+                  AND ({SEARCH_DOCUMENT} LIKE %(prefix)s OR {SEARCH_DOCUMENT} LIKE %(word_prefix)s)
+                LIMIT %(candidates)s
+            ) word_prefix_matches
+            UNION ALL
+            SELECT id,
+                   CASE WHEN document LIKE %(prefix)s OR document LIKE %(word_prefix)s THEN 1 ELSE 2 END,
+                   word_similarity(%(text)s, document)
+            FROM (
+                SELECT id, {SEARCH_DOCUMENT} AS document
+                FROM tickets
+                WHERE event_id = %(event_id)s AND {SEARCH_DOCUMENT} LIKE %(contains)s
+                LIMIT %(candidates)s
+            ) substring_matches
+        ) matches
+        ORDER BY id, tier
+    ) ranked
+    JOIN tickets t ON t.event_id = %(event_id)s AND t.id = ranked.id
+    JOIN ticket_types tt ON tt.id = t.ticket_type_id
+    ORDER BY ranked.tier, ranked.score DESC, t.recipient_name
+    LIMIT %(limit)s
+'''
+
+FUZZY_SEARCH_QUERY = f'''
+    SELECT {_RESULT_COLUMNS}
+    FROM (
+        SELECT id, word_similarity(%(text)s, document) AS score
+        FROM (
+            SELECT id, {SEARCH_DOCUMENT} AS document
+            FROM tickets
+            WHERE event_id = %(event_id)s AND %(text)s <%% {SEARCH_DOCUMENT}
+            LIMIT %(candidates)s
+        ) fuzzy_matches
+    ) ranked
+    JOIN tickets t ON t.event_id = %(event_id)s AND t.id = ranked.id
+    JOIN ticket_types tt ON tt.id = t.ticket_type_id
+    ORDER BY ranked.score DESC, t.recipient_name
+    LIMIT %(limit)s
+'''
+
+
+def parse_search(event_id, q, limit=None):
+    """A Search from request arguments. Raises ValueError with a message for the client."""
+    try:
+        event_id = int(event_id)
+    except (TypeError, ValueError):
+        raise ValueError('eventId is required')
+
+    if limit in (None, ''):
+        limit = DEFAULT_LIMIT
+    else:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError('limit must be a number')
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        limit = min(limit, MAX_LIMIT)
+
+    raw = ' '.join((q or '').split())
+    text = raw.lower()
+    digits = re.sub(r'[^0-9]', '', raw)
+    if _PHONE_LIKE.match(raw) and len(digits) >= MIN_QUERY_LENGTH:
+        # Stored numbers are local (0803...) or international (+234803...)
+        text = digits.lstrip('0')
+        if text.startswith('234') and len(text) > 10:
+            text = text[3:]
+
+    if len(text) < MIN_QUERY_LENGTH:
+        raise ValueError(f'q must be at least {MIN_QUERY_LENGTH} characters')
+
+    return Search(event_id, text, raw.upper(), limit)
+
+
+def search_params(search):
+    """Named parameters for SEARCH_QUERY / FUZZY_SEARCH_QUERY"""
+    pattern = _escape_like(search.text)
+    return {
+        'event_id': search.event_id,
+        'ticket_number': search.ticket_number,
+        'text': search.text,
+        'contains': f'%{pattern}%',
+        'prefix': f'{pattern}%',
+        'word_prefix': f'% {pattern}%',
+        'candidates': SEARCH_CANDIDATES,
+        'limit': search.limit,
+    }
+
+
+def merge_results(first, fuzzy, limit):
+    """The first statement's rows, topped up with fuzzy rows not already in them"""
+    seen = {row['id'] for row in first}
+    merged = list(first)
+    for row in fuzzy:
+        if len(merged) >= limit:
+            break
+        if row['id'] not in seen:
+            seen.add(row['id'])
+            merged.append(row)
+    return merged
+
+
+def as_asyncpg(query, params):
+    """(query, args) with %(name)s placeholders rewritten to asyncpg's $n"""
+    names = []
+
+    def placeholder(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f'${names.index(name) + 1}'
+
+    query = re.sub(r'%\((\w+)\)s', placeholder, query).replace('%%', '%')
+    return query, [params[name] for name in names]
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def create_search_indexes(cur):
+    """
+    Enable pg_trgm / btree_gin and create the search index. Returns False,
+    leaving the transaction usable, when the extensions can't be created
+    (the database user needs CREATE on the database, or a superuser has to
+    create them once).
+    """
+    cur.execute('SAVEPOINT search_extensions')
+    try:
+        cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cur.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    except Exception:
+        cur.execute('ROLLBACK TO SAVEPOINT search_extensions')
+        return False
+    cur.execute('RELEASE SAVEPOINT search_extensions')
+
+    cur.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_tickets_search
+        ON tickets USING gin (event_id, ({SEARCH_DOCUMENT}) gin_trgm_ops)
+    ''')
+    return True
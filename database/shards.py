@@ -0,0 +1,173 @@
+"""
+Event-level sharding.
+
+With SHARD_DATABASE_URLS set, every event lives on exactly one Postgres
+node together with its ticket types, tickets, check-ins, archive rows and
+background jobs, so ticket and scanner requests touch a single node and
+never join across nodes. Shard 0 is DATABASE_URL: it also holds the users
+table (copied to the other shards so scanner/creator joins stay local) and
+the event_shards directory, whose sequence hands out globally unique event
+ids.
+
+How a request finds its shard without asking anyone:
+  * event id     -> event_shards directory, cached forever (events never move)
+  * ticket id    -> id // SHARD_ID_SPAN (each shard's tickets sequence starts
+                    at shard * SHARD_ID_SPAN, see migrate.py --shards)
+  * ticket number / QR payload -> the "TKT-S<shard>-" prefix
+
+Tickets created before sharding was switched on live on shard 0 and carry
+no prefix, which is exactly what the fallbacks below assume.
+
+Without SHARD_DATABASE_URLS everything here resolves to shard 0 and the app
+behaves as a single-node deployment.
+"""
+import re
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from db import execute_query, execute_rows, SHARD_DATABASE_URLS
+except ImportError:
+    from database.db import execute_query, execute_rows, SHARD_DATABASE_URLS
+
+SHARD_ID_SPAN = 100_000_000
+
+_TICKET_NUMBER_SHARD = re.compile(r'^TKT-S(\d+)-')
+
+_event_shards = {}
+_allocate_lock = threading.Lock()
+
+
+def sharding_enabled():
+    return bool(SHARD_DATABASE_URLS)
+
+
+def shard_count():
+    return 1 + len(SHARD_DATABASE_URLS)
+
+
+def all_shards():
+    return list(range(shard_count()))
+
+
+def _valid(shard):
+    return shard if 0 <= shard < shard_count() else 0
+
+
+def shard_for_event(event_id):
+    if not sharding_enabled() or event_id is None:
+        return 0
+
+    event_id = int(event_id)
+    if event_id in _event_shards:
+        return _event_shards[event_id]
+
+    rows = execute_query('SELECT shard FROM event_shards WHERE event_id = %s', (event_id,))
+    if not rows:
+        # Unknown ids are not cached: the id may simply not be allocated yet
+        return 0
+
+    shard = _valid(rows[0]['shard'])
+    _event_shards[event_id] = shard
+    return shard
+
+
+def shard_for_ticket_id(ticket_id):
+    if not sharding_enabled() or ticket_id is None:
+        return 0
+    return _valid(int(ticket_id) // SHARD_ID_SPAN)
+
+
+def shard_for_ticket_number(ticket_number):
+    if not sharding_enabled() or not ticket_number:
+        return 0
+    match = _TICKET_NUMBER_SHARD.match(ticket_number)
+    return _valid(int(match.group(1))) if match else 0
+
+
+def shard_for_qr_payload(qr_payload):
+    return shard_for_ticket_number((qr_payload or '').split('|', 1)[0])
+
+
+def allocate_event():
+    """
+    Reserve a new event id on the home shard and place the event on the
+    shard with the fewest events. Returns (event_id, shard).
+    """
+    with _allocate_lock:
+        load = {shard: 0 for shard in all_shards()}
+        for row in execute_query('SELECT shard, COUNT(*) AS events FROM event_shards GROUP BY shard'):
+            if row['shard'] in load:
+                load[row['shard']] = row['events']
+        shard = min(load, key=lambda s: (load[s], s))
+
+        rows = execute_query('INSERT INTO event_shards (shard) VALUES (%s) RETURNING event_id', (shard,))
+
+    event_id = rows[0]['event_id']
+    _event_shards[event_id] = shard
+    return event_id, shard
+
+
+def release_event(event_id):
+    """Drop a deleted event from the directory"""
+    if not sharding_enabled():
+        return
+    execute_query('DELETE FROM event_shards WHERE event_id = %s', (event_id,), fetch=False)
+    _event_shards.pop(int(event_id), None)
+
+
+def fan_out(query, params=None, intent='read'):
+    """Run the same query on every shard in parallel and concatenate the rows"""
+    if not sharding_enabled():
+        return execute_query(query, params, intent=intent) or []
+
+    def run(shard):
+        return execute_query(query, params, intent=intent, shard=shard) or []
+
+    results = _on_every_shard(run)
+    return [row for rows in results for row in rows]
+
+
+def fan_out_rows(query, params=None, intent='read'):
+    """fan_out for execute_rows: (column names, every shard's tuple rows)"""
+    if not sharding_enabled():
+        return execute_rows(query, params, intent=intent)
+
+    results = _on_every_shard(lambda shard: execute_rows(query, params, intent=intent, shard=shard))
+    return results[0][0], [row for _, rows in results for row in rows]
+
+
+def _on_every_shard(run):
+    """run(shard) for every shard in parallel; the results in shard order"""
+    # One context copy per shard so the request's statement timeout and
+    # query counters follow the query into the worker threads
+    contexts = [contextvars.copy_context() for _ in all_shards()]
+    with ThreadPoolExecutor(max_workers=shard_count()) as pool:
+        return list(pool.map(lambda ctx, shard: ctx.run(run, shard), contexts, all_shards()))
+
+
+def replicate_user(user_id):
+    """Copy a user row from the home shard to every other shard"""
+    if not sharding_enabled():
+        return
+
+    rows = execute_query('''
+        SELECT id, email, password_hash, full_name, role, created_at
+        FROM users WHERE id = %s
+    ''', (user_id,))
+    if not rows:
+        return
+
+    user = rows[0]
+    for shard in all_shards()[1:]:
+        execute_query('''
+            INSERT INTO users (id, email, password_hash, full_name, role, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO UPDATE SET
+                email = EXCLUDED.email,
+                password_hash = EXCLUDED.password_hash,
+                full_name = EXCLUDED.full_name,
+                role = EXCLUDED.role
+        ''', (user['id'], user['email'], user['password_hash'], user['full_name'],
+              user['role'], user['created_at']), fetch=False, shard=shard)
@@ -1,41 +1,28 @@
 import os
-import requests
+import time
+import base64
+import logging
 from dotenv import load_dotenv
+import metrics
+import tracing
 
 load_dotenv()
 
-def send_ticket_email(
-    recipient_email,
+logger = logging.getLogger(__name__)
+
+# Override to point at a local stand-in (loadtest/resend_stub.py) for load tests
+RESEND_API_URL = os.getenv('RESEND_API_URL', 'https://api.resend.com/emails')
+
+def render_ticket_email_html(
     recipient_name,
     event_name,
     event_date,
     event_location,
     ticket_number,
-    ticket_type,
-    qr_code_base64,
-    ticket_bg_image=None
+    ticket_type
 ):
-    """Send ticket email with embedded QR code"""
-    
-    api_key = os.getenv('RESEND_API_KEY')
-    from_email = os.getenv('EMAIL_FROM')
-    
-    print(f"\nSending ticket to: {recipient_email}")
-    print(f"Ticket number: {ticket_number}")
-    
-    if not api_key or not from_email:
-        print("ERROR: Email not configured")
-        return False
-    
-    try:
-        # Clean base64 data
-        if 'base64,' in qr_code_base64:
-            qr_data = qr_code_base64.split('base64,')[1]
-        else:
-            qr_data = qr_code_base64
-        
-        # Create ticket card HTML with cid reference
-        html_content = f"""
+    """Ticket card HTML; the QR code is referenced as the inline attachment cid:qrcode"""
+    return f"""
         <!DOCTYPE html>
         <html>
         <head>
@@ -152,8 +139,45 @@ def send_ticket_email(
         </body>
         </html>
         """
+
+@tracing.traced('send_ticket_email', 'email')
+def send_ticket_email(
+    recipient_email,
+    recipient_name,
+    event_name,
+    event_date,
+    event_location,
+    ticket_number,
+    ticket_type,
+    qr_code_base64,
+    ticket_bg_image=None,
+    pdf_path=None
+):
+    """Send ticket email with embedded QR code, and the ticket PDF attached when pdf_path is given"""
+    
+    api_key = os.getenv('RESEND_API_KEY')
+    from_email = os.getenv('EMAIL_FROM')
+    
+    # Deferred: requests is one of the slowest imports at startup and only this path needs it
+    import requests
+    
+    if not api_key or not from_email:
+        logger.error("Email not configured, ticket %s not sent", ticket_number)
+        metrics.EMAILS.labels('not_configured').inc()
+        return False
+    
+    started = None
+    try:
+        # Clean base64 data
+        if 'base64,' in qr_code_base64:
+            qr_data = qr_code_base64.split('base64,')[1]
+        else:
+            qr_data = qr_code_base64
         
-        url = "https://api.resend.com/emails"
+        # Create ticket card HTML with cid reference
+        html_content = render_ticket_email_html(
+            recipient_name, event_name, event_date, event_location, ticket_number, ticket_type
+        )
         
         headers = {
             "Authorization": f"Bearer {api_key}",
@@ -175,21 +199,37 @@ def send_ticket_email(
             ]
         }
         
-        print(f"Calling Resend API with QR attachment...")
-        response = requests.post(url, json=data, headers=headers, timeout=15)
+        if pdf_path:
+            with open(pdf_path, 'rb') as f:
+                data["attachments"].append({
+                    "filename": f"{ticket_number}.pdf",
+                    "content": base64.b64encode(f.read()).decode()
+                })
         
-        print(f"Status: {response.status_code}")
-        print(f"Response: {response.text}")
+        started = time.perf_counter()
+        with tracing.span('resend.post', 'email'):
+            response = requests.post(RESEND_API_URL, json=data, headers=headers, timeout=15)
+        outcome = 'sent' if response.status_code in [200, 201] else 'rejected'
+        metrics.EMAIL_SEND_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+        metrics.EMAILS.labels(outcome).inc()
         
         if response.status_code in [200, 201]:
-            print(f"SUCCESS: Ticket sent to {recipient_email}")
+            logger.info("Ticket email sent", extra={
+                'ticket_number': ticket_number,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            })
             return True
         else:
-            print(f"FAILED: {response.status_code} - {response.text}")
+            logger.warning("Ticket email rejected by provider", extra={
+                'ticket_number': ticket_number,
+                'status': response.status_code,
+                'error': response.text[:200]
+            })
             return False
         
     except Exception as e:
-        print(f"ERROR: {e}")
-        import traceback
-        traceback.print_exc()
+        if started is not None:
+            metrics.EMAIL_SEND_SECONDS.labels('error').observe(time.perf_counter() - started)
+        metrics.EMAILS.labels('error').inc()
+        logger.exception("Ticket email failed for %s", ticket_number)
         return False
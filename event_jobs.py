@@ -0,0 +1,493 @@
+"""
+Background jobs that work through a whole event's rows: chunked deletion,
+hot/cold archival and rendering the event's ticket PDFs.
+
+Deleting a big event in one transaction holds locks on tickets/check_ins
+and writes one huge WAL burst while scanners at other events are busy.
+Instead delete_event marks the event 'deleting', records a row in
+event_jobs and returns; a background thread then removes child rows in
+bounded batches, committing (and recording progress) after each one.
+
+Archival moves a closed event's tickets and check-ins into the compact
+tickets_archive / check_ins_archive tables in the same batched way, so
+the hot tables (and their indexes) only hold upcoming and running events.
+Reads go through the tickets_all / check_ins_all views, and listings use
+the per-event counts snapshotted in event_archive_stats. It runs when
+close_event is called with ARCHIVE_ON_CLOSE=true, and, when
+ARCHIVE_RETENTION_DAYS is set, for closed events that took place more than
+that many days ago (queued on worker start, or by running this module
+from cron).
+
+PDF rendering (render_pdfs) stores a PDF for every ticket of an event; see
+ticket_pdfs.py. Its progress is in tickets_done.
+
+Jobs survive crashes: every worker calls resume_pending_jobs() once, and a
+Postgres advisory lock per job makes sure only one process runs it.
+
+With sharding a job row lives on its event's shard next to the rows it
+works through, so job ids are only unique per shard and every function
+here carries the shard along with the id.
+"""
+import os
+import time
+import logging
+import threading
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from database.db import get_db_connection, release_db_connection, execute_query
+from database.partitions import (
+    has_event_partitions, drop_event_partitions, event_partition_name, retry_on_lock_timeout, PartitionLockBusy
+)
+from database.shards import all_shards, shard_for_event, release_event, fan_out
+import checkin_journal
+import validation_index
+import ticket_pdfs
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv('EVENT_JOB_BATCH_SIZE', '2000'))
+BATCH_PAUSE = float(os.getenv('EVENT_JOB_BATCH_PAUSE', '0.05'))
+# Dropping a partition takes ACCESS EXCLUSIVE on the parent tickets/check_ins, and
+# every scanner query queues behind the waiting request. So each attempt waits
+# only briefly, then backs off and retries; after the last attempt the batched
+# deletes do the work.
+PARTITION_LOCK_TIMEOUT = os.getenv('EVENT_JOB_PARTITION_LOCK_TIMEOUT', '100ms')
+PARTITION_LOCK_ATTEMPTS = int(os.getenv('EVENT_JOB_PARTITION_LOCK_ATTEMPTS', '20'))
+PARTITION_RETRY_MAX_PAUSE = float(os.getenv('EVENT_JOB_PARTITION_RETRY_MAX_PAUSE', '2'))
+ARCHIVE_ON_CLOSE = os.getenv('ARCHIVE_ON_CLOSE', 'false').lower() == 'true'
+# Closed events whose date is older than this are archived; 0 (the default) disables it
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS') or '0')
+
+# First key of the two-int advisory lock, so job locks never clash with other users
+ADVISORY_LOCK_NAMESPACE = 9090
+
+JOB_COLUMNS = '''
+    id, event_id, event_name, job_type, status,
+    checkins_done, tickets_done, ticket_types_done,
+    error, created_at, updated_at, finished_at
+'''
+
+
+def start_delete(event_id):
+    """Mark an event as deleting and queue its deletion job. Returns the job, or None if no such event."""
+    shard = shard_for_event(event_id)
+    conn = get_db_connection(shard=shard)
+    conn.autocommit = False
+
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute('SELECT name FROM events WHERE id = %s FOR UPDATE', (event_id,))
+            event = cur.fetchone()
+
+            if not event:
+                conn.rollback()
+                return None
+
+            cur.execute("UPDATE events SET status = 'deleting' WHERE id = %s", (event_id,))
+
+            # Re-deleting an event that is already being deleted returns the running job
+            cur.execute(f'''
+                SELECT {JOB_COLUMNS} FROM event_jobs
+                WHERE event_id = %s AND job_type = 'delete' AND status IN ('pending', 'running')
+            ''', (event_id,))
+            job = cur.fetchone()
+
+            if not job:
+                cur.execute(f'''
+                    INSERT INTO event_jobs (event_id, event_name, job_type, status)
+                    VALUES (%s, %s, 'delete', 'pending')
+                    RETURNING {JOB_COLUMNS}
+                ''', (event_id, event['name']))
+                job = cur.fetchone()
+
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+    # Scanners should stop accepting this event's tickets straight away
+    validation_index.drop_index(event_id)
+
+    _spawn(job['id'], shard)
+    return job
+
+
+def get_latest_job(event_id, job_type):
+    """Most recent job of a type for an event"""
+    job = execute_query(f'''
+        SELECT {JOB_COLUMNS} FROM event_jobs
+        WHERE event_id = %s AND job_type = %s
+        ORDER BY id DESC
+        LIMIT 1
+    ''', (event_id, job_type), shard=shard_for_event(event_id))
+    return job[0] if job else None
+
+
+def resume_pending_jobs():
+    """Pick up jobs left pending or running by a crashed or restarted process"""
+    resumed = 0
+    for shard in all_shards():
+        jobs = execute_query(
+            "SELECT id FROM event_jobs WHERE status IN ('pending', 'running') ORDER BY id",
+            shard=shard
+        ) or []
+
+        for job in jobs:
+            _spawn(job['id'], shard)
+        resumed += len(jobs)
+
+    if resumed:
+        logger.info("Resuming %d event job(s)", resumed)
+
+    queue_due_archives()
+
+
+def _spawn(job_id, shard=0):
+    thread = threading.Thread(target=run_job, args=(job_id, shard), name=f'event-job-{shard}-{job_id}', daemon=True)
+    thread.start()
+
+
+def run_job(job_id, shard=0):
+    """Run a job to completion unless another process already holds it"""
+    lock_conn = get_db_connection(shard=shard)
+    lock_conn.autocommit = True
+
+    try:
+        with lock_conn.cursor() as cur:
+            cur.execute('SELECT pg_try_advisory_lock(%s, %s)', (ADVISORY_LOCK_NAMESPACE, job_id))
+            if not cur.fetchone()[0]:
+                return
+
+        try:
+            job = execute_query(f'SELECT {JOB_COLUMNS} FROM event_jobs WHERE id = %s', (job_id,), shard=shard)
+            if not job or job[0]['status'] not in ('pending', 'running'):
+                return
+            job = dict(job[0], shard=shard)
+
+            _set_status(job_id, 'running', shard=shard)
+            logger.info("Event job %s: %s event %s", job_id, job['job_type'], job['event_id'])
+
+            JOB_RUNNERS[job['job_type']](job)
+
+            _set_status(job_id, 'completed', shard=shard)
+            logger.info("Event job %s completed", job_id)
+
+        except Exception as e:
+            logger.exception("Event job %s failed: %s", job_id, e)
+            _set_status(job_id, 'failed', str(e), shard=shard)
+
+        finally:
+            with lock_conn.cursor() as cur:
+                cur.execute('SELECT pg_advisory_unlock(%s, %s)', (ADVISORY_LOCK_NAMESPACE, job_id))
+
+    finally:
+        lock_conn.autocommit = False
+        release_db_connection(lock_conn)
+
+
+def _set_status(job_id, status, error=None, shard=0):
+    execute_query('''
+        UPDATE event_jobs
+        SET status = %s,
+            error = %s,
+            updated_at = NOW(),
+            finished_at = CASE WHEN %s IN ('completed', 'failed') THEN NOW() ELSE NULL END
+        WHERE id = %s
+    ''', (status, error, status, job_id), fetch=False, shard=shard)
+
+
+def _in_batches(job, progress_column, sql, params):
+    """
+    Repeat a statement LIMITed by %(batch)s until it touches fewer rows than
+    a full batch, committing the job's progress together with each batch.
+    """
+    params = dict(params, batch=BATCH_SIZE)
+
+    while True:
+        conn = get_db_connection(shard=job['shard'])
+        conn.autocommit = False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                affected = cur.rowcount
+
+                cur.execute(f'''
+                    UPDATE event_jobs
+                    SET {progress_column} = {progress_column} + %s, updated_at = NOW()
+                    WHERE id = %s
+                ''', (affected, job['id']))
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            release_db_connection(conn)
+
+        if affected < BATCH_SIZE:
+            return
+
+        time.sleep(BATCH_PAUSE)
+
+
+def _drop_partitions(job, archive=False):
+    """
+    LIST-partitioned fast path: drop the event's own tickets/check_ins
+    partitions (copying their rows to the archive first when archiving) in
+    one transaction. The drop waits at most PARTITION_LOCK_TIMEOUT for the
+    parent locks per attempt, backing off in between. Returns False when
+    there is nothing to drop or the locks stayed busy, in which case the
+    batched path does the work.
+    """
+    event_id = job['event_id']
+    conn = get_db_connection(shard=job['shard'])
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            if not has_event_partitions(cur, event_id):
+                conn.rollback()
+                return False
+
+            cur.execute('SET LOCAL lock_timeout = %s', (PARTITION_LOCK_TIMEOUT,))
+
+            if archive:
+                cur.execute(f'''
+                    INSERT INTO check_ins_archive (id, ticket_id, event_id, scanner_id, check_in_time)
+                    SELECT id, ticket_id, event_id, scanner_id, check_in_time
+                    FROM {event_partition_name('check_ins', event_id)}
+                ''')
+                cur.execute(f'''
+                    INSERT INTO tickets_archive (
+                        id, event_id, ticket_type_id, qr_code, qr_digest, ticket_number,
+                        recipient_name, recipient_email, recipient_phone,
+                        status, email_sent, created_by, created_at, updated_at
+                    )
+                    SELECT id, event_id, ticket_type_id, qr_code, qr_digest, ticket_number,
+                           recipient_name, recipient_email, recipient_phone,
+                           status, email_sent, created_by, created_at, updated_at
+                    FROM {event_partition_name('tickets', event_id)}
+                ''')
+
+            # The archive copy above is kept across attempts
+            try:
+                checkins, tickets = retry_on_lock_timeout(
+                    cur, lambda: drop_event_partitions(cur, event_id),
+                    PARTITION_LOCK_ATTEMPTS, PARTITION_RETRY_MAX_PAUSE
+                )
+            except PartitionLockBusy:
+                conn.rollback()
+                logger.info("Partition locks stayed busy for event %s, using batched path", event_id)
+                return False
+
+            cur.execute('''
+                UPDATE event_jobs
+                SET checkins_done = checkins_done + %s,
+                    tickets_done = tickets_done + %s,
+                    updated_at = NOW()
+                WHERE id = %s
+            ''', (checkins, tickets, job['id']))
+
+        conn.commit()
+        logger.info("Dropped partitions of event %s (%d tickets, %d check-ins)", event_id, tickets, checkins)
+        return True
+
+    except psycopg2.errors.LockNotAvailable:
+        conn.rollback()
+        logger.info("Partition lock busy for event %s, using batched path", event_id)
+        return False
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        release_db_connection(conn)
+
+
+def _run_delete(job):
+    shard = job['shard']
+    params = {'event_id': job['event_id']}
+
+    # 0. Own partitions: dropped whole. The batched steps below then only
+    #    find rows that live in a default/hash partition or unpartitioned table.
+    _drop_partitions(job)
+
+    # 1. Check-ins
+    _in_batches(job, 'checkins_done', '''
+        DELETE FROM check_ins WHERE id IN (
+            SELECT c.id FROM check_ins c
+            JOIN tickets t ON c.ticket_id = t.id
+            WHERE t.event_id = %(event_id)s
+            LIMIT %(batch)s
+        )
+    ''', params)
+    _in_batches(job, 'checkins_done', '''
+        DELETE FROM check_ins_archive WHERE id IN (
+            SELECT id FROM check_ins_archive WHERE event_id = %(event_id)s LIMIT %(batch)s
+        )
+    ''', params)
+
+    # 2. Tickets
+    _in_batches(job, 'tickets_done', '''
+        DELETE FROM tickets WHERE id IN (
+            SELECT id FROM tickets WHERE event_id = %(event_id)s LIMIT %(batch)s
+        )
+    ''', params)
+    _in_batches(job, 'tickets_done', '''
+        DELETE FROM tickets_archive WHERE id IN (
+            SELECT id FROM tickets_archive WHERE event_id = %(event_id)s LIMIT %(batch)s
+        )
+    ''', params)
+
+    # 3. Ticket types
+    _in_batches(job, 'ticket_types_done', '''
+        DELETE FROM ticket_types WHERE id IN (
+            SELECT id FROM ticket_types WHERE event_id = %(event_id)s LIMIT %(batch)s
+        )
+    ''', params)
+
+    # 4. The event itself
+    execute_query('DELETE FROM event_archive_stats WHERE event_id = %s', (job['event_id'],), fetch=False, shard=shard)
+    execute_query('DELETE FROM events WHERE id = %s', (job['event_id'],), fetch=False, shard=shard)
+    release_event(job['event_id'])
+
+    checkin_journal.forget_event(job['event_id'])
+    validation_index.drop_index(job['event_id'])
+    ticket_pdfs.forget_event(job['event_id'])
+
+
+def _run_archive(job):
+    """Move a closed event's tickets and check-ins into the archive tables"""
+    shard = job['shard']
+    event_id = job['event_id']
+    params = {'event_id': event_id}
+
+    event = execute_query('SELECT status FROM events WHERE id = %s', (event_id,), shard=shard)
+    if not event or event[0]['status'] != 'closed':
+        raise Exception(f"Event {event_id} is not closed, not archiving")
+
+    # 0. Own partitions: copied and dropped whole
+    _drop_partitions(job, archive=True)
+
+    # 1. Check-ins: delete and insert in one statement so a row is never in both places
+    _in_batches(job, 'checkins_done', '''
+        WITH moved AS (
+            DELETE FROM check_ins WHERE id IN (
+                SELECT c.id FROM check_ins c
+                JOIN tickets t ON c.ticket_id = t.id
+                WHERE t.event_id = %(event_id)s
+                LIMIT %(batch)s
+            )
+            RETURNING id, ticket_id, scanner_id, check_in_time
+        )
+        INSERT INTO check_ins_archive (id, ticket_id, event_id, scanner_id, check_in_time)
+        SELECT id, ticket_id, %(event_id)s, scanner_id, check_in_time FROM moved
+    ''', params)
+
+    # 2. Tickets, without the bulky per-ticket background image
+    _in_batches(job, 'tickets_done', '''
+        WITH moved AS (
+            DELETE FROM tickets WHERE id IN (
+                SELECT id FROM tickets WHERE event_id = %(event_id)s LIMIT %(batch)s
+            )
+            RETURNING *
+        )
+        INSERT INTO tickets_archive (
+            id, event_id, ticket_type_id, qr_code, qr_digest, ticket_number,
+            recipient_name, recipient_email, recipient_phone,
+            status, email_sent, created_by, created_at, updated_at
+        )
+        SELECT id, event_id, ticket_type_id, qr_code, qr_digest, ticket_number,
+               recipient_name, recipient_email, recipient_phone,
+               status, email_sent, created_by, created_at, updated_at
+        FROM moved
+    ''', params)
+
+    # 3. Listing stats, so get_all_events never has to aggregate the archive
+    execute_query('''
+        INSERT INTO event_archive_stats (
+            event_id, total_tickets_issued, tickets_used, tickets_active, tickets_cancelled,
+            total_revenue, cancelled_revenue
+        )
+        SELECT %s,
+               COUNT(t.id),
+               COUNT(*) FILTER (WHERE t.status = 'used'),
+               COUNT(*) FILTER (WHERE t.status = 'active'),
+               COUNT(*) FILTER (WHERE t.status = 'cancelled'),
+               COALESCE(SUM(tt.price), 0),
+               COALESCE(SUM(tt.price) FILTER (WHERE t.status = 'cancelled'), 0)
+        FROM tickets_archive t
+        LEFT JOIN ticket_types tt ON t.ticket_type_id = tt.id
+        WHERE t.event_id = %s
+        ON CONFLICT (event_id) DO UPDATE SET
+            total_tickets_issued = EXCLUDED.total_tickets_issued,
+            tickets_used = EXCLUDED.tickets_used,
+            tickets_active = EXCLUDED.tickets_active,
+            tickets_cancelled = EXCLUDED.tickets_cancelled,
+            total_revenue = EXCLUDED.total_revenue,
+            cancelled_revenue = EXCLUDED.cancelled_revenue
+    ''', (event_id, event_id), fetch=False, shard=shard)
+
+    execute_query('UPDATE events SET archived_at = NOW() WHERE id = %s', (event_id,), fetch=False, shard=shard)
+
+    checkin_journal.forget_event(event_id)
+    validation_index.drop_index(event_id)
+    ticket_pdfs.forget_event(event_id)
+
+
+def queue_job(event_id, job_type):
+    """Queue a job unless one of the same type is already pending/running. Returns the job id or None."""
+    shard = shard_for_event(event_id)
+    job = execute_query('''
+        INSERT INTO event_jobs (event_id, event_name, job_type, status)
+        SELECT id, name, %s, 'pending' FROM events WHERE id = %s
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    ''', (job_type, event_id), shard=shard)
+
+    if not job:
+        return None
+
+    _spawn(job[0]['id'], shard)
+    return job[0]['id']
+
+
+def queue_due_archives():
+    """Queue archival for events closed longer than the retention window"""
+    if ARCHIVE_RETENTION_DAYS <= 0:
+        return []
+
+    due = fan_out('''
+        SELECT id FROM events
+        WHERE status = 'closed'
+          AND archived_at IS NULL
+          AND event_date < NOW() - make_interval(days => %s)
+    ''', (ARCHIVE_RETENTION_DAYS,), intent='primary')
+
+    return [job_id for job_id in (queue_job(e['id'], 'archive') for e in due) if job_id]
+
+
+JOB_RUNNERS = {
+    'delete': _run_delete,
+    'archive': _run_archive,
+    'render_pdfs': ticket_pdfs.render_event,
+}
+
+
+if __name__ == '__main__':
+    # Cron entry point: queue archival for events past the retention window and run it here
+    from app_logging import configure_logging
+    from database.db import init_db
+    configure_logging()
+    init_db()
+
+    for job in queue_due_archives():
+        logger.info("Queued archive job %s", job)
+
+    for thread in threading.enumerate():
+        if thread.name.startswith('event-job-'):
+            thread.join()
@@ -0,0 +1,75 @@
+"""
+Production gunicorn settings: `gunicorn -c gunicorn.conf.py app:app` (see Procfile).
+
+The app is preloaded in the master, so workers fork with the code already
+imported and share those pages copy-on-write instead of each importing
+it again. The master's DB pools are closed before forking and every
+worker opens its own in post_fork, then checks them before it accepts a
+request. A psycopg2 connection must never be shared across processes.
+
+Worker class (GUNICORN_WORKER_CLASS):
+
+  gthread (default)  WEB_CONCURRENCY processes x GUNICORN_THREADS threads.
+  gevent             Greenlets; needs `pip install gevent psycogreen`.
+                     psycopg2 is made cooperative below, before the app
+                     is preloaded.
+
+Sizing: each process keeps its own DB_POOL_MAX connections per database,
+so workers default to 2 x CPUs + 1 but never more than
+DB_MAX_CONNECTIONS // DB_POOL_MAX (DB_MAX_CONNECTIONS is this app's
+share of Postgres max_connections). A request can hold two connections
+at once (create_ticket), and psycopg2 pools raise instead of waiting, so
+threads and greenlets per worker default to DB_POOL_MAX // 2.
+"""
+import os
+import multiprocessing
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Must run before preload imports psycopg2, requests and friends
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', '100'))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+workers = int(
+    os.getenv('WEB_CONCURRENCY')
+    or max(1, min(multiprocessing.cpu_count() * 2 + 1, DB_MAX_CONNECTIONS // DB_POOL_MAX))
+)
+threads = int(os.getenv('GUNICORN_THREADS') or max(1, DB_POOL_MAX // 2))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS') or max(1, DB_POOL_MAX // 2))
+
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# Set to recycle each worker after that many requests (caps slow leaks); jitter staggers the restarts
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+
+
+def pre_fork(server, worker):
+    # Connections opened while preloading belong to the master; children start clean
+    from database import db
+    db.close_db()
+
+
+def post_fork(server, worker):
+    from database import db
+    db.init_db()
+    db.warm_pools()
+    server.log.info("Worker %s: DB pools ready", worker.pid)
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges from the multiprocess /metrics totals
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,229 @@
+"""
+Upload normalization for banner and ticket background images.
+
+Images arrive as base64 (or data URL) uploads of any size and used to be
+stored and sent on unchanged, often several megabytes per ticket row. On
+ingest (create_event, update_event, create_ticket) they are now decoded,
+checked, and re-encoded into fixed size variants:
+
+  full   at most 1240x1754 (A4 at 150 dpi), JPEG quality 85. This is what
+         the banner_image / ticket_bg_image columns hold. PDFs and emails
+         use it.
+  thumb  at most 400x400, WebP quality 75. Stored for event banners in
+         banner_thumb, for listings and cards.
+
+An upload already within a variant's size and format is kept byte for byte
+rather than re-encoded, so normalizing twice changes nothing and loses no
+quality. Anything that is not a JPEG/PNG/WebP/GIF, or is larger than
+IMAGE_MAX_BYTES decoded or IMAGE_MAX_PIXELS, raises ImageError, and the
+route answers 400.
+
+Rows stored before this keep their original images until
+
+    python image_pipeline.py --backfill
+
+rewrites them, on every shard, once per distinct image.
+"""
+import os
+import base64
+import binascii
+import logging
+from io import BytesIO
+from collections import namedtuple
+import tracing
+
+logger = logging.getLogger(__name__)
+
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(15 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', '50000000'))
+ACCEPTED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+EXIF_ORIENTATION = 0x0112
+
+Variant = namedtuple('Variant', 'width height format quality')
+
+VARIANTS = {
+    'full': Variant(1240, 1754, 'JPEG', 85),
+    'thumb': Variant(400, 400, 'WEBP', 75),
+}
+
+
+class ImageError(ValueError):
+    """An upload that can't be used as an image"""
+
+
+def normalize(data, variants=('full',)):
+    """Variant name -> data URL for a base64 or data URL upload. Raises ImageError."""
+    raw = _decode(data)
+
+    with tracing.span('image.normalize', 'image', bytes=len(raw)):
+        image, image_format, rotated = _open(raw)
+        return {
+            name: _encode(image, image_format, rotated, raw, VARIANTS[name])
+            for name in variants
+        }
+
+
+def _decode(data):
+    if not isinstance(data, str):
+        raise ImageError('Image must be a base64 string')
+
+    encoded = data.split('base64,', 1)[1] if 'base64,' in data else data
+    # base64 is 4 characters per 3 bytes; refuse before decoding anything huge
+    if len(encoded) * 3 // 4 > IMAGE_MAX_BYTES:
+        raise ImageError(f'Image is larger than {IMAGE_MAX_BYTES // (1024 * 1024)} MB')
+
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImageError('Image is not valid base64')
+
+
+def _open(raw):
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(BytesIO(raw))
+    except (UnidentifiedImageError, OSError):
+        raise ImageError('Unrecognized image format')
+
+    if image.format not in ACCEPTED_FORMATS:
+        raise ImageError(f'Unsupported image format {image.format}')
+
+    # Checked from the header, before the pixels are decoded
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise ImageError(f'Image is too large ({image.width}x{image.height})')
+
+    image_format = image.format
+    try:
+        image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageError(f'Image could not be decoded: {e}')
+
+    # Phone photos are often stored sideways with an EXIF hint to rotate them
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+    if rotated:
+        image = ImageOps.exif_transpose(image)
+    return image, image_format, rotated
+
+
+def _encode(image, image_format, rotated, raw, variant):
+    from PIL import Image
+
+    fits = image.width <= variant.width and image.height <= variant.height
+    if fits and image_format == variant.format and not rotated and image.mode in ('RGB', 'L'):
+        return _data_url(variant.format, raw)
+
+    if variant.format == 'JPEG' and image.mode != 'RGB':
+        image = _flatten(image)
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+
+    if not fits:
+        image = image.copy()
+        image.thumbnail((variant.width, variant.height), Image.LANCZOS)
+
+    buffer = BytesIO()
+    if variant.format == 'JPEG':
+        image.save(buffer, format='JPEG', quality=variant.quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format=variant.format, quality=variant.quality, method=4)
+    return _data_url(variant.format, buffer.getvalue())
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _flatten(image):
+    """RGB on a white background, for formats without transparency"""
+    from PIL import Image
+
+    if not _has_alpha(image):
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _data_url(image_format, content):
+    return f'data:image/{image_format.lower()};base64,' + base64.b64encode(content).decode()
+
+
+def backfill(shard):
+    """Normalize one shard's stored banners and ticket backgrounds; returns (events, tickets) rewritten"""
+    from database.db import execute_query
+
+    events = 0
+    last_id = 0
+    while True:
+        rows = execute_query('''
+            SELECT id, banner_image FROM events
+            WHERE id > %s AND banner_image IS NOT NULL AND banner_thumb IS NULL
+            ORDER BY id
+            LIMIT 100
+        ''', (last_id,), shard=shard) or []
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row['id']
+            try:
+                images = normalize(row['banner_image'], ('full', 'thumb'))
+            except ImageError as e:
+                logger.warning("Event %s banner left as it is: %s", row['id'], e)
+                continue
+            execute_query(
+                'UPDATE events SET banner_image = %s, banner_thumb = %s WHERE id = %s',
+                (images['full'], images['thumb'], row['id']), fetch=False, shard=shard
+            )
+            events += 1
+
+    # Tickets of an event usually share a handful of backgrounds, so each is
+    # fetched and normalized once, an event at a time
+    tickets = 0
+    with_images = execute_query(
+        'SELECT DISTINCT event_id FROM tickets WHERE ticket_bg_image IS NOT NULL ORDER BY event_id',
+        shard=shard
+    ) or []
+
+    for event in with_images:
+        distinct = execute_query('''
+            SELECT DISTINCT ON (md5(ticket_bg_image)) md5(ticket_bg_image) AS digest, ticket_bg_image
+            FROM tickets
+            WHERE event_id = %s AND ticket_bg_image IS NOT NULL
+        ''', (event['event_id'],), shard=shard) or []
+
+        for row in distinct:
+            try:
+                full = normalize(row['ticket_bg_image'])['full']
+            except ImageError as e:
+                logger.warning("Ticket background on event %s left as it is: %s", event['event_id'], e)
+                continue
+            if full == row['ticket_bg_image']:
+                continue
+            updated = execute_query('''
+                UPDATE tickets SET ticket_bg_image = %s
+                WHERE event_id = %s AND md5(ticket_bg_image) = %s
+                RETURNING id
+            ''', (full, event['event_id'], row['digest']), shard=shard)
+            tickets += len(updated or [])
+
+    return events, tickets
+
+
+if __name__ == '__main__':
+    import sys
+    from app_logging import configure_logging
+    from database.db import init_db
+    from database.shards import all_shards
+    configure_logging()
+    init_db()
+
+    if '--backfill' not in sys.argv:
+        print(__doc__)
+        sys.exit(1)
+
+    for shard in all_shards():
+        events, tickets = backfill(shard)
+        logger.info("Shard %s: normalized %d banner(s) and %d ticket background(s)", shard, events, tickets)
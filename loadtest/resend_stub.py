@@ -0,0 +1,87 @@
+"""
+Local stand-in for the Resend email API, so load tests never send real mail.
+
+    python loadtest/resend_stub.py --port 8025 --latency-ms 120 --error-rate 0.01
+
+then run the app with RESEND_API_URL=http://127.0.0.1:8025/emails (and any
+RESEND_API_KEY / EMAIL_FROM). Every POST /emails sleeps --latency-ms
+(+/- --jitter-ms), then answers 200 with a fake id, or 500 for a
+--error-rate share of requests. GET /stats returns the counts so far.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ResendStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.1
+    jitter = 0.0
+    error_rate = 0.0
+    counts = {'sent': 0, 'failed': 0, 'bytes': 0}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        failed = random.random() < self.error_rate
+        with self.lock:
+            self.counts['failed' if failed else 'sent'] += 1
+            self.counts['bytes'] += length
+
+        if failed:
+            self._reply(500, {'name': 'internal_server_error', 'message': 'stub failure'})
+        else:
+            self._reply(200, {'id': str(uuid.uuid4())})
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._reply(404, {'message': 'not found'})
+            return
+        with self.lock:
+            self._reply(200, dict(self.counts))
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency-ms', type=float, default=120)
+    parser.add_argument('--jitter-ms', type=float, default=40)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    ResendStub.latency = args.latency_ms / 1000
+    ResendStub.jitter = args.jitter_ms / 1000
+    ResendStub.error_rate = args.error_rate
+
+    server = ThreadingHTTPServer((args.host, args.port), ResendStub)
+    server.daemon_threads = True
+    print(f"Resend stub on http://{args.host}:{args.port}/emails "
+          f"({args.latency_ms:.0f} ms +/- {args.jitter_ms:.0f}, {args.error_rate:.1%} errors)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Prometheus metrics, served at /metrics.
+
+Under gunicorn every worker is its own process, so set
+PROMETHEUS_MULTIPROC_DIR to an empty, writable directory (wiped on each
+deploy) before the app starts: prometheus_client then keeps each worker's
+values in small mmap'd files there and /metrics adds them up. Without it
+the metrics are per process, which is fine for the dev server and tests.
+
+Updating a metric is a lock-protected float add in this process, with no
+I/O on the request path. The data layer does not import this module: it
+exposes observer lists (database/db.py pool_observers,
+database/query_budget.py query_observers) that this module subscribes to
+on import, so migrate.py and friends keep working without it.
+
+Scan labels are kept bounded, because the event id can come from an
+untrusted QR payload and the gate name from the scanner app. An event id
+is only used as a label once this worker has seen a real ticket of that
+event; until then it counts under 'unknown'. Gates are limited to
+SCAN_GATES (comma-separated) when set, and otherwise to the first
+MAX_SCAN_GATES names seen. Any other gate counts as 'other'.
+"""
+import os
+import re
+import time
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY,
+    generate_latest, multiprocess, CONTENT_TYPE_LATEST,
+)
+from database import db, query_budget
+
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+SCAN_GATES = {g.strip().lower() for g in os.getenv('SCAN_GATES', '').split(',') if g.strip()}
+MAX_SCAN_GATES = 16
+# Outcomes that come from a real ticket row, so their event id is known to exist
+TRUSTED_SCAN_OUTCOMES = ('checked_in', 'duplicate', 'used', 'cancelled')
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 15, 30)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'ticket9ja_http_request_duration_seconds', 'HTTP request latency',
+    ['method', 'endpoint', 'status'], buckets=FAST_BUCKETS + (10,),
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    'ticket9ja_db_pool_checkout_seconds', 'Time spent waiting for a pooled connection',
+    ['pool'], buckets=FAST_BUCKETS,
+)
+DB_POOL_IN_USE = Gauge(
+    'ticket9ja_db_pool_connections_in_use', 'Connections currently checked out',
+    ['pool'], multiprocess_mode='livesum',
+)
+DB_QUERY_SECONDS = Histogram(
+    'ticket9ja_db_query_duration_seconds', 'Query execution time',
+    buckets=FAST_BUCKETS,
+)
+QR_RENDER_SECONDS = Histogram(
+    'ticket9ja_qr_render_seconds', 'QR code PNG render time',
+    buckets=FAST_BUCKETS,
+)
+EMAIL_SEND_SECONDS = Histogram(
+    'ticket9ja_email_send_seconds', 'Ticket email provider call latency',
+    ['outcome'], buckets=SLOW_BUCKETS,
+)
+EMAILS = Counter(
+    'ticket9ja_emails_total', 'Ticket emails by outcome',
+    ['outcome'],
+)
+SCANS = Counter(
+    'ticket9ja_scans_total', 'Ticket scans by event, gate and outcome',
+    ['event_id', 'gate', 'outcome'],
+)
+
+
+def _on_pool(event, pool, seconds):
+    if event == 'checkout':
+        DB_POOL_CHECKOUT_SECONDS.labels(pool).observe(seconds)
+        DB_POOL_IN_USE.labels(pool).inc()
+    elif event == 'release':
+        DB_POOL_IN_USE.labels(pool).dec()
+
+
+def _on_query(query, seconds, rows):
+    DB_QUERY_SECONDS.observe(seconds)
+
+
+db.pool_observers.append(_on_pool)
+query_budget.query_observers.append(_on_query)
+
+
+def observe_request(method, endpoint, status, seconds):
+    HTTP_REQUEST_SECONDS.labels(method, endpoint or 'unmatched', str(status)).observe(seconds)
+
+
+_known_events = set()
+_seen_gates = set()
+
+
+def count_scan(event_id, gate, outcome):
+    SCANS.labels(_event_label(event_id, outcome), _gate_label(gate), outcome).inc()
+
+
+def _event_label(event_id, outcome):
+    if event_id is None:
+        return 'unknown'
+    if outcome in TRUSTED_SCAN_OUTCOMES:
+        _known_events.add(event_id)
+    return str(event_id) if event_id in _known_events else 'unknown'
+
+
+def _gate_label(gate):
+    if not gate:
+        return 'unknown'
+    gate = re.sub(r'[^a-z0-9_-]', '', str(gate).lower())[:32] or 'unknown'
+    if SCAN_GATES:
+        return gate if gate in SCAN_GATES else 'other'
+    if gate in _seen_gates:
+        return gate
+    if len(_seen_gates) < MAX_SCAN_GATES:
+        _seen_gates.add(gate)
+        return gate
+    return 'other'
+
+
+class timed:
+    """Context manager observing elapsed seconds on a histogram (or one of its labelled children)"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+def render():
+    """Exposition text for every worker process"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
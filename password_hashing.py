@@ -0,0 +1,74 @@
+"""
+bcrypt hashing off the request path, with a bound on how much of it runs at once.
+
+A bcrypt check at cost 12 is ~250 ms of CPU. When a whole scanner team
+logs in at gate-open, doing that inline on every request thread starves
+the scans sharing the worker. Here hashes run on a small thread pool
+(bcrypt releases the GIL while it works) of PASSWORD_HASH_WORKERS
+threads. At most PASSWORD_HASH_QUEUE more callers may wait for a slot;
+anyone beyond that, or anyone who waited PASSWORD_HASH_TIMEOUT seconds,
+gets HashingBusy straight away so the route can answer 503 + Retry-After
+instead of piling up.
+
+BCRYPT_ROUNDS sets the cost for new hashes. Hashes made at another cost
+still verify; login rehashes them at the current cost (needs_rehash).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+import tracing
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '16'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '5'))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+# Running plus waiting hashes; acquiring without blocking is the fast-fail check
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+class HashingBusy(Exception):
+    """Too many password hashes in flight; retry shortly"""
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+
+    future = _executor.submit(fn, *args)
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        # A queued hash frees its slot now; one already running frees it when done
+        future.cancel()
+        raise HashingBusy()
+
+
+def hash_password(password):
+    with tracing.span('bcrypt.hashpw', 'auth', rounds=BCRYPT_ROUNDS):
+        return _run(_hash, password)
+
+
+def verify_password(password, password_hash):
+    # Includes the wait for a hashing thread, which is what the request feels
+    with tracing.span('bcrypt.checkpw', 'auth'):
+        return _run(_check, password, password_hash)
+
+
+def needs_rehash(password_hash):
+    """True when a hash was made with a different cost than BCRYPT_ROUNDS"""
+    try:
+        return int(password_hash.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def _hash(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
@@ -0,0 +1,235 @@
+"""
+On-demand request profiling.
+
+A request is profiled when an admin sends `X-Profile: 1` (the header is
+ignored for everyone else) or when it falls in PROFILE_SAMPLE_RATE. A
+profiled request runs under cProfile and is always traced (tracing.py),
+whatever TRACE_SAMPLE_RATE says, so the stored profile carries its span
+timeline: DB statements and connections, QR, email and auth spans, each
+with its offset from the start of the request.
+
+The result goes to PROFILE_DIR as <id>.json (summary, timeline, top
+functions by cumulative time) and <id>.prof (raw pstats, for snakeviz or
+`python -m pstats`), and the response carries X-Profile-ID. Admins read
+them back through /api/admin/profiles. They are files rather than memory
+so any gunicorn worker can serve a profile taken by another; only the
+newest PROFILE_KEEP are kept.
+
+Requests that are not profiled pay one header lookup, and one random()
+call when sampling is on.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import logging
+import tempfile
+from datetime import datetime, timezone
+from database import db, query_budget
+import tracing
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'ticket9ja-profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '200'))
+TOP_FUNCTIONS = 40
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class Profile:
+    """One profiled request's cProfile run"""
+
+    def __init__(self, trigger):
+        self.id = uuid.uuid4().hex
+        self.trigger = trigger
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.profiler = cProfile.Profile()
+        self.profiler_error = None
+
+
+def start(request, request_id):
+    """Start profiling the current request if it asks for it or is sampled; returns the Profile or None"""
+    if request.headers.get(PROFILE_HEADER) and _requested_by_admin():
+        trigger = 'header'
+    elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        trigger = 'sample'
+    else:
+        return None
+
+    if tracing.current_trace() is None:
+        tracing.start_trace(request_id, tracing.trace_name(request), force=True)
+
+    profile = Profile(trigger)
+    try:
+        profile.profiler.enable()
+    except ValueError as e:
+        # Another profiler already owns this thread; keep the timeline anyway
+        profile.profiler = None
+        profile.profiler_error = str(e)
+    return profile
+
+
+def finish(profile, request, status, trace):
+    """Stop profiling and store the result with the request's (ended) trace; returns the profile id"""
+    if profile.profiler is not None:
+        profile.profiler.disable()
+    duration_ms = round((time.perf_counter() - profile.started) * 1000, 1)
+
+    stats = query_budget.request_stats()
+    record = {
+        'id': profile.id,
+        'trigger': profile.trigger,
+        'requestId': trace.trace_id if trace is not None else None,
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': status,
+        'startedAt': profile.started_at.isoformat(),
+        'durationMs': duration_ms,
+        'dbQueries': stats['queries'],
+        'dbMs': round(stats['ms'], 1),
+        'spans': trace.span_dicts() if trace is not None else [],
+        'droppedSpans': trace.dropped_spans if trace is not None else 0,
+        'functions': _top_functions(profile.profiler) if profile.profiler is not None else [],
+        'profilerError': profile.profiler_error,
+    }
+
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if profile.profiler is not None:
+            profile.profiler.dump_stats(_path(profile.id, '.prof'))
+        # Written under a temporary name so readers never see half a file
+        partial = _path(profile.id, '.json.tmp')
+        with open(partial, 'w') as f:
+            json.dump(record, f)
+        os.replace(partial, _path(profile.id, '.json'))
+        _prune()
+    except OSError as e:
+        logger.warning("Could not store profile %s: %s", profile.id, e)
+
+    logger.info("Request profiled", extra={
+        'profile_id': profile.id, 'trigger': profile.trigger, 'path': request.path,
+        'status': status, 'duration_ms': duration_ms
+    })
+    return profile.id
+
+
+def discard(profile):
+    """Stop a profile that never reached finish() (the request failed before after_request)"""
+    if profile.profiler is not None:
+        profile.profiler.disable()
+
+
+def list_profiles(limit=50):
+    """Summaries of the newest stored profiles (no spans or functions), newest first"""
+    summaries = []
+    for name in _stored()[:limit]:
+        record = _read(name)
+        if record is not None:
+            record.pop('spans', None)
+            record.pop('functions', None)
+            summaries.append(record)
+    return summaries
+
+
+def load_profile(profile_id):
+    if not _PROFILE_ID.match(profile_id or ''):
+        return None
+    return _read(f'{profile_id}.json')
+
+
+def stats_path(profile_id):
+    """Path of the raw pstats file, or None"""
+    if not _PROFILE_ID.match(profile_id or ''):
+        return None
+    path = _path(profile_id, '.prof')
+    return path if os.path.exists(path) else None
+
+
+def _requested_by_admin():
+    from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+
+    try:
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+    except Exception:
+        return False
+    if user_id is None:
+        return False
+
+    user = db.execute_query('SELECT role FROM users WHERE id = %s', (int(user_id),))
+    return bool(user) and user[0]['role'] == 'admin'
+
+
+def _top_functions(profiler):
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: -item[1][3])[:TOP_FUNCTIONS]
+    functions = []
+    for (filename, line, function), (primitive_calls, calls, total, cumulative, _) in rows:
+        functions.append({
+            'function': function,
+            'location': f'{_short_path(filename)}:{line}',
+            'calls': calls,
+            'primitiveCalls': primitive_calls,
+            'totalMs': round(total * 1000, 3),
+            'cumulativeMs': round(cumulative * 1000, 3),
+        })
+    return functions
+
+
+def _short_path(filename):
+    if filename.startswith(_ROOT + os.sep):
+        return os.path.relpath(filename, _ROOT)
+    marker = os.sep + 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return filename
+
+
+def _path(profile_id, suffix):
+    return os.path.join(PROFILE_DIR, profile_id + suffix)
+
+
+def _stored():
+    """Stored profile file names, newest first"""
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=_mtime, reverse=True)
+    return [entry.name for entry in entries]
+
+
+def _mtime(entry):
+    try:
+        return entry.stat().st_mtime
+    except FileNotFoundError:  # pruned by another worker meanwhile
+        return 0
+
+
+def _read(name):
+    try:
+        with open(os.path.join(PROFILE_DIR, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _prune():
+    for name in _stored()[PROFILE_KEEP:]:
+        profile_id = name[:-len('.json')]
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(_path(profile_id, suffix))
+            except FileNotFoundError:
+                pass
+
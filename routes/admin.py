@@ -1,7 +1,11 @@
-from flask import Blueprint, request, jsonify
+import os
+from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database.db import execute_query
+from database.shards import fan_out
 from functools import wraps
+import profiling
+import tracing
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -11,7 +15,8 @@ def admin_required(fn):
     @jwt_required()
     def wrapper(*args, **kwargs):
         user_id = get_jwt_identity()
-        user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
+        with tracing.span('admin_required', 'auth'):
+            user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
         
         if not user or user[0]['role'] != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
@@ -24,18 +29,98 @@ def admin_required(fn):
 def get_dashboard():
     """Get admin dashboard statistics"""
     
-    stats = execute_query('''
-        SELECT 
-            (SELECT COUNT(*) FROM users WHERE role = 'user') as total_users,
-            (SELECT COUNT(*) FROM events WHERE status = 'published') as active_events,
-            (SELECT COUNT(*) FROM tickets) as total_tickets_sold,
-            (SELECT COALESCE(SUM(purchase_price), 0) FROM tickets WHERE status != 'cancelled') as total_revenue
+    users = execute_query('''
+        SELECT COUNT(*) FILTER (WHERE role = 'scanner') as total_scanners
+        FROM users
     ''')
     
-    if stats:
+    # Events and tickets live on their shard; add up each shard's totals.
+    # Archived events count through their event_archive_stats snapshot.
+    per_shard = fan_out('''
+        SELECT 
+            (SELECT COUNT(*) FROM events WHERE status = 'active') as active_events,
+            (SELECT COUNT(*) FROM tickets)
+              + (SELECT COALESCE(SUM(total_tickets_issued), 0) FROM event_archive_stats) as total_tickets_issued,
+            (SELECT COALESCE(SUM(tt.price), 0)
+             FROM tickets t JOIN ticket_types tt ON t.ticket_type_id = tt.id
+             WHERE t.status != 'cancelled')
+              + (SELECT COALESCE(SUM(total_revenue - COALESCE(cancelled_revenue, 0)), 0)
+                 FROM event_archive_stats) as total_revenue
+    ''', intent='read')
+    
+    if users and per_shard:
+        stats = {'total_scanners': users[0]['total_scanners']}
+        for key in ('active_events', 'total_tickets_issued', 'total_revenue'):
+            stats[key] = sum(row[key] for row in per_shard)
         return jsonify({
             'success': True,
-            'data': stats[0]
+            'data': stats
         }), 200
     
     return jsonify({'success': False, 'error': 'Stats not available'}), 500
+
+@admin_bp.route('/profiles', methods=['GET'])
+@admin_required
+def list_profiles():
+    """Newest request profiles (see profiling.py), without their timelines"""
+    limit = min(request.args.get('limit', 50, type=int), profiling.PROFILE_KEEP)
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'profiles': profiling.list_profiles(limit),
+            'sampleRate': profiling.PROFILE_SAMPLE_RATE
+        }
+    }), 200
+
+@admin_bp.route('/profiles/<profile_id>', methods=['GET'])
+@admin_required
+def get_profile(profile_id):
+    """One profile: summary, span timeline and top functions"""
+    profile = profiling.load_profile(profile_id)
+    
+    if profile is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    
+    return jsonify({'success': True, 'data': {'profile': profile}}), 200
+
+@admin_bp.route('/profiles/<profile_id>/pstats', methods=['GET'])
+@admin_required
+def download_profile_stats(profile_id):
+    """Raw cProfile output, for snakeviz or python -m pstats"""
+    path = profiling.stats_path(profile_id)
+    
+    if path is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'{profile_id}.prof')
+
+@admin_bp.route('/traces', methods=['GET'])
+@admin_required
+def slowest_traces():
+    """Slowest recent request traces (see tracing.py) held by the worker answering this request"""
+    limit = min(request.args.get('limit', 10, type=int), tracing.TRACE_BUFFER)
+    min_ms = request.args.get('minMs', 0, type=float)
+    with_spans = request.args.get('spans', 'true').lower() != 'false'
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'traces': tracing.slowest(limit, min_ms, with_spans),
+            'buffered': tracing.buffered(),
+            'sampleRate': tracing.TRACE_SAMPLE_RATE,
+            'worker': os.getpid()
+        }
+    }), 200
+
+@admin_bp.route('/traces/<trace_id>', methods=['GET'])
+@admin_required
+def get_trace(trace_id):
+    """One buffered trace by id (the request's X-Request-ID)"""
+    trace = tracing.find(trace_id)
+    
+    if trace is None:
+        return jsonify({'success': False, 'error': 'Trace not found on this worker'}), 404
+    
+    return jsonify({'success': True, 'data': {'trace': trace}}), 200
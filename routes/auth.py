@@ -1,10 +1,21 @@
+import logging
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from database.db import execute_query
-import bcrypt
+from database.shards import replicate_user
+from password_hashing import hash_password, verify_password, needs_rehash, HashingBusy
 
 auth_bp = Blueprint('auth', __name__)
 
+logger = logging.getLogger(__name__)
+
+@auth_bp.errorhandler(HashingBusy)
+def hashing_busy(e):
+    # Too many logins hashing at once: shed load instead of queueing behind bcrypt
+    response = jsonify({'success': False, 'error': 'Too many sign-in attempts right now, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     """Register new user"""
@@ -22,7 +33,7 @@ def register():
     if existing:
         return jsonify({'success': False, 'error': 'User already exists'}), 400
     
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    password_hash = hash_password(password)
     
     try:
         user = execute_query('''
@@ -32,6 +43,7 @@ def register():
         ''', (email, password_hash, full_name, role))
         
         if user:
+            replicate_user(user[0]['id'])
             return jsonify({
                 'success': True,
                 'message': 'User registered successfully',
@@ -67,12 +79,15 @@ def login():
         
         user = user[0]
         
-        if not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+        if not verify_password(password, user['password_hash']):
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
         
+        # BCRYPT_ROUNDS changed since this hash was made: upgrade it while we have the password
+        if needs_rehash(user['password_hash']):
+            _rehash(user['id'], password)
+        
         # CRITICAL FIX: JWT subject MUST be string
         user_id_string = str(user['id'])
-        print(f"🔑 Creating token for user ID: {user_id_string} (type: {type(user_id_string).__name__})")
         
         access_token = create_access_token(identity=user_id_string)
         
@@ -83,7 +98,7 @@ def login():
             'role': user['role']
         }
         
-        print(f"✅ Login successful for {email}")
+        logger.info("Login successful", extra={'user_id': user['id']})
         
         return jsonify({
             'success': True,
@@ -93,12 +108,24 @@ def login():
             }
         }), 200
         
+    except HashingBusy:
+        raise
     except Exception as e:
-        print(f"❌ Login error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Login error")
         return jsonify({'success': False, 'error': 'Login failed'}), 500
 
+def _rehash(user_id, password):
+    try:
+        execute_query(
+            'UPDATE users SET password_hash = %s WHERE id = %s',
+            (hash_password(password), user_id),
+            fetch=False
+        )
+        replicate_user(user_id)
+    except Exception as e:
+        # Not fatal: the old hash still verifies, next login tries again
+        logger.warning("Password rehash failed for user %s: %s", user_id, e)
+
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
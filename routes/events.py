@@ -1,13 +1,25 @@
+import logging
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database.db import execute_query, get_db_connection, release_db_connection
+from database.query_budget import statement_timeout
 from functools import wraps
 from psycopg2.extras import RealDictCursor
+import validation_index
+import event_jobs
+import ticket_pdfs
+import image_pipeline
+import listings
+import tracing
+from database.partitions import create_event_partitions, PartitionLockBusy
+from database.shards import sharding_enabled, shard_for_event, allocate_event, release_event, fan_out, fan_out_rows
 import base64
 import os
 
 events_bp = Blueprint('events', __name__)
 
+logger = logging.getLogger(__name__)
+
 def admin_required(fn):
     @wraps(fn)
     @jwt_required()
@@ -15,7 +27,8 @@ def admin_required(fn):
         user_id = get_jwt_identity()
         user_id = int(user_id)
         
-        user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
+        with tracing.span('admin_required', 'auth'):
+            user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
         
         if not user or user[0]['role'] != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
@@ -25,32 +38,57 @@ def admin_required(fn):
 
 
 @events_bp.route('', methods=['GET'])
+@statement_timeout(5000)
 @jwt_required()
 def get_all_events():
-    """Get all events with statistics"""
+    """Get all events with statistics (?format=rows|columnar for the compact forms, see listings.py)"""
     status = request.args.get('status')
     
+    try:
+        fmt = listings.requested_format(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Listings carry banner_thumb only; the full banner_image comes with GET /<id>
     query = '''
-        SELECT e.*,
+        SELECT e.id, e.name, e.description, e.event_date, e.location, e.capacity,
+               e.status, e.banner_thumb, e.created_by, e.created_at, e.updated_at,
+               e.archived_at,
                u.full_name as created_by_name,
-               COUNT(DISTINCT t.id) as total_tickets_issued,
-               COUNT(DISTINCT CASE WHEN t.status = 'used' THEN t.id END) as tickets_used,
-               COUNT(DISTINCT CASE WHEN t.status = 'active' THEN t.id END) as tickets_active,
-               COALESCE(SUM(tt.price), 0) as total_revenue
+               COUNT(DISTINCT t.id) + COALESCE(MAX(s.total_tickets_issued), 0) as total_tickets_issued,
+               COUNT(DISTINCT CASE WHEN t.status = 'used' THEN t.id END) + COALESCE(MAX(s.tickets_used), 0) as tickets_used,
+               COUNT(DISTINCT CASE WHEN t.status = 'active' THEN t.id END) + COALESCE(MAX(s.tickets_active), 0) as tickets_active,
+               COALESCE(SUM(tt.price), 0) + COALESCE(MAX(s.total_revenue), 0) as total_revenue
         FROM events e
         LEFT JOIN users u ON e.created_by = u.id
         LEFT JOIN tickets t ON e.id = t.event_id
         LEFT JOIN ticket_types tt ON t.ticket_type_id = tt.id
+        LEFT JOIN event_archive_stats s ON e.id = s.event_id
     '''
     params = ()
     
     if status:
         query += ' WHERE e.status = %s'
         params = (status,)
+    else:
+        query += " WHERE e.status != 'deleting'"
     
     query += ' GROUP BY e.id, u.full_name ORDER BY e.event_date DESC'
     
-    events = execute_query(query, params)
+    if fmt:
+        columns, rows = fan_out_rows(query, params, intent='read')
+        if sharding_enabled():
+            event_date = columns.index('event_date')
+            rows.sort(key=lambda row: row[event_date], reverse=True)
+        return jsonify({
+            'success': True,
+            'data': dict(listings.compact(columns, rows, fmt), format=fmt, total=len(rows))
+        }), 200
+    
+    # Each shard only knows its own events; merge and re-sort here
+    events = fan_out(query, params, intent='read')
+    if sharding_enabled():
+        events.sort(key=lambda e: e['event_date'], reverse=True)
     
     return jsonify({
         'success': True,
@@ -58,9 +96,12 @@ def get_all_events():
     }), 200
 
 @events_bp.route('/<int:event_id>', methods=['GET'])
+@statement_timeout(5000)
 @admin_required
 def get_event_by_id(event_id):
     """Get event with detailed statistics"""
+    shard = shard_for_event(event_id)
+    
     event = execute_query('''
         SELECT e.*,
                u.full_name as created_by_name,
@@ -70,10 +111,10 @@ def get_event_by_id(event_id):
                COUNT(DISTINCT CASE WHEN t.status = 'cancelled' THEN t.id END) as tickets_cancelled
         FROM events e
         LEFT JOIN users u ON e.created_by = u.id
-        LEFT JOIN tickets t ON e.id = t.event_id
+        LEFT JOIN tickets_all t ON e.id = t.event_id
         WHERE e.id = %s
         GROUP BY e.id, u.full_name
-    ''', (event_id,))
+    ''', (event_id,), intent='read', shard=shard)
     
     if not event:
         return jsonify({'success': False, 'error': 'Event not found'}), 404
@@ -85,23 +126,23 @@ def get_event_by_id(event_id):
         SELECT tt.*,
                COALESCE(SUM(CASE WHEN t.status != 'cancelled' THEN tt.price ELSE 0 END), 0) as revenue
         FROM ticket_types tt
-        LEFT JOIN tickets t ON tt.id = t.ticket_type_id
+        LEFT JOIN tickets_all t ON tt.id = t.ticket_type_id
         WHERE tt.event_id = %s
         GROUP BY tt.id
         ORDER BY tt.price ASC
-    ''', (event_id,))
+    ''', (event_id,), intent='read', shard=shard)
     
     event['ticketTypes'] = ticket_types or []
     
     # Get recent tickets
     recent_tickets = execute_query('''
         SELECT t.*, tt.name as ticket_type_name
-        FROM tickets t
+        FROM tickets_all t
         JOIN ticket_types tt ON t.ticket_type_id = tt.id
         WHERE t.event_id = %s
         ORDER BY t.created_at DESC
         LIMIT 10
-    ''', (event_id,))
+    ''', (event_id,), intent='read', shard=shard)
     
     event['recentTickets'] = recent_tickets or []
     
@@ -127,18 +168,35 @@ def create_event():
         if not all([name, event_date, location, capacity]):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
+        # Resized before the connection is taken; the original upload is not kept
+        banner_thumb = None
+        if banner_image:
+            try:
+                banner = image_pipeline.normalize(banner_image, ('full', 'thumb'))
+            except image_pipeline.ImageError as e:
+                return jsonify({'success': False, 'error': f'Banner image: {e}'}), 400
+            banner_image, banner_thumb = banner['full'], banner['thumb']
+        
+        # With sharding the home node hands out the id and picks the shard
+        event_id, shard = allocate_event() if sharding_enabled() else (None, 0)
+        
         # Use a single transaction for everything
-        conn = get_db_connection()
+        conn = get_db_connection(shard=shard)
         
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Create event
-                print("Creating event...")
                 cur.execute('''
-                    INSERT INTO events (created_by, name, description, banner_image, event_date, location, capacity, status)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, 'draft')
+                    INSERT INTO events (
+                        id, created_by, name, description, banner_image, banner_thumb,
+                        event_date, location, capacity, status
+                    )
+                    VALUES (COALESCE(%s, nextval(pg_get_serial_sequence('events', 'id'))), %s, %s, %s, %s, %s, %s, %s, %s, 'draft')
                     RETURNING *
-                ''', (user_id, name, description, banner_image, event_date, location, int(capacity)))
+                ''', (
+                    event_id, user_id, name, description, banner_image, banner_thumb,
+                    event_date, location, int(capacity)
+                ))
                 
                 event = cur.fetchone()
                 
@@ -146,10 +204,12 @@ def create_event():
                     raise Exception("Failed to create event")
                 
                 event_id = event['id']
-                print(f"Event created with ID: {event_id}")
+                logger.info("Event created", extra={'event_id': event_id, 'shard': shard})
+                
+                # LIST-partitioned databases give each event its own tickets/check_ins tables
+                create_event_partitions(cur, event_id)
                 
                 # Create default ticket types
-                print("Creating ticket types...")
                 default_ticket_types = [
                     ('Early bird', 50.00, 100, 'Early bird special pricing', '#10B981'),
                     ('Late bird', 80.00, 50, 'Regular pricing', '#3B82F6'),
@@ -166,7 +226,6 @@ def create_event():
                 
                 # Commit the entire transaction
                 conn.commit()
-                print("Transaction committed successfully")
                 
                 return jsonify({
                     'success': True,
@@ -176,15 +235,21 @@ def create_event():
                 
         except Exception as e:
             conn.rollback()
-            print(f"Transaction rolled back: {e}")
+            logger.warning("Create event rolled back: %s", e)
+            if sharding_enabled() and event_id is not None:
+                release_event(event_id)
             raise e
         finally:
             release_db_connection(conn)
         
+    except PartitionLockBusy:
+        # Long queries on tickets/check_ins; waiting would queue every scanner behind the DDL
+        logger.warning("Create event: partition locks busy, asked the client to retry")
+        response = jsonify({'success': False, 'error': 'The event could not be created right now, please retry'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
     except Exception as e:
-        print(f"Create event error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Create event error")
         return jsonify({'success': False, 'error': str(e)}), 500
     
 @events_bp.route('/<int:event_id>', methods=['PUT'])
@@ -193,8 +258,10 @@ def update_event(event_id):
     """Update event details"""
     data = request.get_json()
     
+    shard = shard_for_event(event_id)
+    
     # Check if event exists
-    event = execute_query('SELECT id FROM events WHERE id = %s', (event_id,))
+    event = execute_query('SELECT id FROM events WHERE id = %s', (event_id,), shard=shard)
     if not event:
         return jsonify({'success': False, 'error': 'Event not found'}), 404
     
@@ -211,8 +278,16 @@ def update_event(event_id):
         values.append(data['description'])
     
     if 'bannerImage' in data:
+        banner = {'full': None, 'thumb': None}
+        if data['bannerImage']:
+            try:
+                banner = image_pipeline.normalize(data['bannerImage'], ('full', 'thumb'))
+            except image_pipeline.ImageError as e:
+                return jsonify({'success': False, 'error': f'Banner image: {e}'}), 400
         fields.append('banner_image = %s')
-        values.append(data['bannerImage'])
+        values.append(banner['full'])
+        fields.append('banner_thumb = %s')
+        values.append(banner['thumb'])
     
     if 'eventDate' in data:
         fields.append('event_date = %s')
@@ -232,7 +307,10 @@ def update_event(event_id):
     values.append(event_id)
     query = f"UPDATE events SET {', '.join(fields)} WHERE id = %s RETURNING *"
     
-    updated_event = execute_query(query, tuple(values))
+    updated_event = execute_query(query, tuple(values), shard=shard)
+    
+    # Stored ticket PDFs show the old details
+    ticket_pdfs.forget_event(event_id)
     
     return jsonify({
         'success': True,
@@ -243,78 +321,97 @@ def update_event(event_id):
 @events_bp.route('/<int:event_id>', methods=['DELETE'])
 @admin_required
 def delete_event(event_id):
-    """Delete event and all related data"""
-    conn = get_db_connection()
-    conn.autocommit = False
-    
+    """Start deleting an event and all related data in the background"""
     try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        print(f"Deleting event {event_id}...")
+        logger.info("Deleting event %s", event_id)
         
-        # Get event details first
-        cur.execute('SELECT name FROM events WHERE id = %s', (event_id,))
-        event = cur.fetchone()
+        job = event_jobs.start_delete(event_id)
         
-        if not event:
+        if not job:
             return jsonify({'success': False, 'error': 'Event not found'}), 404
         
-        # Delete in correct order due to foreign keys
-        
-        # 1. Delete check-ins first
-        cur.execute('DELETE FROM check_ins WHERE ticket_id IN (SELECT id FROM tickets WHERE event_id = %s)', (event_id,))
-        deleted_checkins = cur.rowcount
-        print(f"Deleted {deleted_checkins} check-ins")
-        
-        # 2. Delete tickets
-        cur.execute('DELETE FROM tickets WHERE event_id = %s', (event_id,))
-        deleted_tickets = cur.rowcount
-        print(f"Deleted {deleted_tickets} tickets")
-        
-        # 3. Delete ticket types
-        cur.execute('DELETE FROM ticket_types WHERE event_id = %s', (event_id,))
-        deleted_types = cur.rowcount
-        print(f"Deleted {deleted_types} ticket types")
-        
-        # 4. Finally delete the event
-        cur.execute('DELETE FROM events WHERE id = %s', (event_id,))
-        print(f"Deleted event: {event['name']}")
+        return jsonify({
+            'success': True,
+            'message': f'Event "{job["event_name"]}" is being deleted',
+            'data': {'job': job}
+        }), 202
         
-        # Commit all changes
-        conn.commit()
-        cur.close()
+    except Exception as e:
+        logger.exception("Delete event error")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@events_bp.route('/<int:event_id>/deletion', methods=['GET'])
+@admin_required
+def get_event_deletion(event_id):
+    """Progress of an event's deletion job"""
+    job = event_jobs.get_latest_job(event_id, 'delete')
+    
+    if not job:
+        return jsonify({'success': False, 'error': 'No deletion job for this event'}), 404
+    
+    return jsonify({'success': True, 'data': {'job': job}}), 200
+
+@events_bp.route('/<int:event_id>/pdfs', methods=['POST'])
+@admin_required
+def render_event_pdfs(event_id):
+    """Start rendering PDFs for all of an event's tickets in the background"""
+    try:
+        # Returns None when a render is already running; its job is returned instead
+        event_jobs.queue_job(event_id, 'render_pdfs')
+        job = event_jobs.get_latest_job(event_id, 'render_pdfs')
         
-        print(f"Event {event_id} and all related data deleted successfully")
+        if not job:
+            return jsonify({'success': False, 'error': 'Event not found'}), 404
         
         return jsonify({
             'success': True,
-            'message': f'Event "{event["name"]}" and all related data deleted successfully',
-            'deleted': {
-                'checkins': deleted_checkins,
-                'tickets': deleted_tickets,
-                'ticketTypes': deleted_types
-            }
-        }), 200
+            'message': f'Rendering ticket PDFs for "{job["event_name"]}"',
+            'data': {'job': job}
+        }), 202
         
     except Exception as e:
-        conn.rollback()
-        print(f"Delete event error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Render PDFs error")
         return jsonify({'success': False, 'error': str(e)}), 500
-        
-    finally:
-        release_db_connection(conn)
+
+@events_bp.route('/<int:event_id>/pdfs', methods=['GET'])
+@admin_required
+def get_event_pdfs(event_id):
+    """Progress of an event's PDF rendering job"""
+    job = event_jobs.get_latest_job(event_id, 'render_pdfs')
+    
+    if not job:
+        return jsonify({'success': False, 'error': 'No PDF rendering job for this event'}), 404
+    
+    return jsonify({'success': True, 'data': {'job': job}}), 200
 
 @events_bp.route('/<int:event_id>/activate', methods=['POST'])
 @admin_required
 def activate_event(event_id):
     """Activate event"""
-    execute_query(
-        'UPDATE events SET status = %s WHERE id = %s',
-        ('active', event_id),
-        fetch=False
-    )
+    # Archived events keep their tickets in cold storage, so scanners could not find them
+    activated = execute_query('''
+        UPDATE events SET status = %s
+        WHERE id = %s
+          AND status != 'deleting'
+          AND archived_at IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM event_jobs j
+              WHERE j.event_id = events.id AND j.job_type = 'archive' AND j.status IN ('pending', 'running')
+          )
+        RETURNING id
+    ''', ('active', event_id), shard=shard_for_event(event_id))
+    
+    if not activated:
+        return jsonify({
+            'success': False,
+            'error': 'Event not found, archived or being deleted'
+        }), 400
+    
+    # Build the shared validation index so scanners can reject bad codes without the DB
+    try:
+        validation_index.build_index(event_id)
+    except Exception as e:
+        logger.warning("Validation index build failed (scans fall back to DB): %s", e)
     
     return jsonify({
         'success': True,
@@ -326,11 +423,20 @@ def activate_event(event_id):
 def close_event(event_id):
     """Close event"""
     execute_query(
-        'UPDATE events SET status = %s WHERE id = %s',
+        "UPDATE events SET status = %s WHERE id = %s AND status != 'deleting'",
         ('closed', event_id),
-        fetch=False
+        fetch=False,
+        shard=shard_for_event(event_id)
     )
     
+    validation_index.drop_index(event_id)
+    
+    if event_jobs.ARCHIVE_ON_CLOSE:
+        try:
+            event_jobs.queue_job(event_id, 'archive')
+        except Exception as e:
+            logger.warning("Could not queue archive job (retention sweep will retry): %s", e)
+    
     return jsonify({
         'success': True,
         'message': 'Event closed successfully'
@@ -355,7 +461,7 @@ def add_custom_ticket_type(event_id):
         INSERT INTO ticket_types (event_id, name, price, quantity, is_custom, description, color)
         VALUES (%s, %s, %s, %s, true, %s, %s)
         RETURNING *
-    ''', (event_id, name, price, quantity, description, color))
+    ''', (event_id, name, price, quantity, description, color), shard=shard_for_event(event_id))
     
     return jsonify({
         'success': True,
@@ -394,7 +500,10 @@ def update_ticket_type(event_id, type_id):
     values.extend([type_id, event_id])
     query = f"UPDATE ticket_types SET {', '.join(fields)} WHERE id = %s AND event_id = %s RETURNING *"
     
-    updated = execute_query(query, tuple(values))
+    updated = execute_query(query, tuple(values), shard=shard_for_event(event_id))
+    
+    if updated and 'name' in data:
+        ticket_pdfs.forget_event(event_id)
     
     return jsonify({
         'success': True,
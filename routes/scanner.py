@@ -1,11 +1,41 @@
+import logging
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database.db import execute_query, get_db_connection, release_db_connection
+from database.query_budget import statement_timeout
 from psycopg2.extras import RealDictCursor
+from psycopg2 import Binary
 from functools import wraps
+import checkin_journal
+import metrics
+import tracing
+import validation_index
+from ticket_codes import qr_digest, event_id_from_payload
+from database.shards import shard_for_qr_payload, shard_for_ticket_number, shard_for_event, fan_out
+from database.search import parse_search, search_params, merge_results, SEARCH_QUERY, FUZZY_SEARCH_QUERY
+from app_logging import sampled_logger
+import os
 
 scanner_bp = Blueprint('scanner', __name__)
 
+logger = logging.getLogger(__name__)
+# One line per scan is a lot at the gates; INFO here is sampled (LOG_SCAN_SAMPLE_RATE)
+scan_logger = sampled_logger(f'{__name__}.scans')
+
+# Rows created before the qr_digest column existed have it NULL until
+# `python database/migrate.py --backfill-qr-digest` has run. Turn this off
+# afterwards so invalid codes never fall back to scanning qr_code.
+QR_LEGACY_LOOKUP = os.getenv('QR_LEGACY_LOOKUP', 'true').lower() == 'true'
+
+TICKET_SCAN_QUERY = '''
+    SELECT t.*, 
+           e.name as event_name,
+           tt.name as ticket_type
+    FROM tickets t
+    JOIN events e ON t.event_id = e.id
+    JOIN ticket_types tt ON t.ticket_type_id = tt.id
+'''
+
 def scanner_required(fn):
     @wraps(fn)
     @jwt_required()
@@ -13,7 +43,8 @@ def scanner_required(fn):
         user_id = get_jwt_identity()
         user_id = int(user_id)
         
-        user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
+        with tracing.span('scanner_required', 'auth'):
+            user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
         
         if not user or user[0]['role'] not in ['scanner', 'admin']:
             return jsonify({'success': False, 'error': 'Scanner access required'}), 403
@@ -22,75 +53,107 @@ def scanner_required(fn):
     return wrapper
 
 @scanner_bp.route('/validate', methods=['POST'])
+@statement_timeout(2000)
 @scanner_required
 def validate_ticket():
     """Validate and check-in a ticket"""
-    print("\n" + "="*60)
-    print("TICKET VALIDATION REQUEST")
-    print("="*60)
-    
     user_id = get_jwt_identity()
     user_id = int(user_id)
     
     data = request.get_json()
     qr_code = data.get('qrCode')
-    
-    print(f"QR Code received: {qr_code}")
-    print(f"Scanner ID: {user_id}")
+    # Optional: which entrance the scanner is posted at, for per-gate scan metrics
+    gate = data.get('gate') or request.headers.get('X-Scanner-Gate')
+    scan_event_id = event_id_from_payload(qr_code) if qr_code else None
     
     if not qr_code:
+        metrics.count_scan(None, gate, 'invalid')
         return jsonify({'success': False, 'error': 'QR code required'}), 400
     
-    conn = get_db_connection()
+    # Reject unknown and cancelled codes from the shared index without a DB round trip
+    indexed_status = validation_index.check(qr_code)
+    if indexed_status == 'unknown':
+        scan_logger.info("Scan rejected: not in validation index", extra={'event_id': scan_event_id, 'gate': gate})
+        metrics.count_scan(scan_event_id, gate, 'not_found')
+        return jsonify({
+            'success': False,
+            'error': 'Ticket not found. Please check the ticket number.'
+        }), 404
+    if indexed_status == 'cancelled':
+        scan_logger.info("Scan rejected: cancelled per validation index", extra={'event_id': scan_event_id, 'gate': gate})
+        metrics.count_scan(scan_event_id, gate, 'cancelled')
+        return jsonify({
+            'success': False,
+            'error': 'Ticket is cancelled and cannot be used'
+        }), 400
+    
+    # The ticket number in the payload names the shard holding the event
+    conn = get_db_connection(shard=shard_for_qr_payload(qr_code))
     conn.autocommit = False
     
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Find ticket by QR code
-        print(f"Searching for ticket with QR: {qr_code}")
-        
-        cur.execute('''
-            SELECT t.*, 
-                   e.name as event_name,
-                   tt.name as ticket_type
-            FROM tickets t
-            JOIN events e ON t.event_id = e.id
-            JOIN ticket_types tt ON t.ticket_type_id = tt.id
-            WHERE t.qr_code = %s
-        ''', (qr_code,))
+        # The event id in the payload lets partitioned tables prune to one partition
+        payload_event_id = event_id_from_payload(qr_code)
+        if payload_event_id is not None:
+            cur.execute(
+                TICKET_SCAN_QUERY + ' WHERE t.event_id = %s AND t.qr_digest = %s AND t.qr_code = %s',
+                (payload_event_id, Binary(qr_digest(qr_code)), qr_code)
+            )
+        else:
+            cur.execute(
+                TICKET_SCAN_QUERY + ' WHERE t.qr_digest = %s AND t.qr_code = %s',
+                (Binary(qr_digest(qr_code)), qr_code)
+            )
         
         ticket = cur.fetchone()
         
+        if not ticket and QR_LEGACY_LOOKUP:
+            cur.execute(
+                TICKET_SCAN_QUERY + ' WHERE t.qr_digest IS NULL AND t.qr_code = %s',
+                (qr_code,)
+            )
+            ticket = cur.fetchone()
+        
         if not ticket:
-            print("Ticket not found!")
+            scan_logger.info("Scan rejected: ticket not found", extra={'event_id': scan_event_id, 'gate': gate})
+            metrics.count_scan(scan_event_id, gate, 'not_found')
             return jsonify({
                 'success': False,
                 'error': 'Ticket not found. Please check the ticket number.'
             }), 404
         
-        print(f"Ticket found: {ticket['ticket_number']} - Status: {ticket['status']}")
-        
         # Check if ticket is active
         if ticket['status'] != 'active':
-            print(f"Ticket status is {ticket['status']}, not active")
+            scan_logger.info("Scan rejected: ticket not active", extra={
+                'ticket_number': ticket['ticket_number'], 'status': ticket['status'], 'gate': gate
+            })
+            metrics.count_scan(ticket['event_id'], gate, ticket['status'])
             return jsonify({
                 'success': False,
                 'error': f'Ticket is {ticket["status"]} and cannot be used'
             }), 400
         
+        # Write-behind mode: answer from the in-memory used map and journal the check-in
+        if checkin_journal.is_enabled():
+            cur.close()
+            return _journal_check_in(ticket, user_id, gate)
+        
         # Check if already checked in
         cur.execute('''
             SELECT c.*, u.full_name as scanner_name
             FROM check_ins c
             JOIN users u ON c.scanner_id = u.id
-            WHERE c.ticket_id = %s
-        ''', (ticket['id'],))
+            WHERE c.event_id = %s AND c.ticket_id = %s
+        ''', (ticket['event_id'], ticket['id']))
         
         existing_checkin = cur.fetchone()
         
         if existing_checkin:
-            print("Ticket already checked in!")
+            scan_logger.info("Scan rejected: already checked in", extra={'ticket_number': ticket['ticket_number'], 'gate': gate})
+            metrics.count_scan(ticket['event_id'], gate, 'duplicate')
             return jsonify({
                 'success': False,
                 'error': 'This ticket has already been used',
@@ -103,12 +166,11 @@ def validate_ticket():
             }), 400
         
         # Create check-in record
-        print("Creating check-in record...")
         cur.execute('''
-            INSERT INTO check_ins (ticket_id, scanner_id, check_in_time)
-            VALUES (%s, %s, NOW())
+            INSERT INTO check_ins (ticket_id, event_id, scanner_id, check_in_time)
+            VALUES (%s, %s, %s, NOW())
             RETURNING check_in_time
-        ''', (ticket['id'], user_id))
+        ''', (ticket['id'], ticket['event_id'], user_id))
         
         checkin = cur.fetchone()
         
@@ -116,14 +178,16 @@ def validate_ticket():
         cur.execute('''
             UPDATE tickets 
             SET status = 'used' 
-            WHERE id = %s
-        ''', (ticket['id'],))
+            WHERE event_id = %s AND id = %s
+        ''', (ticket['event_id'], ticket['id']))
         
         conn.commit()
         cur.close()
         
-        print("Check-in successful!")
-        print("="*60 + "\n")
+        validation_index.upsert_ticket(ticket['event_id'], ticket['qr_code'], ticket['id'], 'used')
+        
+        scan_logger.info("Checked in", extra={'ticket_number': ticket['ticket_number'], 'gate': gate})
+        metrics.count_scan(ticket['event_id'], gate, 'checked_in')
         
         return jsonify({
             'success': True,
@@ -139,30 +203,66 @@ def validate_ticket():
         
     except Exception as e:
         conn.rollback()
-        print(f"Validation error: {e}")
-        import traceback
-        traceback.print_exc()
+        metrics.count_scan(scan_event_id, gate, 'error')
+        logger.exception("Validation error")
         return jsonify({'success': False, 'error': str(e)}), 500
         
     finally:
         release_db_connection(conn)
 
+def _journal_check_in(ticket, user_id, gate=None):
+    """Check in through the write-behind journal instead of a per-scan transaction"""
+    accepted, entry = checkin_journal.record_check_in(ticket['event_id'], ticket['id'], user_id)
+    
+    if not accepted:
+        scan_logger.info("Scan rejected: already checked in", extra={'ticket_number': ticket['ticket_number'], 'gate': gate})
+        metrics.count_scan(ticket['event_id'], gate, 'duplicate')
+        scanner = execute_query('SELECT full_name FROM users WHERE id = %s', (entry['scanner_id'],))
+        return jsonify({
+            'success': False,
+            'error': 'This ticket has already been used',
+            'previous_checkin': {
+                'ticket_number': ticket['ticket_number'],
+                'recipient_name': ticket['recipient_name'],
+                'check_in_time': entry['check_in_time'],
+                'scanner_name': scanner[0]['full_name'] if scanner else None
+            }
+        }), 400
+    
+    validation_index.upsert_ticket(ticket['event_id'], ticket['qr_code'], ticket['id'], 'used')
+    
+    scan_logger.info("Checked in (journaled)", extra={'ticket_number': ticket['ticket_number'], 'gate': gate})
+    metrics.count_scan(ticket['event_id'], gate, 'checked_in')
+    
+    return jsonify({
+        'success': True,
+        'message': 'Check-in successful!',
+        'data': {
+            'ticket_number': ticket['ticket_number'],
+            'recipient_name': ticket['recipient_name'],
+            'event_name': ticket['event_name'],
+            'ticket_type': ticket['ticket_type'],
+            'check_in_time': entry['check_in_time']
+        }
+    }), 200
+
 @scanner_bp.route('/lookup/<ticket_number>', methods=['GET'])
+@statement_timeout(2000)
 @scanner_required
 def lookup_ticket(ticket_number):
     """Lookup ticket by number for manual entry"""
-    print(f"\nLookup request for ticket: {ticket_number}")
+    scan_logger.info("Ticket lookup", extra={'ticket_number': ticket_number})
     
     try:
         ticket = execute_query('''
             SELECT t.*, 
                    e.name as event_name,
                    tt.name as ticket_type
-            FROM tickets t
+            FROM tickets_all t
             JOIN events e ON t.event_id = e.id
             JOIN ticket_types tt ON t.ticket_type_id = tt.id
             WHERE t.ticket_number = %s
-        ''', (ticket_number,))
+        ''', (ticket_number,), shard=shard_for_ticket_number(ticket_number))
         
         if not ticket:
             return jsonify({'success': False, 'error': 'Ticket not found'}), 404
@@ -173,10 +273,46 @@ def lookup_ticket(ticket_number):
         }), 200
         
     except Exception as e:
-        print(f"Lookup error: {e}")
+        logger.exception("Lookup error")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@scanner_bp.route('/search', methods=['GET'])
+@statement_timeout(2000)
+@scanner_required
+def search_tickets():
+    """Find an event's tickets by partial name, email, phone or ticket number (guests without a QR code)"""
+    try:
+        search = parse_search(request.args.get('eventId'), request.args.get('q'), request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    scan_logger.info("Ticket search", extra={'event_id': search.event_id})
+    
+    try:
+        shard = shard_for_event(search.event_id)
+        params = search_params(search)
+        tickets = execute_query(SEARCH_QUERY, params, shard=shard) or []
+        
+        # Typo-tolerant matches only when the substring matches don't fill the page
+        if len(tickets) < search.limit:
+            fuzzy = execute_query(FUZZY_SEARCH_QUERY, params, shard=shard) or []
+            tickets = merge_results(tickets, fuzzy, search.limit)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'tickets': tickets,
+                'total': len(tickets),
+                'truncated': len(tickets) >= search.limit
+            }
+        }), 200
+        
+    except Exception as e:
+        logger.exception("Search error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @scanner_bp.route('/stats', methods=['GET'])
+@statement_timeout(3000)
 @scanner_required
 def get_stats():
     """Get scanner statistics"""
@@ -184,20 +320,20 @@ def get_stats():
     user_id = int(user_id)
     
     try:
-        # Total scans
-        total = execute_query('''
+        # Total scans (a scanner may have worked events on several shards, archived ones included)
+        total = fan_out('''
             SELECT COUNT(*) as count 
-            FROM check_ins 
+            FROM check_ins_all 
             WHERE scanner_id = %s
-        ''', (user_id,))
+        ''', (user_id,), intent='primary')
         
         # Today's scans
-        today = execute_query('''
+        today = fan_out('''
             SELECT COUNT(*) as count 
-            FROM check_ins 
+            FROM check_ins_all 
             WHERE scanner_id = %s 
             AND DATE(check_in_time) = CURRENT_DATE
-        ''', (user_id,))
+        ''', (user_id,), intent='primary')
         
         # Duplicate attempts (tickets that were already used)
         # This is an approximation - we can't track failed scans easily
@@ -206,12 +342,12 @@ def get_stats():
         return jsonify({
             'success': True,
             'data': {
-                'total': total[0]['count'] if total else 0,
-                'today': today[0]['count'] if today else 0,
+                'total': sum(row['count'] for row in total),
+                'today': sum(row['count'] for row in today),
                 'duplicates': duplicates
             }
         }), 200
         
     except Exception as e:
-        print(f"Stats error: {e}")
+        logger.exception("Stats error")
         return jsonify({'success': False, 'error': str(e)}), 500
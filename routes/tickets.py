@@ -1,16 +1,24 @@
-from flask import Blueprint, request, jsonify
+import logging
+from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from database.db import execute_query, get_db_connection, release_db_connection
+from database.db import execute_query, execute_rows, get_db_connection, release_db_connection
+from database.query_budget import statement_timeout
 from functools import wraps
-import uuid
-import qrcode
-import io
-import base64
-from email_service import send_ticket_email
+import checkin_journal
+import validation_index
+import ticket_pdfs
+import image_pipeline
+import listings
+import tracing
+from ticket_codes import generate_ticket_number, build_qr_payload, qr_digest, render_qr_base64
+from database.shards import sharding_enabled, shard_for_event, shard_for_ticket_id
+from psycopg2 import Binary
 from psycopg2.extras import RealDictCursor
 
 tickets_bp = Blueprint('tickets', __name__)
 
+logger = logging.getLogger(__name__)
+
 def admin_required(fn):
     @wraps(fn)
     @jwt_required()
@@ -18,7 +26,8 @@ def admin_required(fn):
         user_id = get_jwt_identity()
         user_id = int(user_id)
         
-        user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
+        with tracing.span('admin_required', 'auth'):
+            user = execute_query('SELECT role FROM users WHERE id = %s', (user_id,))
         
         if not user or user[0]['role'] != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
@@ -30,15 +39,10 @@ def admin_required(fn):
 @admin_required
 def create_ticket():
     """Create ticket and send email"""
-    print("\n" + "="*60)
-    print("TICKET CREATION REQUEST")
-    print("="*60)
-    
     user_id = get_jwt_identity()
     user_id = int(user_id)
     
     data = request.get_json()
-    print(f"Request data: {data}")
     
     event_id = data.get('eventId')
     ticket_type_id = data.get('ticketTypeId')
@@ -51,25 +55,34 @@ def create_ticket():
     if not all([event_id, recipient_name, recipient_email]):
         return jsonify({'success': False, 'error': 'Missing required fields'}), 400
     
-    conn = get_db_connection()
+    if ticket_bg_image:
+        try:
+            ticket_bg_image = image_pipeline.normalize(ticket_bg_image)['full']
+        except image_pipeline.ImageError as e:
+            return jsonify({'success': False, 'error': f'Ticket background: {e}'}), 400
+    
+    # Tickets live on their event's shard
+    shard = shard_for_event(event_id)
+    conn = get_db_connection(shard=shard)
     conn.autocommit = False
     
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        print(f"Getting event {event_id}...")
         cur.execute('SELECT * FROM events WHERE id = %s', (event_id,))
         event = cur.fetchone()
         
         if not event:
-            print("Event not found")
             return jsonify({'success': False, 'error': 'Event not found'}), 404
         
-        print(f"Event found: {event['name']}")
+        if event['status'] == 'deleting':
+            return jsonify({'success': False, 'error': 'Event is being deleted'}), 400
+        
+        if event['archived_at']:
+            return jsonify({'success': False, 'error': 'Event is archived'}), 400
         
         # Handle ticket type
         if custom_ticket_type:
-            print(f"Creating custom ticket type: {custom_ticket_type['name']}")
             cur.execute('''
                 INSERT INTO ticket_types (event_id, name, price, quantity, is_custom, description)
                 VALUES (%s, %s, 0, 1, true, %s)
@@ -79,19 +92,16 @@ def create_ticket():
             ticket_type = cur.fetchone()
             ticket_type_id = ticket_type['id']
             ticket_type_name = ticket_type['name']
-            print(f"Custom ticket type created: {ticket_type_name} (ID: {ticket_type_id})")
+            logger.info("Custom ticket type created", extra={'event_id': event_id, 'ticket_type_id': ticket_type_id})
             
         else:
-            print(f"Getting ticket type {ticket_type_id}...")
             cur.execute('SELECT * FROM ticket_types WHERE id = %s', (ticket_type_id,))
             ticket_type = cur.fetchone()
             
             if not ticket_type:
-                print("Ticket type not found")
                 return jsonify({'success': False, 'error': 'Ticket type not found'}), 404
             
             ticket_type_name = ticket_type['name']
-            print(f"Ticket type found: {ticket_type_name}")
             
             # Update quantity
             cur.execute('''
@@ -99,35 +109,25 @@ def create_ticket():
                 SET quantity_issued = quantity_issued + 1 
                 WHERE id = %s
             ''', (ticket_type_id,))
-            print("Quantity updated")
         
         # Generate ticket number and QR code
-        ticket_number = f"TKT-{uuid.uuid4().hex[:8].upper()}"
-        qr_data = f"{ticket_number}|{event_id}|{recipient_email}"
-        
-        print(f"Generated ticket number: {ticket_number}")
+        ticket_number = generate_ticket_number(shard if sharding_enabled() else None)
+        qr_data = build_qr_payload(ticket_number, event_id, recipient_email)
         
         # Generate QR code
-        qr_img = qrcode.make(qr_data)
-        buffer = io.BytesIO()
-        qr_img.save(buffer)
-        buffer.seek(0)
-        qr_code_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        print("QR code generated")
+        qr_code_base64 = render_qr_base64(qr_data)
         
         # Insert ticket
-        print("Inserting ticket into database...")
         cur.execute('''
             INSERT INTO tickets (
-                event_id, ticket_type_id, qr_code, ticket_number,
+                event_id, ticket_type_id, qr_code, qr_digest, ticket_number,
                 recipient_name, recipient_email, recipient_phone,
                 ticket_bg_image, status, created_by, email_sent
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'active', %s, false)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'active', %s, false)
             RETURNING id, ticket_number, created_at
         ''', (
-            event_id, ticket_type_id, qr_data, ticket_number,
+            event_id, ticket_type_id, qr_data, Binary(qr_digest(qr_data)), ticket_number,
             recipient_name, recipient_email, recipient_phone,
             ticket_bg_image, user_id
         ))
@@ -135,25 +135,13 @@ def create_ticket():
         ticket = cur.fetchone()
         ticket_id = ticket['id']
         
-        print(f"Ticket inserted with ID: {ticket_id}")
-        
         # Commit
-        print("Committing transaction...")
         conn.commit()
-        print("Transaction committed!")
-        
-        # Verify
-        print("Verifying ticket in database...")
-        cur.execute('SELECT id, ticket_number FROM tickets WHERE id = %s', (ticket_id,))
-        verify = cur.fetchone()
-        
-        if verify:
-            print(f"VERIFIED: Ticket {verify['ticket_number']} exists in database!")
-        else:
-            print(f"WARNING: Ticket {ticket_id} NOT found after commit!")
-        
         cur.close()
         
+        validation_index.upsert_ticket(event_id, qr_data, ticket_id, 'active')
+        logger.info("Ticket created", extra={'ticket_id': ticket_id, 'ticket_number': ticket_number, 'event_id': event_id})
+        
         # Prepare response
         ticket_data = {
             'id': ticket_id,
@@ -165,14 +153,24 @@ def create_ticket():
             'createdAt': ticket['created_at'].isoformat()
         }
         
-        print("="*60)
-        print("TICKET CREATED SUCCESSFULLY")
-        print("="*60 + "\n")
-        
         # NOW SEND EMAIL
         try:
-            print("Sending ticket email...")
+            pdf_path = None
+            if ticket_pdfs.PDF_EMAIL_ATTACHMENT:
+                pdf_path = _render_pdf_for_email({
+                    'event_id': event_id,
+                    'ticket_number': ticket_number,
+                    'recipient_name': recipient_name,
+                    'qr_code': qr_data,
+                    'ticket_type_name': ticket_type_name,
+                    'event_name': event['name'],
+                    'event_date': event['event_date'],
+                    'location': event['location'],
+                    'ticket_bg_image': ticket_bg_image,
+                    'banner_image': event['banner_image'],
+                })
             
+            from email_service import send_ticket_email
             email_sent = send_ticket_email(
                 recipient_email=recipient_email,
                 recipient_name=recipient_name,
@@ -182,24 +180,23 @@ def create_ticket():
                 ticket_number=ticket_number,
                 ticket_type=ticket_type_name,
                 qr_code_base64=qr_code_base64,
-                ticket_bg_image=ticket_bg_image
+                ticket_bg_image=ticket_bg_image,
+                pdf_path=pdf_path
             )
             
             if email_sent:
-                print("Email sent successfully!")
                 # Update email_sent flag
                 execute_query(
-                    'UPDATE tickets SET email_sent = true WHERE id = %s',
-                    (ticket_id,),
-                    fetch=False
+                    'UPDATE tickets SET email_sent = true WHERE event_id = %s AND id = %s',
+                    (event_id, ticket_id),
+                    fetch=False,
+                    shard=shard
                 )
             else:
-                print("Email failed to send")
+                logger.warning("Ticket email not sent", extra={'ticket_id': ticket_id})
                 
-        except Exception as email_error:
-            print(f"Email error (ticket still created): {email_error}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Email error (ticket still created)")
         
         return jsonify({
             'success': True,
@@ -208,14 +205,7 @@ def create_ticket():
         }), 201
         
     except Exception as e:
-        print("\n" + "!"*60)
-        print("ERROR OCCURRED")
-        print("!"*60)
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
-        print("!"*60 + "\n")
-        
+        logger.exception("Create ticket error")
         conn.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
         
@@ -223,22 +213,37 @@ def create_ticket():
         release_db_connection(conn)
 
 @tickets_bp.route('/event/<int:event_id>', methods=['GET'])
+@statement_timeout(10000)
 @jwt_required()
 def get_event_tickets(event_id):
-    """Get all tickets for an event"""
+    """Get all tickets for an event (?format=rows|columnar for the compact forms, see listings.py)"""
     try:
-        tickets = execute_query('''
-            SELECT t.*, 
-                   tt.name as ticket_type_name,
-                   c.check_in_time,
-                   u.full_name as scanner_name
-            FROM tickets t
-            JOIN ticket_types tt ON t.ticket_type_id = tt.id
-            LEFT JOIN check_ins c ON t.id = c.ticket_id
-            LEFT JOIN users u ON c.scanner_id = u.id
-            WHERE t.event_id = %s
-            ORDER BY t.created_at DESC
-        ''', (event_id,))
+        fmt = listings.requested_format(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    query = '''
+        SELECT t.*, 
+               tt.name as ticket_type_name,
+               c.check_in_time,
+               u.full_name as scanner_name
+        FROM tickets_all t
+        JOIN ticket_types tt ON t.ticket_type_id = tt.id
+        LEFT JOIN check_ins_all c ON t.id = c.ticket_id
+        LEFT JOIN users u ON c.scanner_id = u.id
+        WHERE t.event_id = %s
+        ORDER BY t.created_at DESC
+    '''
+    
+    try:
+        if fmt:
+            columns, rows = execute_rows(query, (event_id,), shard=shard_for_event(event_id))
+            return jsonify({
+                'success': True,
+                'data': dict(listings.compact(columns, rows, fmt), format=fmt, total=len(rows))
+            }), 200
+        
+        tickets = execute_query(query, (event_id,), intent='read', shard=shard_for_event(event_id))
         
         return jsonify({
             'success': True,
@@ -280,10 +285,37 @@ def update_ticket(ticket_id):
         return jsonify({'success': False, 'error': 'No fields to update'}), 400
     
     values.append(ticket_id)
-    query = f"UPDATE tickets SET {', '.join(fields)} WHERE id = %s RETURNING *"
+    query = f'''
+        UPDATE tickets SET {', '.join(fields)} WHERE id = %s
+        RETURNING id, event_id, ticket_type_id, qr_code, ticket_number,
+                  recipient_name, recipient_email, recipient_phone, ticket_bg_image,
+                  status, email_sent, created_by, created_at, updated_at
+    '''
+    
+    if data.get('status') == 'active':
+        # A re-activated ticket can be scanned again, by either scan path, so its check-in goes too
+        query = f'''
+            WITH updated AS ({query}),
+            cleared AS (
+                DELETE FROM check_ins c USING updated u
+                WHERE c.event_id = u.event_id AND c.ticket_id = u.id
+            )
+            SELECT * FROM updated
+        '''
     
     try:
-        updated = execute_query(query, tuple(values))
+        updated = execute_query(query, tuple(values), shard=shard_for_ticket_id(ticket_id))
+        
+        if updated and data.get('status') == 'active':
+            checkin_journal.forget_ticket(updated[0]['event_id'], ticket_id)
+        
+        if updated and 'status' in data:
+            validation_index.upsert_ticket(
+                updated[0]['event_id'], updated[0]['qr_code'], ticket_id, updated[0]['status']
+            )
+        
+        if updated:
+            ticket_pdfs.forget_ticket(updated[0]['event_id'], updated[0]['ticket_number'])
         
         return jsonify({
             'success': True,
@@ -297,35 +329,35 @@ def update_ticket(ticket_id):
 @admin_required
 def cancel_ticket(ticket_id):
     """Delete ticket completely"""
-    conn = get_db_connection()
+    conn = get_db_connection(shard=shard_for_ticket_id(ticket_id))
     conn.autocommit = False
     
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        print(f"Deleting ticket {ticket_id}...")
-        
-        cur.execute('SELECT ticket_number, status FROM tickets WHERE id = %s', (ticket_id,))
+        cur.execute('SELECT ticket_number, status, event_id, qr_code FROM tickets WHERE id = %s', (ticket_id,))
         ticket = cur.fetchone()
         
         if not ticket:
             return jsonify({'success': False, 'error': 'Ticket not found'}), 404
         
         # Delete check-ins first
-        cur.execute('DELETE FROM check_ins WHERE ticket_id = %s', (ticket_id,))
+        cur.execute('DELETE FROM check_ins WHERE event_id = %s AND ticket_id = %s', (ticket['event_id'], ticket_id))
         deleted_checkins = cur.rowcount
         
-        if deleted_checkins > 0:
-            print(f"Deleted {deleted_checkins} check-in record(s)")
-        
         # Delete the ticket
-        cur.execute('DELETE FROM tickets WHERE id = %s', (ticket_id,))
-        print(f"Deleted ticket: {ticket['ticket_number']}")
+        cur.execute('DELETE FROM tickets WHERE event_id = %s AND id = %s', (ticket['event_id'], ticket_id))
         
         conn.commit()
         cur.close()
         
-        print(f"Ticket {ticket_id} deleted successfully")
+        checkin_journal.forget_ticket(ticket['event_id'], ticket_id)
+        validation_index.remove_ticket(ticket['event_id'], ticket['qr_code'], ticket_id)
+        ticket_pdfs.forget_ticket(ticket['event_id'], ticket['ticket_number'])
+        
+        logger.info("Ticket deleted", extra={
+            'ticket_id': ticket_id, 'ticket_number': ticket['ticket_number'], 'check_ins': deleted_checkins
+        })
         
         return jsonify({
             'success': True,
@@ -334,9 +366,7 @@ def cancel_ticket(ticket_id):
         
     except Exception as e:
         conn.rollback()
-        print(f"Delete ticket error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Delete ticket error")
         return jsonify({'success': False, 'error': str(e)}), 500
         
     finally:
@@ -358,7 +388,7 @@ def resend_ticket(ticket_id):
             JOIN events e ON t.event_id = e.id
             JOIN ticket_types tt ON t.ticket_type_id = tt.id
             WHERE t.id = %s
-        ''', (ticket_id,))
+        ''', (ticket_id,), shard=shard_for_ticket_id(ticket_id))
         
         if not ticket:
             return jsonify({'success': False, 'error': 'Ticket not found'}), 404
@@ -366,13 +396,14 @@ def resend_ticket(ticket_id):
         ticket = ticket[0]
         
         # Generate QR code
-        qr_img = qrcode.make(ticket['qr_code'])
-        buffer = io.BytesIO()
-        qr_img.save(buffer)
-        buffer.seek(0)
-        qr_image_base64 = base64.b64encode(buffer.getvalue()).decode()
+        qr_image_base64 = render_qr_base64(ticket['qr_code'])
+        
+        pdf_path = None
+        if ticket_pdfs.PDF_EMAIL_ATTACHMENT:
+            pdf_path = _render_pdf_for_email(ticket)
         
         # Send email
+        from email_service import send_ticket_email
         email_sent = send_ticket_email(
             recipient_email=ticket['recipient_email'],
             recipient_name=ticket['recipient_name'],
@@ -382,14 +413,16 @@ def resend_ticket(ticket_id):
             ticket_number=ticket['ticket_number'],
             ticket_type=ticket['ticket_type_name'],
             qr_code_base64=qr_image_base64,
-            ticket_bg_image=ticket.get('ticket_bg_image') or ticket.get('banner_image')
+            ticket_bg_image=ticket.get('ticket_bg_image') or ticket.get('banner_image'),
+            pdf_path=pdf_path
         )
         
         if email_sent:
             execute_query(
-                'UPDATE tickets SET email_sent = true WHERE id = %s',
-                (ticket_id,),
-                fetch=False
+                'UPDATE tickets SET email_sent = true WHERE event_id = %s AND id = %s',
+                (ticket['event_id'], ticket_id),
+                fetch=False,
+                shard=shard_for_ticket_id(ticket_id)
             )
             
             return jsonify({
@@ -403,14 +436,44 @@ def resend_ticket(ticket_id):
             }), 500
             
     except Exception as e:
-        print(f"Resend error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Resend error")
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
         
+@tickets_bp.route('/<int:ticket_id>/pdf', methods=['GET'])
+@admin_required
+def download_ticket_pdf(ticket_id):
+    """Download a ticket as PDF (the stored copy, rendered now if there is none)"""
+    try:
+        ticket = ticket_pdfs.ticket_pdf(ticket_id)
+        
+        if not ticket:
+            return jsonify({'success': False, 'error': 'Ticket not found'}), 404
+        
+        if ticket['status'] == 'cancelled':
+            return jsonify({'success': False, 'error': 'Ticket is cancelled'}), 400
+        
+        return send_file(
+            ticket['path'],
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f"{ticket['ticket_number']}.pdf"
+        )
+        
+    except Exception as e:
+        logger.exception("Ticket PDF error")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _render_pdf_for_email(ticket):
+    """The ticket's PDF path for attaching, or None so the email still goes out without it"""
+    try:
+        return ticket_pdfs.render_ticket(ticket)
+    except Exception:
+        logger.exception("Ticket PDF not rendered, emailing without it")
+        return None
+
 @tickets_bp.route('/test-email', methods=['GET'])
 def test_email_public():
     """Test email configuration - no auth required for testing"""
@@ -422,15 +485,6 @@ def test_email_public():
     email_user = os.getenv('EMAIL_USER')
     email_password = os.getenv('EMAIL_PASSWORD')
     
-    print("\n" + "="*60)
-    print("EMAIL CONFIGURATION TEST")
-    print("="*60)
-    print(f"EMAIL_HOST: {email_host}")
-    print(f"EMAIL_PORT: {email_port}")
-    print(f"EMAIL_USER: {email_user}")
-    print(f"EMAIL_PASSWORD: {'SET (length: ' + str(len(email_password)) + ')' if email_password else 'NOT SET'}")
-    print("="*60)
-    
     if not all([email_host, email_user, email_password]):
         return jsonify({
             'success': False,
@@ -456,22 +510,12 @@ def test_email_public():
         msg['From'] = email_user
         msg['To'] = email_user  # Send to yourself
         
-        print("Attempting SMTP connection...")
-        
         with smtplib.SMTP(email_host, int(email_port), timeout=15) as server:
-            print("Connected to SMTP server")
-            
-            print("Starting TLS...")
             server.starttls()
-            print("TLS started")
-            
-            print("Logging in...")
             server.login(email_user, email_password)
-            print("Login successful")
-            
-            print("Sending email...")
             server.send_message(msg)
-            print("Email sent!")
+        
+        logger.info("Test email sent via %s", email_host)
         
         return jsonify({
             'success': True,
@@ -480,7 +524,7 @@ def test_email_public():
         }), 200
         
     except smtplib.SMTPAuthenticationError as e:
-        print(f"Authentication failed: {e}")
+        logger.warning("Test email SMTP authentication failed: %s", e)
         return jsonify({
             'success': False,
             'error': 'SMTP Authentication Failed',
@@ -489,7 +533,7 @@ def test_email_public():
         }), 500
         
     except socket.timeout:
-        print("Connection timeout")
+        logger.warning("Test email SMTP connection timeout (%s)", email_host)
         return jsonify({
             'success': False,
             'error': 'Connection Timeout',
@@ -497,9 +541,7 @@ def test_email_public():
         }), 500
         
     except Exception as e:
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Test email error")
         return jsonify({
             'success': False,
             'error': str(e),
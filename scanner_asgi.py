@@ -0,0 +1,428 @@
+"""
+Async variant of the scanner endpoints (routes/scanner.py) as a plain ASGI app.
+
+Scanner traffic is lots of tiny, I/O-bound requests. Under the sync Flask
+app each one holds a worker thread while it waits on Postgres, so a gate
+rush runs out of threads long before the CPU is busy. Here every request is
+a coroutine on one event loop and waits on an asyncpg pool instead.
+
+Serves the same paths and JSON contracts as the blueprint:
+
+    POST /api/scanner/validate
+    GET  /api/scanner/lookup/<ticket_number>
+    GET  /api/scanner/search?eventId=&q=&limit=
+    GET  /api/scanner/stats
+
+Run it next to the Flask app and route /api/scanner/* to it at the proxy:
+
+    uvicorn scanner_asgi:app --host 0.0.0.0 --port 5001 --workers 2
+
+Tokens are the ones the Flask app issues (same JWT_SECRET_KEY). The
+validation index and the check-in journal are the same modules the sync
+path uses; their occasional blocking work (file locks, journal fsync,
+index refresh queries) runs in a worker thread so it never stalls the loop.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import decimal
+from datetime import date
+from urllib.parse import parse_qs
+import jwt
+from werkzeug.http import http_date
+from dotenv import load_dotenv
+from app_logging import configure_logging, sampled_logger, request_id_var
+from database import async_db
+from database.shards import shard_for_qr_payload, shard_for_ticket_number, shard_for_event
+from database.search import parse_search, search_params, merge_results, as_asyncpg, SEARCH_QUERY, FUZZY_SEARCH_QUERY
+from ticket_codes import qr_digest, event_id_from_payload
+import checkin_journal
+import metrics
+import validation_index
+
+load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
+scan_logger = sampled_logger(f'{__name__}.scans')
+
+JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
+QR_LEGACY_LOOKUP = os.getenv('QR_LEGACY_LOOKUP', 'true').lower() == 'true'
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, PUT, DELETE, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization'),
+    (b'access-control-max-age', b'3600'),
+]
+
+TICKET_SCAN_QUERY = '''
+    SELECT t.*,
+           e.name as event_name,
+           tt.name as ticket_type
+    FROM tickets t
+    JOIN events e ON t.event_id = e.id
+    JOIN ticket_types tt ON t.ticket_type_id = tt.id
+'''
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body):
+        super().__init__(body)
+        self.status = status
+        self.body = body
+
+
+def _json_default(o):
+    # Same encoding as Flask's default JSON provider
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+async def _send_json(send, status, body, request_id=None):
+    payload = json.dumps(body, default=_json_default, sort_keys=True, separators=(',', ':')).encode()
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(payload)).encode()),
+    ] + CORS_HEADERS
+    if request_id:
+        headers.append((b'x-request-id', request_id.encode()))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers,
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _read_json(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    raw = b''.join(chunks)
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        raise HTTPError(400, {'success': False, 'error': 'Invalid JSON body'})
+
+
+async def _scanner_user(scope):
+    """JWT check matching @jwt_required() plus scanner_required"""
+    headers = dict(scope['headers'])
+    auth = headers.get(b'authorization', b'').decode()
+    if not auth:
+        raise HTTPError(401, {'msg': 'Missing Authorization Header'})
+    scheme, _, token = auth.partition(' ')
+    if scheme != 'Bearer' or not token:
+        raise HTTPError(422, {'msg': "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'"})
+
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        raise HTTPError(401, {'msg': 'Token has expired'})
+    except jwt.InvalidTokenError as e:
+        raise HTTPError(422, {'msg': str(e)})
+    if claims.get('type') != 'access':
+        raise HTTPError(422, {'msg': 'Only non-refresh tokens are allowed'})
+
+    user_id = int(claims['sub'])
+    user = await async_db.fetchrow('SELECT role FROM users WHERE id = $1', user_id)
+    if not user or user['role'] not in ['scanner', 'admin']:
+        raise HTTPError(403, {'success': False, 'error': 'Scanner access required'})
+    return user_id
+
+
+async def _find_ticket(conn, qr_code):
+    payload_event_id = event_id_from_payload(qr_code)
+    if payload_event_id is not None:
+        ticket = await conn.fetchrow(
+            TICKET_SCAN_QUERY + ' WHERE t.event_id = $1 AND t.qr_digest = $2 AND t.qr_code = $3',
+            payload_event_id, qr_digest(qr_code), qr_code
+        )
+    else:
+        ticket = await conn.fetchrow(
+            TICKET_SCAN_QUERY + ' WHERE t.qr_digest = $1 AND t.qr_code = $2',
+            qr_digest(qr_code), qr_code
+        )
+
+    if not ticket and QR_LEGACY_LOOKUP:
+        ticket = await conn.fetchrow(
+            TICKET_SCAN_QUERY + ' WHERE t.qr_digest IS NULL AND t.qr_code = $1',
+            qr_code
+        )
+    return ticket
+
+
+async def validate_ticket(scope, receive):
+    user_id = await _scanner_user(scope)
+    data = await _read_json(receive)
+    qr_code = data.get('qrCode') if isinstance(data, dict) else None
+    gate = (data.get('gate') if isinstance(data, dict) else None) \
+        or dict(scope['headers']).get(b'x-scanner-gate', b'').decode() or None
+    scan_event_id = event_id_from_payload(qr_code) if qr_code else None
+
+    if not qr_code:
+        metrics.count_scan(None, gate, 'invalid')
+        return 400, {'success': False, 'error': 'QR code required'}
+
+    indexed_status = await asyncio.to_thread(validation_index.check, qr_code)
+    if indexed_status == 'unknown':
+        metrics.count_scan(scan_event_id, gate, 'not_found')
+        return 404, {'success': False, 'error': 'Ticket not found. Please check the ticket number.'}
+    if indexed_status == 'cancelled':
+        metrics.count_scan(scan_event_id, gate, 'cancelled')
+        return 400, {'success': False, 'error': 'Ticket is cancelled and cannot be used'}
+
+    async with async_db.get_pool(shard_for_qr_payload(qr_code)).acquire() as conn:
+        ticket = await _find_ticket(conn, qr_code)
+
+        if not ticket:
+            metrics.count_scan(scan_event_id, gate, 'not_found')
+            return 404, {'success': False, 'error': 'Ticket not found. Please check the ticket number.'}
+
+        if ticket['status'] != 'active':
+            metrics.count_scan(ticket['event_id'], gate, ticket['status'])
+            return 400, {'success': False, 'error': f'Ticket is {ticket["status"]} and cannot be used'}
+
+        if await asyncio.to_thread(checkin_journal.is_enabled):
+            return await _journal_check_in(ticket, user_id, gate)
+
+        async with conn.transaction():
+            existing_checkin = await conn.fetchrow('''
+                SELECT c.*, u.full_name as scanner_name
+                FROM check_ins c
+                JOIN users u ON c.scanner_id = u.id
+                WHERE c.event_id = $1 AND c.ticket_id = $2
+            ''', ticket['event_id'], ticket['id'])
+
+            if existing_checkin:
+                metrics.count_scan(ticket['event_id'], gate, 'duplicate')
+                return 400, {
+                    'success': False,
+                    'error': 'This ticket has already been used',
+                    'previous_checkin': {
+                        'ticket_number': ticket['ticket_number'],
+                        'recipient_name': ticket['recipient_name'],
+                        'check_in_time': existing_checkin['check_in_time'].isoformat(),
+                        'scanner_name': existing_checkin['scanner_name']
+                    }
+                }
+
+            checkin = await conn.fetchrow('''
+                INSERT INTO check_ins (ticket_id, event_id, scanner_id, check_in_time)
+                VALUES ($1, $2, $3, NOW())
+                RETURNING check_in_time
+            ''', ticket['id'], ticket['event_id'], user_id)
+
+            await conn.execute(
+                "UPDATE tickets SET status = 'used' WHERE event_id = $1 AND id = $2",
+                ticket['event_id'], ticket['id']
+            )
+
+    await asyncio.to_thread(
+        validation_index.upsert_ticket, ticket['event_id'], ticket['qr_code'], ticket['id'], 'used'
+    )
+    metrics.count_scan(ticket['event_id'], gate, 'checked_in')
+
+    return 200, {
+        'success': True,
+        'message': 'Check-in successful!',
+        'data': {
+            'ticket_number': ticket['ticket_number'],
+            'recipient_name': ticket['recipient_name'],
+            'event_name': ticket['event_name'],
+            'ticket_type': ticket['ticket_type'],
+            'check_in_time': checkin['check_in_time'].isoformat()
+        }
+    }
+
+
+async def _journal_check_in(ticket, user_id, gate):
+    accepted, entry = await asyncio.to_thread(
+        checkin_journal.record_check_in, ticket['event_id'], ticket['id'], user_id
+    )
+
+    if not accepted:
+        metrics.count_scan(ticket['event_id'], gate, 'duplicate')
+        scanner = await async_db.fetchrow('SELECT full_name FROM users WHERE id = $1', entry['scanner_id'])
+        return 400, {
+            'success': False,
+            'error': 'This ticket has already been used',
+            'previous_checkin': {
+                'ticket_number': ticket['ticket_number'],
+                'recipient_name': ticket['recipient_name'],
+                'check_in_time': entry['check_in_time'],
+                'scanner_name': scanner['full_name'] if scanner else None
+            }
+        }
+
+    await asyncio.to_thread(
+        validation_index.upsert_ticket, ticket['event_id'], ticket['qr_code'], ticket['id'], 'used'
+    )
+    metrics.count_scan(ticket['event_id'], gate, 'checked_in')
+
+    return 200, {
+        'success': True,
+        'message': 'Check-in successful!',
+        'data': {
+            'ticket_number': ticket['ticket_number'],
+            'recipient_name': ticket['recipient_name'],
+            'event_name': ticket['event_name'],
+            'ticket_type': ticket['ticket_type'],
+            'check_in_time': entry['check_in_time']
+        }
+    }
+
+
+async def lookup_ticket(scope, receive, ticket_number):
+    await _scanner_user(scope)
+
+    ticket = await async_db.fetchrow('''
+        SELECT t.*,
+               e.name as event_name,
+               tt.name as ticket_type
+        FROM tickets_all t
+        JOIN events e ON t.event_id = e.id
+        JOIN ticket_types tt ON t.ticket_type_id = tt.id
+        WHERE t.ticket_number = $1
+    ''', ticket_number, shard=shard_for_ticket_number(ticket_number))
+
+    if not ticket:
+        return 404, {'success': False, 'error': 'Ticket not found'}
+
+    return 200, {'success': True, 'ticket': dict(ticket)}
+
+
+async def search_tickets(scope, receive):
+    await _scanner_user(scope)
+
+    args = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        search = parse_search(
+            args.get('eventId', [None])[0], args.get('q', [None])[0], args.get('limit', [None])[0]
+        )
+    except ValueError as e:
+        return 400, {'success': False, 'error': str(e)}
+
+    scan_logger.info("Ticket search", extra={'event_id': search.event_id})
+
+    # The shard directory is only on the sync connection pools
+    shard = await asyncio.to_thread(shard_for_event, search.event_id)
+    params = search_params(search)
+    tickets = [dict(row) for row in await async_db.fetch(*as_asyncpg(SEARCH_QUERY, params), shard=shard)]
+
+    if len(tickets) < search.limit:
+        fuzzy = await async_db.fetch(*as_asyncpg(FUZZY_SEARCH_QUERY, params), shard=shard)
+        tickets = merge_results(tickets, [dict(row) for row in fuzzy], search.limit)
+
+    return 200, {
+        'success': True,
+        'data': {
+            'tickets': tickets,
+            'total': len(tickets),
+            'truncated': len(tickets) >= search.limit
+        }
+    }
+
+
+async def get_stats(scope, receive):
+    user_id = await _scanner_user(scope)
+
+    rows = await async_db.fan_out('''
+        SELECT COUNT(*) as total,
+               COUNT(*) FILTER (WHERE DATE(check_in_time) = CURRENT_DATE) as today
+        FROM check_ins_all
+        WHERE scanner_id = $1
+    ''', user_id)
+
+    return 200, {
+        'success': True,
+        'data': {
+            'total': sum(row['total'] for row in rows),
+            'today': sum(row['today'] for row in rows),
+            'duplicates': 0
+        }
+    }
+
+
+def _route(method, path):
+    if method == 'POST' and path == '/api/scanner/validate':
+        return validate_ticket, ()
+    if method == 'GET' and path == '/api/scanner/stats':
+        return get_stats, ()
+    if method == 'GET' and path == '/api/scanner/search':
+        return search_tickets, ()
+    if method == 'GET' and path.startswith('/api/scanner/lookup/'):
+        ticket_number = path[len('/api/scanner/lookup/'):]
+        if ticket_number and '/' not in ticket_number:
+            return lookup_ticket, (ticket_number,)
+    return None, ()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await async_db.init_pools()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_db.close_pools()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+
+    if method == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 200, 'headers': CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    if scope['path'] == '/health':
+        await _send_json(send, 200, {'status': 'healthy', 'app': 'scanner-async'})
+        return
+
+    handler, args = _route(method, scope['path'])
+    if handler is None:
+        await _send_json(send, 404, {'success': False, 'error': 'Endpoint not found'})
+        return
+
+    request_id = dict(scope['headers']).get(b'x-request-id', b'').decode() or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    started = time.perf_counter()
+
+    try:
+        status, body = await handler(scope, receive, *args)
+    except HTTPError as e:
+        status, body = e.status, e.body
+    except Exception as e:
+        logger.exception("Async scanner error")
+        status, body = 500, {'success': False, 'error': str(e)}
+
+    scan_logger.info("Scanner request", extra={
+        'method': method, 'path': scope['path'], 'status': status,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+    })
+    await _send_json(send, status, body, request_id)
@@ -5,8 +5,11 @@ import os
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
-import bcrypt  # ← BACK TO BCRYPT
-from database.db import execute_query, init_db
+import math
+import time
+import random
+from password_hashing import hash_password
+from database.db import execute_query, init_db, get_db_connection, release_db_connection
 from datetime import datetime, timedelta
 
 def seed_database():
@@ -20,8 +23,8 @@ def seed_database():
         print(f"❌ Failed to initialize database: {e}")
         return
     
-    # Hash password using bcrypt (matches auth.py)
-    password_hash = bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')  # ← BCRYPT
+    # Hash password using bcrypt at BCRYPT_ROUNDS (matches auth.py)
+    password_hash = hash_password('password123')
     
     # Create admin user
     print("👤 Creating admin user...")
@@ -124,9 +127,370 @@ def seed_database():
     print("\n🎉 Ready to use!")
     print("=" * 60 + "\n")
 
+# --- Scale mode --------------------------------------------------------------
+#
+#   python seed.py --scale --events 500 --tickets 5000000 --checkins 3000000 --seed 1
+#
+# Production-sized synthetic data for index, partitioning and query work.
+# Everything is drawn from --seed, so two runs against freshly migrated
+# databases produce the same rows, ids included. Events are spread over the
+# year before --anchor and the quarter after it, with log-normal sizes (a
+# few festivals, many small shows). Tickets follow the default ticket-type
+# mix and sell in a ramp towards the event, and about 2% are cancelled.
+# Only events before the anchor have check-ins. Those arrive around doors
+# open, and every checked-in ticket is 'used', as the scanner leaves it.
+#
+# Each event is one transaction on its own shard, in the same order as
+# create_event: the event row, its partitions when tickets is
+# LIST-partitioned, then its ticket types. Tickets and check-ins follow
+# with COPY. Ticket ids are reserved from the shard's tickets sequence
+# under a table lock, so a running app only waits while an event is written.
+
+SCALE_ANCHOR = datetime(2025, 6, 1)
+SCALE_PASSWORD = 'password123'
+SCALE_CANCELLED_SHARE = 0.02
+SCALE_UNSENT_SHARE = 0.01
+
+# name, price, share of an event's tickets, description, color (create_event's defaults)
+SCALE_TICKET_TYPES = [
+    ('Early bird', 50.00, 0.42, 'Early bird special pricing', '#10B981'),
+    ('Late bird', 80.00, 0.33, 'Regular pricing', '#3B82F6'),
+    ('VIP', 150.00, 0.15, 'VIP access and perks', '#8B5CF6'),
+    ('Table for 4', 300.00, 0.07, 'Reserved table for 4 people', '#F59E0B'),
+    ('Table for 8', 500.00, 0.03, 'Reserved table for 8 people', '#EF4444'),
+]
+
+_FIRST_NAMES = [
+    'Adaeze', 'Chinedu', 'Tunde', 'Ngozi', 'Emeka', 'Funmi', 'Ibrahim', 'Aisha', 'Segun', 'Kemi',
+    'Obinna', 'Zainab', 'Yusuf', 'Bola', 'Ifeoma', 'Kunle', 'Halima', 'Uche', 'Temitope', 'Musa',
+    'Amaka', 'Femi', 'Hauwa', 'Chioma', 'Dayo', 'Nneka', 'Sani', 'Yemi', 'Efe', 'Tobi',
+]
+_LAST_NAMES = [
+    'Okafor', 'Adeyemi', 'Bello', 'Eze', 'Ogunleye', 'Abubakar', 'Nwosu', 'Balogun', 'Okonkwo', 'Lawal',
+    'Ibrahim', 'Adebayo', 'Obi', 'Danjuma', 'Afolabi', 'Chukwu', 'Mohammed', 'Oyelaran', 'Nnamdi', 'Usman',
+]
+_EVENT_KINDS = [
+    'Tech Conference', 'Afrobeats Night', 'Comedy Special', 'Startup Summit', 'Food Festival',
+    'Jazz Evening', 'Fashion Week', 'Gospel Concert', 'Film Premiere', 'Book Fair',
+]
+_VENUES = [
+    ('Eko Convention Centre', 'Lagos'), ('Landmark Centre', 'Lagos'), ('Muson Centre', 'Lagos'),
+    ('International Conference Centre', 'Abuja'), ('Transcorp Hilton', 'Abuja'),
+    ('Civic Centre', 'Port Harcourt'), ('Liberation Stadium', 'Port Harcourt'),
+    ('Lekan Salami Stadium', 'Ibadan'), ('Trade Fair Complex', 'Kano'), ('Dome', 'Enugu'),
+]
+
+TICKET_COPY_COLUMNS = (
+    'id', 'event_id', 'ticket_type_id', 'qr_code', 'qr_digest', 'ticket_number',
+    'recipient_name', 'recipient_email', 'recipient_phone', 'status', 'email_sent',
+    'created_by', 'created_at', 'updated_at',
+)
+CHECK_IN_COPY_COLUMNS = ('ticket_id', 'event_id', 'scanner_id', 'check_in_time')
+
+def _split(total, weights):
+    """Integers proportional to weights that add up to exactly total (largest remainder)"""
+    scaled = [int(weight * 1_000_000) for weight in weights]
+    scale = sum(scaled)
+    if total <= 0 or scale <= 0:
+        return [0] * len(weights)
+    
+    counts = [total * weight // scale for weight in scaled]
+    by_remainder = sorted(range(len(scaled)), key=lambda i: -(total * scaled[i] % scale))
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+def _split_capped(total, weights, caps):
+    """_split with no count above its cap; what a capped entry can't take goes to the others"""
+    counts = [0] * len(weights)
+    while total > 0:
+        open_slots = [i for i in range(len(weights)) if weights[i] > 0 and counts[i] < caps[i]]
+        if not open_slots:
+            raise ValueError("not enough room for the requested counts")
+        
+        shares = _split(total, [weights[i] for i in open_slots])
+        total = 0
+        for i, share in zip(open_slots, shares):
+            taken = min(share, caps[i] - counts[i])
+            counts[i] += taken
+            total += share - taken
+    return counts
+
+def plan_scale(events, tickets, checkins, seed=1, anchor=SCALE_ANCHOR):
+    """
+    Name, date, status and ticket/cancellation/check-in counts for every
+    event. Cheap, so it is drawn up front and bad counts fail before
+    anything is written.
+    """
+    if events < 1 or tickets < 0 or checkins < 0:
+        raise ValueError("--events must be at least 1 and the counts can't be negative")
+    
+    rng = random.Random(f'plan:{seed}')
+    plans = []
+    for index in range(events):
+        day = anchor + timedelta(days=rng.uniform(-365, 90))
+        event_date = day.replace(hour=rng.choice((10, 14, 18, 19, 20)), minute=0, second=0, microsecond=0)
+        kind = rng.choice(_EVENT_KINDS)
+        venue, city = rng.choice(_VENUES)
+        plans.append({
+            'index': index,
+            'name': f'{kind} {city} {event_date.year} #{index + 1}',
+            'location': f'{venue}, {city}',
+            'event_date': event_date,
+            'status': 'closed' if event_date < anchor - timedelta(days=7) else 'active',
+            'past': event_date < anchor,
+            'size': rng.lognormvariate(0, 1.2),
+            'attendance': rng.uniform(0.55, 0.95),
+        })
+    
+    for plan, count in zip(plans, _split(tickets, [plan['size'] for plan in plans])):
+        plan['tickets'] = count
+        plan['cancelled'] = round(count * SCALE_CANCELLED_SHARE)
+    
+    # Only events that already happened get check-ins, at most one per valid ticket
+    room = [plan['tickets'] - plan['cancelled'] if plan['past'] else 0 for plan in plans]
+    if checkins > sum(room):
+        raise ValueError(f"only {sum(room):,} valid tickets belong to events before {anchor:%Y-%m-%d}; "
+                         f"lower --checkins or move --anchor later")
+    weights = [room[i] * plan['attendance'] for i, plan in enumerate(plans)]
+    for plan, count in zip(plans, _split_capped(checkins, weights, room)):
+        plan['checkins'] = count
+    return plans
+
+def seed_scale(events, tickets, checkins, scanners=40, seed=1, anchor=SCALE_ANCHOR):
+    """Write production-sized synthetic data with COPY (see the notes above)"""
+    from database.shards import sharding_enabled, replicate_user
+    
+    if checkins and scanners < 1:
+        raise ValueError("check-ins need at least one scanner account")
+    plans = plan_scale(events, tickets, checkins, seed, anchor)
+    
+    print(f"🌱 Seeding {events:,} events, {tickets:,} tickets and {checkins:,} check-ins "
+          f"(seed {seed}, anchor {anchor:%Y-%m-%d})...")
+    init_db()
+    
+    admin_id, scanner_ids = _scale_accounts(scanners)
+    if sharding_enabled():
+        for user_id in [admin_id] + scanner_ids:
+            replicate_user(user_id)
+    print(f"   ✅ Admin and {len(scanner_ids)} scanner accounts (password: {SCALE_PASSWORD})")
+    
+    started = time.perf_counter()
+    shards = set()
+    written = 0
+    for plan in plans:
+        shards.add(_seed_scale_event(plan, seed, admin_id, scanner_ids, anchor))
+        written += plan['tickets'] + plan['checkins']
+        done = plan['index'] + 1
+        if done % 25 == 0 or done == len(plans):
+            elapsed = time.perf_counter() - started
+            print(f"   ...{done}/{len(plans)} events, {written:,} rows ({written / elapsed:,.0f} rows/s)")
+    
+    print("📊 Analyzing...")
+    for shard in sorted(shards):
+        _analyze(shard)
+    print(f"\n✨ Scale data seeded in {time.perf_counter() - started:.0f}s\n")
+
+def _scale_accounts(scanners):
+    """The admin account plus `scanners` scanner accounts; returns (admin id, scanner ids)"""
+    password_hash = hash_password(SCALE_PASSWORD)
+    accounts = [('admin@ticket9ja.com', 'Admin User', 'admin')] + [
+        (f'scanner{n}@scale.ticket9ja.com', f'Gate Scanner {n}', 'scanner') for n in range(1, scanners + 1)
+    ]
+    
+    ids = []
+    for email, full_name, role in accounts:
+        rows = execute_query('''
+            INSERT INTO users (email, password_hash, full_name, role)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (email) DO UPDATE SET password_hash = EXCLUDED.password_hash
+            RETURNING id
+        ''', (email, password_hash, full_name, role))
+        ids.append(rows[0]['id'])
+    return ids[0], ids[1:]
+
+def _seed_scale_event(plan, seed, admin_id, scanner_ids, anchor):
+    """One event with its ticket types, tickets and check-ins, in one transaction; returns its shard"""
+    from psycopg2.extras import RealDictCursor
+    from database.partitions import create_event_partitions
+    from database.shards import sharding_enabled, allocate_event, release_event
+    from ticket_codes import build_qr_payload, qr_digest
+    
+    rng = random.Random(f'event:{seed}:{plan["index"]}')
+    count = plan['tickets']
+    event_date = plan['event_date']
+    
+    # Sales ramp up towards the event and stop an hour before it (or at the anchor)
+    sales_end = min(event_date - timedelta(hours=1), anchor)
+    sales_start = min(event_date - timedelta(days=60), sales_end - timedelta(days=1))
+    window = (sales_end - sales_start).total_seconds()
+    created = sorted(sales_end - timedelta(seconds=window * rng.random() ** 2) for _ in range(count))
+    
+    type_shares = [share for _, _, share, _, _ in SCALE_TICKET_TYPES]
+    type_counts = _split(count, type_shares)
+    type_of = [kind for kind, issued in enumerate(type_counts) for _ in range(issued)]
+    rng.shuffle(type_of)
+    
+    cancelled = set(rng.sample(range(count), plan['cancelled']))
+    used = rng.sample([i for i in range(count) if i not in cancelled], plan['checkins'])
+    gates = rng.sample(scanner_ids, min(len(scanner_ids), 2 + count // 5000)) if scanner_ids else []
+    
+    # Doors open an hour early; most people arrive just after the start
+    check_in_at = {i: event_date + timedelta(minutes=rng.triangular(-60, 150, 10)) for i in used}
+    
+    event_id, shard = allocate_event() if sharding_enabled() else (None, 0)
+    conn = get_db_connection(shard=shard)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute('''
+                INSERT INTO events (id, created_by, name, description, event_date, location, capacity, status, created_at, updated_at)
+                VALUES (COALESCE(%s, nextval(pg_get_serial_sequence('events', 'id'))), %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (event_id, admin_id, plan['name'], 'Synthetic event (seed.py --scale)', event_date,
+                  plan['location'], 0, plan['status'], sales_start, sales_start))
+            event_id = cur.fetchone()['id']
+            create_event_partitions(cur, event_id)
+            
+            type_ids = []
+            capacity = 0
+            for (name, price, _, description, color), issued in zip(SCALE_TICKET_TYPES, type_counts):
+                quantity = math.ceil(issued * rng.uniform(1.0, 1.3))
+                capacity += quantity
+                cur.execute('''
+                    INSERT INTO ticket_types (event_id, name, price, quantity, quantity_issued, is_custom, description, color)
+                    VALUES (%s, %s, %s, %s, %s, false, %s, %s)
+                    RETURNING id
+                ''', (event_id, name, price, quantity, issued, description, color))
+                type_ids.append(cur.fetchone()['id'])
+            cur.execute('UPDATE events SET capacity = %s WHERE id = %s', (capacity, event_id))
+            
+            # Reserve a block of ticket ids; the lock keeps the app's inserts out of it meanwhile
+            first_id = 0
+            if count:
+                cur.execute('LOCK TABLE tickets IN SHARE ROW EXCLUSIVE MODE')
+                cur.execute("SELECT nextval(pg_get_serial_sequence('tickets', 'id')) AS first_id")
+                first_id = cur.fetchone()['first_id']
+                cur.execute("SELECT setval(pg_get_serial_sequence('tickets', 'id'), %s)", (first_id + count - 1,))
+            
+            prefix = f'TKT-S{shard}-' if sharding_enabled() else 'TKT-'
+            
+            def ticket_lines():
+                for i in range(count):
+                    ticket_id = first_id + i
+                    first, last = rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)
+                    email = f'{first}.{last}{ticket_id % 10000}@example.com'.lower()
+                    ticket_number = f'{prefix}{_scale_ticket_code(ticket_id):010X}'
+                    qr_payload = build_qr_payload(ticket_number, event_id, email)
+                    status = 'cancelled' if i in cancelled else 'used' if i in check_in_at else 'active'
+                    yield _copy_line((
+                        ticket_id, event_id, type_ids[type_of[i]], qr_payload, qr_digest(qr_payload),
+                        ticket_number, f'{first} {last}', email,
+                        f'+23480{rng.randrange(10 ** 8):08d}' if rng.random() < 0.8 else None,
+                        status, rng.random() >= SCALE_UNSENT_SHARE, admin_id,
+                        created[i], check_in_at.get(i, created[i]),
+                    ))
+            
+            def check_in_lines():
+                for check_in_time, i in sorted((at, i) for i, at in check_in_at.items()):
+                    yield _copy_line((first_id + i, event_id, rng.choice(gates), check_in_time))
+            
+            _copy(cur, 'tickets', TICKET_COPY_COLUMNS, ticket_lines())
+            _copy(cur, 'check_ins', CHECK_IN_COPY_COLUMNS, check_in_lines())
+        
+        conn.commit()
+        return shard
+    
+    except Exception:
+        conn.rollback()
+        if sharding_enabled() and event_id is not None:
+            release_event(event_id)
+        raise
+    
+    finally:
+        release_db_connection(conn)
+
+def _scale_ticket_code(ticket_id):
+    """
+    Ticket id -> 40-bit code through a fixed permutation. Numbers look random
+    but never repeat, and at 10 hex digits they can't clash with the app's
+    8-digit ones.
+    """
+    mask = (1 << 40) - 1
+    x = (ticket_id * 0x9E3779B97F) & mask
+    x ^= x >> 23
+    x = (x * 0xC2B2AE3D27) & mask
+    return x ^ (x >> 19)
+
+def _copy_line(values):
+    """One row in COPY's text format"""
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append('\\N')
+        elif isinstance(value, bool):
+            fields.append('t' if value else 'f')
+        elif isinstance(value, bytes):
+            fields.append('\\\\x' + value.hex())
+        elif isinstance(value, datetime):
+            fields.append(value.isoformat(' '))
+        else:
+            fields.append(str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n'))
+    return '\t'.join(fields) + '\n'
+
+class _CopyStream:
+    """Just enough of a file for cursor.copy_expert to pull rows from a generator"""
+    
+    def __init__(self, lines):
+        self._lines = lines
+        self._pending = ''
+    
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            self._pending = ''
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+def _copy(cur, table, columns, lines):
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", _CopyStream(lines), size=1 << 16)
+
+def _analyze(shard):
+    conn = get_db_connection(shard=shard)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('ANALYZE users, events, ticket_types, tickets, check_ins')
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
 if __name__ == '__main__':
+    import logging
+    import argparse
+    from urllib.parse import urlsplit
     from dotenv import load_dotenv
     load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    parser = argparse.ArgumentParser(description='Seed accounts and a sample event, or production-sized data with --scale')
+    parser.add_argument('--scale', action='store_true', help='generate synthetic events, tickets and check-ins with COPY')
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--tickets', type=int, default=5_000_000)
+    parser.add_argument('--checkins', type=int, default=3_000_000)
+    parser.add_argument('--scanners', type=int, default=40, help='scanner accounts the check-ins are spread over')
+    parser.add_argument('--seed', type=int, default=1, help='same seed, same data (on a freshly migrated database)')
+    parser.add_argument('--anchor', default=SCALE_ANCHOR.date().isoformat(),
+                        help="the data's 'today' (YYYY-MM-DD): earlier events are over and checked in")
+    parser.add_argument('--allow-remote-db', action='store_true', help='let --scale write to a non-local DATABASE_URL')
+    args = parser.parse_args()
     
     # Verify DATABASE_URL exists
     database_url = os.getenv('DATABASE_URL')
@@ -134,6 +498,17 @@ if __name__ == '__main__':
         print("❌ DATABASE_URL not found in environment!")
         print("Set DATABASE_URL environment variable first")
         print("Example: export DATABASE_URL='postgres://...'")
+    elif args.scale:
+        # .env may name a production database; millions of synthetic rows only go to a local one by default
+        host = urlsplit(database_url).hostname or 'localhost'
+        if host not in ('localhost', '127.0.0.1', '::1') and not args.allow_remote_db:
+            parser.error(f"DATABASE_URL points at {host}; --scale only writes to a local database "
+                         f"(--allow-remote-db to override for a dedicated benchmark server)")
+        try:
+            seed_scale(args.events, args.tickets, args.checkins, scanners=args.scanners,
+                       seed=args.seed, anchor=datetime.fromisoformat(args.anchor))
+        except ValueError as e:
+            parser.error(str(e))
     else:
         print(f"✅ Using database: {database_url[:50]}...")
         seed_database()
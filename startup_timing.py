@@ -0,0 +1,37 @@
+"""
+Where app.py's startup time goes.
+
+app.py wraps each import/init step in step(name); report() logs the
+breakdown once the app is importable ("Startup complete", one JSON line
+with per-step milliseconds). Heavy dependencies (qrcode, requests, the
+email service) and the DB pools are deferred to first use, so they show
+up in request latency instead; the first DB connect logs its own
+duration from database/db.py.
+
+For a per-module breakdown run benchmarks/bench_startup.py, which wraps
+`python -X importtime`.
+"""
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+steps = {}
+
+
+@contextmanager
+def step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        steps[name] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def report():
+    """Log the step breakdown; returns total milliseconds since this module was imported"""
+    total = round((time.perf_counter() - _started) * 1000, 1)
+    logger.info("Startup complete", extra={'startup_ms': total, 'steps': dict(steps)})
+    return total
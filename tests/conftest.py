@@ -0,0 +1,18 @@
+"""
+Unit tests for the pieces that run without Postgres (pip install pytest, then
+`python -m pytest -q` from the repo root).
+
+Modules are imported with a DATABASE_URL that points nowhere, so a test
+that forgets to stub a query fails to connect instead of reaching a real
+database. The pools only open on the first query.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# load_dotenv() doesn't override variables that are already set
+os.environ['DATABASE_URL'] = 'postgresql://tests@127.0.0.1:1/tests'
+os.environ['SHARD_DATABASE_URLS'] = ''
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
@@ -0,0 +1,253 @@
+"""
+checkin_journal without Postgres: each "worker" is a separate instance of
+the module sharing one journal file, with the database replaced by a dict
+of flushed check-ins. Separate instances take separate flocks, just as
+separate processes do.
+"""
+import os
+import json
+import fcntl
+import random
+import importlib.util
+import multiprocessing
+
+import pytest
+
+from conftest import ROOT
+
+EVENT_ID = 7
+SCANNER_ID = 3
+
+
+def load_worker(name, db=None):
+    """A fresh checkin_journal instance, as a newly started worker process would have"""
+    spec = importlib.util.spec_from_file_location(
+        f'checkin_journal_{name}', os.path.join(ROOT, 'checkin_journal.py')
+    )
+    worker = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(worker)
+
+    db = {} if db is None else db
+    worker.written = []
+
+    def load_event(event_id):
+        return {ticket_id: dict(entry) for (e, ticket_id), entry in db.items() if e == event_id}
+
+    def write_shard_batch(shard, batch):
+        worker.written.extend(batch)
+        for entry in batch:
+            db.setdefault((entry['event_id'], entry['ticket_id']), entry)
+
+    worker._load_event = load_event
+    worker._write_shard_batch = write_shard_batch
+    worker._start_flusher = lambda: None
+    # The scanner routes ask this before every journaled scan; it opens the files
+    assert worker.is_enabled()
+    return worker
+
+
+def crash(worker):
+    """Let go of the worker's files (and so its flocks) without flushing"""
+    for handle in (worker._journal, worker._append_lock, worker._owner):
+        if handle is not None:
+            handle.close()
+
+
+def written_ids(worker):
+    return [entry['ticket_id'] for entry in worker.written]
+
+
+@pytest.fixture
+def journal_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'journal.log')
+    monkeypatch.setenv('CHECKIN_WRITE_BEHIND', 'true')
+    monkeypatch.setenv('CHECKIN_JOURNAL_PATH', path)
+    monkeypatch.setenv('CHECKIN_JOURNAL_FSYNC', 'false')
+    return path
+
+
+def test_second_scan_is_a_duplicate(journal_path):
+    worker = load_worker('a')
+
+    accepted, entry = worker.record_check_in(EVENT_ID, 1, SCANNER_ID)
+    assert accepted
+
+    accepted, previous = worker.record_check_in(EVENT_ID, 1, SCANNER_ID + 1)
+    assert not accepted
+    assert previous['scanner_id'] == SCANNER_ID
+    assert previous['check_in_time'] == entry['check_in_time']
+    crash(worker)
+
+
+def test_workers_see_each_others_check_ins(journal_path):
+    a, b = load_worker('a'), load_worker('b')
+
+    assert a.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    assert not b.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    assert b.record_check_in(EVENT_ID, 2, SCANNER_ID)[0]
+    assert not a.record_check_in(EVENT_ID, 2, SCANNER_ID)[0]
+    crash(a)
+    crash(b)
+
+
+def _scan_all(name, ticket_ids, start, results):
+    worker = load_worker(name)
+    start.wait()
+    results.put([t for t in ticket_ids if worker.record_check_in(EVENT_ID, t, SCANNER_ID)[0]])
+
+
+def test_each_ticket_admitted_once_across_processes(journal_path):
+    ticket_ids = list(range(1, 201))
+    context = multiprocessing.get_context('fork')
+    start = context.Event()
+    results = context.Queue()
+
+    processes = []
+    for n in range(4):
+        order = ticket_ids[:]
+        random.Random(n).shuffle(order)
+        process = context.Process(target=_scan_all, args=(f'p{n}', order, start, results))
+        process.start()
+        processes.append(process)
+    start.set()
+
+    admitted = []
+    for _ in processes:
+        admitted.extend(results.get(timeout=60))
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert sorted(admitted) == ticket_ids
+    with open(journal_path, 'rb') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    assert sorted(entry['ticket_id'] for entry in lines) == ticket_ids
+
+
+def test_forgotten_ticket_is_admitted_again_and_not_flushed_twice(journal_path):
+    a, b = load_worker('a'), load_worker('b')
+
+    assert a.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    # Re-activated by an admin on another worker before the flush
+    b.forget_ticket(EVENT_ID, 1)
+    assert a.record_check_in(EVENT_ID, 1, SCANNER_ID + 1)[0]
+
+    assert a.flush() == 1
+    assert [e['scanner_id'] for e in a.written] == [SCANNER_ID + 1]
+    crash(a)
+    crash(b)
+
+
+def test_crash_replays_entries_after_the_checkpoint(journal_path, monkeypatch):
+    monkeypatch.setenv('CHECKIN_FLUSH_BATCH_SIZE', '1')
+    db = {}
+    a = load_worker('a', db)
+    for ticket_id in (1, 2, 3):
+        assert a.record_check_in(EVENT_ID, ticket_id, SCANNER_ID)[0]
+
+    write = a._write_shard_batch
+
+    def lose_connection_after_one(shard, batch):
+        if a.written:
+            raise RuntimeError('connection lost')
+        write(shard, batch)
+
+    a._write_shard_batch = lose_connection_after_one
+    with pytest.raises(RuntimeError):
+        a.flush()
+    assert written_ids(a) == [1]
+    crash(a)
+
+    b = load_worker('b', db)
+    assert b.flush() == 2
+    assert written_ids(b) == [2, 3]
+    # Loaded from the database plus the journal, nothing is admitted twice
+    for ticket_id in (1, 2, 3):
+        assert not b.record_check_in(EVENT_ID, ticket_id, SCANNER_ID)[0]
+    crash(b)
+
+    c = load_worker('c', db)
+    assert c.flush() == 0
+    crash(c)
+
+
+def test_torn_write_is_skipped(journal_path):
+    db = {}
+    a = load_worker('a', db)
+    assert a.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    crash(a)
+    # The process died halfway through an append
+    with open(journal_path, 'ab') as f:
+        f.write(b'{"event_id": 7, "tick')
+
+    b = load_worker('b', db)
+    assert b.record_check_in(EVENT_ID, 2, SCANNER_ID)[0]
+    crash(b)
+
+    c = load_worker('c', db)
+    assert c.flush() == 2
+    assert written_ids(c) == [1, 2]
+    assert not c.record_check_in(EVENT_ID, 2, SCANNER_ID)[0]
+    crash(c)
+
+
+def test_compaction_keeps_decisions_and_unflushed_entries(journal_path, monkeypatch):
+    monkeypatch.setenv('CHECKIN_JOURNAL_COMPACT_BYTES', '1')
+    db = {}
+    a, b = load_worker('a', db), load_worker('b', db)
+
+    assert a.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    assert b.record_check_in(EVENT_ID, 2, SCANNER_ID)[0]
+
+    assert a.flush() == 2
+    assert os.path.getsize(journal_path) == 0
+    assert a._read_checkpoint() == 0
+
+    # b still holds the old file open; it moves to the new one on its next scan
+    assert b.record_check_in(EVENT_ID, 3, SCANNER_ID)[0]
+    assert not b.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    assert os.path.getsize(journal_path) > 0
+
+    assert a.flush() == 1
+    assert written_ids(a) == [1, 2, 3]
+
+    # A worker started after compaction finds the flushed check-ins in the database
+    c = load_worker('c', db)
+    for ticket_id in (1, 2, 3):
+        assert not c.record_check_in(EVENT_ID, ticket_id, SCANNER_ID)[0]
+    for worker in (a, b, c):
+        crash(worker)
+
+
+def test_event_is_loaded_under_the_append_lock(journal_path):
+    worker = load_worker('a')
+    held = []
+
+    def load_event(event_id):
+        with open(journal_path + '.lock', 'a') as other:
+            try:
+                fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                held.append(True)
+            else:
+                fcntl.flock(other.fileno(), fcntl.LOCK_UN)
+                held.append(False)
+        return {}
+
+    worker._load_event = load_event
+    assert worker.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    assert held == [True]
+    crash(worker)
+
+
+def test_forget_event_reloads_the_used_map(journal_path):
+    db = {(EVENT_ID, 1): {'ticket_id': 1, 'scanner_id': SCANNER_ID, 'check_in_time': '2030-01-01T18:00:00'}}
+    a, b = load_worker('a', db), load_worker('b', db)
+
+    assert not a.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    # The event's check-ins were deleted in Postgres, then forget_event journaled
+    db.clear()
+    b.forget_event(EVENT_ID)
+    assert a.record_check_in(EVENT_ID, 1, SCANNER_ID)[0]
+    crash(a)
+    crash(b)
@@ -0,0 +1,198 @@
+"""
+validation_index without Postgres: tables are written from fixture rows and
+the refresh query is answered by a stub that records its parameters.
+"""
+import time
+
+import pytest
+
+import validation_index
+
+EVENT_ID = 42
+
+
+def payload(n, event_id=EVENT_ID):
+    return f'TKT-{n:08X}|{event_id}|guest{n}@example.com'
+
+
+def ticket(n, status='active', changed=1000.0):
+    return {'id': n, 'qr_code': payload(n), 'status': status, 'changed': changed}
+
+
+def lookup(n, event_id=EVENT_ID):
+    return validation_index._lookup(validation_index._reader(event_id), payload(n, event_id))
+
+
+def header(event_id=EVENT_ID):
+    magic, capacity, count, changed_until, refreshed_at = validation_index.HEADER.unpack_from(
+        validation_index._reader(event_id), 0
+    )
+    return {'capacity': capacity, 'count': count, 'changed_until': changed_until, 'refreshed_at': refreshed_at}
+
+
+class Queries:
+    """Stands in for execute_query: records each call and answers from `rows`"""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.calls = []
+
+    def __call__(self, query, params=None, **kwargs):
+        self.calls.append((' '.join(query.split()), params))
+        return self.rows
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(validation_index, 'INDEX_DIR', str(tmp_path))
+    monkeypatch.setattr(validation_index, 'INDEX_ENABLED', True)
+    monkeypatch.setattr(validation_index, '_readers', {})
+    monkeypatch.setattr(validation_index, '_inactive', {})
+    return tmp_path
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    stub = Queries()
+    monkeypatch.setattr(validation_index, 'execute_query', stub)
+    return stub
+
+
+@pytest.fixture
+def colliding_keys(monkeypatch):
+    """Every payload hashes to slot 5 of a 64-slot table, so lookups have to probe"""
+    monkeypatch.setattr(validation_index, '_key', lambda qr_payload: 5 + 64 * int(qr_payload[4:12], 16))
+
+
+def test_insert_update_and_remove(queries):
+    validation_index._write_table(EVENT_ID, [ticket(1), ticket(2, 'used')], 64)
+    assert lookup(1) == 'active'
+    assert lookup(2) == 'used'
+    assert lookup(3) is None
+
+    validation_index.upsert_ticket(EVENT_ID, payload(3), 3, 'active')
+    validation_index.upsert_ticket(EVENT_ID, payload(1), 1, 'used')
+    validation_index.remove_ticket(EVENT_ID, payload(2), 2)
+
+    assert lookup(1) == 'used'
+    assert lookup(2) == 'deleted'
+    assert lookup(3) == 'active'
+    assert header()['count'] == 3
+    assert queries.calls == []
+
+
+def test_removing_a_ticket_keeps_the_probe_chain(colliding_keys):
+    validation_index._write_table(EVENT_ID, [ticket(1), ticket(2), ticket(3)], 64)
+
+    validation_index.remove_ticket(EVENT_ID, payload(2), 2)
+    validation_index.upsert_ticket(EVENT_ID, payload(3), 3, 'cancelled')
+
+    # 3 sits two slots past its home slot, behind the removed 2
+    assert lookup(1) == 'active'
+    assert lookup(2) == 'deleted'
+    assert lookup(3) == 'cancelled'
+    assert lookup(4) is None
+
+
+def test_removing_an_unknown_ticket_takes_no_slot():
+    validation_index._write_table(EVENT_ID, [ticket(1)], 64)
+    validation_index.remove_ticket(EVENT_ID, payload(2), 2)
+
+    assert lookup(2) is None
+    assert header()['count'] == 1
+
+
+def test_full_table_is_rebuilt_bigger(monkeypatch):
+    capacity = 64
+    limit = int(capacity * validation_index.MAX_LOAD)
+    validation_index._write_table(EVENT_ID, [ticket(n) for n in range(1, limit + 1)], capacity)
+
+    assert not validation_index._apply_updates(EVENT_ID, [(payload(limit + 1), limit + 1, 'active')])
+
+    # upsert_ticket falls back to a rebuild from Postgres, which has the new ticket committed
+    def execute_query(query, params=None, **kwargs):
+        if 'FROM events' in query:
+            return [{'capacity': 100}]
+        return [ticket(n) for n in range(1, limit + 2)]
+
+    monkeypatch.setattr(validation_index, 'execute_query', execute_query)
+    validation_index.upsert_ticket(EVENT_ID, payload(limit + 1), limit + 1, 'active')
+    assert header()['capacity'] > capacity
+    assert header()['count'] == limit + 1
+    assert lookup(limit + 1) == 'active'
+
+
+def test_refresh_rereads_the_overlap_window(queries, monkeypatch):
+    monkeypatch.setattr(validation_index, 'REFRESH_OVERLAP_SECONDS', 30.0)
+    validation_index._write_table(EVENT_ID, [ticket(1, changed=1000.0), ticket(2, changed=900.0)], 64)
+    monkeypatch.setattr(validation_index, 'REFRESH_SECONDS', 0.0)
+
+    # 2 was cancelled by a transaction that committed late, with an older updated_at
+    queries.rows = [
+        {'id': 2, 'qr_code': payload(2), 'status': 'cancelled', 'changed': 990.0},
+        {'id': 3, 'qr_code': payload(3), 'status': 'active', 'changed': 1005.0},
+    ]
+    assert validation_index.refresh(EVENT_ID)
+
+    (query, params), = queries.calls
+    assert 'updated_at >' in query
+    assert params == (EVENT_ID, 1000.0 - 30.0)
+    assert lookup(2) == 'cancelled'
+    assert lookup(3) == 'active'
+    assert header()['changed_until'] == 1005.0
+
+
+def test_refresh_never_moves_the_mark_back(queries, monkeypatch):
+    validation_index._write_table(EVENT_ID, [ticket(1, changed=1000.0)], 64)
+    monkeypatch.setattr(validation_index, 'REFRESH_SECONDS', 0.0)
+
+    queries.rows = [{'id': 1, 'qr_code': payload(1), 'status': 'used', 'changed': 980.0}]
+    assert validation_index.refresh(EVENT_ID)
+    assert header()['changed_until'] == 1000.0
+
+    queries.rows = []
+    assert validation_index.refresh(EVENT_ID)
+    assert queries.calls[-1][1] == (EVENT_ID, 1000.0 - validation_index.REFRESH_OVERLAP_SECONDS)
+
+
+def test_recent_refresh_is_not_repeated(queries):
+    validation_index._write_table(EVENT_ID, [ticket(1)], 64)
+    assert validation_index.refresh(EVENT_ID)
+    assert queries.calls == []
+
+
+def test_check_answers_from_the_table(queries, monkeypatch):
+    validation_index._write_table(EVENT_ID, [ticket(1), ticket(2, 'cancelled')], 64)
+    monkeypatch.setattr(validation_index, 'MISS_REFRESH_SECONDS', 0.0)
+
+    assert validation_index.check(payload(1)) == 'active'
+    assert validation_index.check(payload(2)) == 'cancelled'
+    # A miss forces a refresh before the scan is rejected
+    assert validation_index.check(payload(3)) == 'unknown'
+    assert len(queries.calls) == 1
+
+
+def test_check_goes_to_the_database_when_the_refresh_lock_is_busy(queries, monkeypatch):
+    validation_index._write_table(EVENT_ID, [ticket(1)], 64)
+    monkeypatch.setattr(validation_index, 'MISS_REFRESH_SECONDS', 0.0)
+    monkeypatch.setattr(validation_index, 'MISS_WAIT_SECONDS', 0.05)
+
+    # Another worker is in the middle of a refresh
+    with validation_index._FileLock(EVENT_ID):
+        started = time.monotonic()
+        assert validation_index.check(payload(3)) is None
+        assert time.monotonic() - started < 1
+
+    assert validation_index.check(payload(1)) == 'active'
+    assert queries.calls == []
+
+
+def test_untrusted_event_ids_create_no_files(queries, index_dir):
+    assert validation_index.check(payload(1, event_id=2 ** 40)) == 'unknown'
+    assert validation_index.check(payload(1, event_id=0)) == 'unknown'
+
+    # Not an active event in Postgres: asked once, nothing built
+    assert validation_index.check(payload(1, event_id=77)) is None
+    assert validation_index.check(payload(1, event_id=77)) is None
+    assert len(queries.calls) == 1
+    assert list(index_dir.iterdir()) == []
@@ -0,0 +1,56 @@
+import io
+import uuid
+import base64
+import hashlib
+import metrics
+import tracing
+
+
+def generate_ticket_number(shard=None):
+    """
+    Random human-readable ticket number. When sharding is on the number
+    carries its shard ("TKT-S2-..."), and so does the QR payload built
+    from it, letting the scanner route without a directory lookup.
+    """
+    if shard is not None:
+        return f"TKT-S{shard}-{uuid.uuid4().hex[:8].upper()}"
+    return f"TKT-{uuid.uuid4().hex[:8].upper()}"
+
+
+def build_qr_payload(ticket_number, event_id, recipient_email):
+    """Payload encoded in the ticket QR code"""
+    return f"{ticket_number}|{event_id}|{recipient_email}"
+
+
+def event_id_from_payload(qr_payload):
+    """Event id embedded in a QR payload, or None for anything that doesn't parse"""
+    parts = qr_payload.split('|')
+    if len(parts) < 3:
+        return None
+    try:
+        return int(parts[1])
+    except ValueError:
+        return None
+
+
+def render_qr_base64(qr_payload):
+    """QR code PNG for a payload, base64-encoded for the ticket email"""
+    # Imported here: scanner-only workers never render, so they never pay for qrcode
+    import qrcode
+
+    with metrics.timed(metrics.QR_RENDER_SECONDS), tracing.span('render_qr_base64', 'qr'):
+        with tracing.span('qrcode.make', 'qr'):
+            qr_img = qrcode.make(qr_payload)
+        buffer = io.BytesIO()
+        qr_img.save(buffer)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def qr_digest(qr_payload):
+    """
+    Fixed-width 16-byte digest of a QR payload.
+
+    Matches Postgres' decode(md5(qr_code), 'hex'), which the backfill in
+    database/migrate.py uses for rows created before the column existed.
+    """
+    return hashlib.md5(qr_payload.encode('utf-8')).digest()
@@ -0,0 +1,289 @@
+"""
+Ticket PDFs: rendered ahead of time for a whole event, stored on disk and
+served from there (download, email attachment).
+
+The render_pdfs event job (event_jobs.py) renders every non-cancelled
+ticket of an event:
+  1. Each distinct background (ticket_bg_image, or the event banner as the
+     fallback) is decoded, shrunk and JPEG-encoded once into
+     PDF_STORAGE_DIR/backgrounds. Postgres hashes the images, so the job
+     only pulls each distinct image across the wire once.
+  2. Tickets are read in keyset pages without their images and sent in
+     chunks of PDF_CHUNK_SIZE to a pool of PDF_WORKERS processes. The job
+     records progress in event_jobs.tickets_done after every page.
+  3. Each PDF goes to PDF_STORAGE_DIR/<event_id>/<ticket_number>.pdf. Files
+     that already exist are skipped, so a resumed job picks up where it
+     stopped (tickets_done starts again from 0 and counts them as done).
+  4. After a page is stored, its tickets are read again. A PDF whose
+     printed details (ticket, ticket type or event) changed since the page
+     was read, or whose ticket was cancelled, is deleted: the edit deleted
+     the old file before the job wrote this one. A check-in only changes
+     the status, which the PDF doesn't show, so it keeps its file.
+
+The pool uses spawn (not fork): jobs run on a thread of a threaded web
+worker, and forking a process with other threads running is unsafe. Workers
+only import pdf_generator. Each job gets its own pool, which goes away when
+the job finishes, so an idle web worker holds no renderer processes.
+
+A single ticket whose PDF is missing (a new ticket, or one edited since)
+is rendered in-process on demand. Edits to a ticket, its event or its
+ticket types delete the stored files they make stale.
+
+Storage is per host. On another host a download simply renders again.
+"""
+import os
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from database.db import execute_query
+from database.shards import shard_for_ticket_id
+import tracing
+
+logger = logging.getLogger(__name__)
+
+PDF_STORAGE_DIR = os.getenv('PDF_STORAGE_DIR') or os.path.join(tempfile.gettempdir(), 'ticket9ja-pdfs')
+PDF_WORKERS = int(os.getenv('PDF_WORKERS') or max(1, (os.cpu_count() or 2) // 2))
+PDF_CHUNK_SIZE = int(os.getenv('PDF_CHUNK_SIZE', '100'))
+# Attach the ticket PDF to ticket emails (renders it at send time when missing)
+PDF_EMAIL_ATTACHMENT = os.getenv('PDF_EMAIL_ATTACHMENT', 'false').lower() == 'true'
+PAGE_SIZE = 2000
+
+BACKGROUND_DIR = os.path.join(PDF_STORAGE_DIR, 'backgrounds')
+DATE_FORMAT = '%B %d, %Y at %I:%M %p'
+
+# Everything a stored PDF is rendered from, without the images themselves.
+# Not the status: the PDF doesn't show it, and doors-open check-ins change it.
+_RENDER_COLUMNS = '''
+    t.id, t.ticket_number, t.recipient_name, t.qr_code,
+    md5(t.ticket_bg_image) AS bg_digest,
+    tt.name AS ticket_type_name,
+    e.name AS event_name, e.event_date, e.location, md5(e.banner_image) AS banner_digest
+'''
+_RENDER_FROM = '''
+    FROM tickets t
+    JOIN ticket_types tt ON t.ticket_type_id = tt.id
+    JOIN events e ON t.event_id = e.id
+'''
+
+
+def pdf_path(event_id, ticket_number):
+    return os.path.join(PDF_STORAGE_DIR, str(int(event_id)), f'{ticket_number}.pdf')
+
+
+def render_ticket(ticket):
+    """
+    Render one ticket in-process unless its PDF is already stored; returns
+    the path. ticket carries event_id, ticket_number, recipient_name,
+    qr_code, ticket_type_name, event_name, event_date, location,
+    ticket_bg_image and banner_image.
+    """
+    path = pdf_path(ticket['event_id'], ticket['ticket_number'])
+    if os.path.exists(path):
+        return path
+
+    import pdf_generator
+
+    with tracing.span('render_pdf', 'pdf', ticket_number=ticket['ticket_number']):
+        image = ticket.get('ticket_bg_image') or ticket.get('banner_image')
+        background = pdf_generator.prepare_background(image, BACKGROUND_DIR) if image else None
+        pdf = pdf_generator.generate_ticket_pdf(
+            ticket['ticket_number'],
+            ticket['recipient_name'],
+            ticket['event_name'],
+            ticket['event_date'].strftime(DATE_FORMAT),
+            ticket['location'],
+            ticket['ticket_type_name'],
+            ticket['qr_code'],
+            background
+        )
+        pdf_generator.store(path, pdf)
+    return path
+
+
+def ticket_pdf(ticket_id):
+    """The ticket's row with its stored PDF's 'path' (rendered when missing), or None if no such ticket"""
+    shard = shard_for_ticket_id(ticket_id)
+    ticket = execute_query('''
+        SELECT t.id, t.event_id, t.ticket_number, t.recipient_name, t.qr_code, t.status,
+               e.name AS event_name, e.event_date, e.location,
+               tt.name AS ticket_type_name
+        FROM tickets t
+        JOIN events e ON t.event_id = e.id
+        JOIN ticket_types tt ON t.ticket_type_id = tt.id
+        WHERE t.id = %s
+    ''', (ticket_id,), shard=shard)
+
+    if not ticket:
+        return None
+    ticket = ticket[0]
+
+    path = pdf_path(ticket['event_id'], ticket['ticket_number'])
+    if ticket['status'] != 'cancelled' and not os.path.exists(path):
+        # The images are only needed to render, not to serve a stored file
+        images = execute_query('''
+            SELECT t.ticket_bg_image, e.banner_image
+            FROM tickets t
+            JOIN events e ON t.event_id = e.id
+            WHERE t.event_id = %s AND t.id = %s
+        ''', (ticket['event_id'], ticket_id), shard=shard)
+        render_ticket(dict(ticket, **images[0]))
+
+    return dict(ticket, path=path)
+
+
+def render_event(job):
+    """render_pdfs job runner: store a PDF for every non-cancelled ticket of the event"""
+    shard = job['shard']
+    event_id = job['event_id']
+
+    event = execute_query('''
+        SELECT status, archived_at FROM events WHERE id = %s
+    ''', (event_id,), shard=shard)
+    if not event:
+        raise Exception(f"Event {event_id} not found")
+    event = event[0]
+    if event['status'] == 'deleting' or event['archived_at']:
+        raise Exception(f"Event {event_id} is archived or being deleted, not rendering")
+
+    # A resumed job goes through every page again, counting stored files as done
+    execute_query('''
+        UPDATE event_jobs SET tickets_done = 0, updated_at = NOW() WHERE id = %s
+    ''', (job['id'],), fetch=False, shard=shard)
+
+    backgrounds = _prepare_backgrounds(event_id, shard)
+
+    executor = _executor()
+    rendered = 0
+    stale = 0
+    last_id = 0
+    try:
+        while True:
+            page = execute_query(f'''
+                SELECT {_RENDER_COLUMNS}
+                {_RENDER_FROM}
+                WHERE t.event_id = %s AND t.status != 'cancelled' AND t.id > %s
+                ORDER BY t.id
+                LIMIT %s
+            ''', (event_id, last_id, PAGE_SIZE), shard=shard) or []
+
+            if not page:
+                break
+            last_id = page[-1]['id']
+
+            pending = []
+            inputs = {}
+            for row in page:
+                path = pdf_path(event_id, row['ticket_number'])
+                if os.path.exists(path):
+                    continue
+                digest = row['bg_digest'] or row['banner_digest']
+                if digest and digest not in backgrounds:
+                    # Image set after the job started; rendered on demand instead
+                    continue
+                pending.append(dict(
+                    event_name=row['event_name'],
+                    event_date=row['event_date'].strftime(DATE_FORMAT),
+                    event_location=row['location'],
+                    ticket_number=row['ticket_number'],
+                    recipient_name=row['recipient_name'],
+                    ticket_type=row['ticket_type_name'],
+                    qr_payload=row['qr_code'],
+                    background=backgrounds.get(digest),
+                    path=path,
+                ))
+                inputs[row['id']] = row
+
+            rendered += render_tickets(pending, executor)
+            if inputs:
+                stale += _discard_stale(event_id, inputs, shard)
+
+            execute_query('''
+                UPDATE event_jobs SET tickets_done = tickets_done + %s, updated_at = NOW()
+                WHERE id = %s
+            ''', (len(page), job['id']), fetch=False, shard=shard)
+
+            if len(page) < PAGE_SIZE:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info("Rendered %d ticket PDF(s) for event %s (%d discarded as edited meanwhile)",
+                rendered - stale, event_id, stale)
+
+
+def _discard_stale(event_id, inputs, shard):
+    """
+    Delete the PDFs just stored for tickets whose render inputs (rows of
+    _RENDER_COLUMNS by ticket id) no longer match the database, or that were
+    cancelled or deleted; returns the count. An edit committed before this
+    read is caught here, and one committed after it deletes the stored file
+    itself.
+    """
+    current = execute_query(f'''
+        SELECT {_RENDER_COLUMNS}
+        {_RENDER_FROM}
+        WHERE t.event_id = %s AND t.id = ANY(%s) AND t.status != 'cancelled'
+    ''', (event_id, list(inputs)), shard=shard) or []
+    current = {row['id']: row for row in current}
+
+    stale = 0
+    for ticket_id, row in inputs.items():
+        if current.get(ticket_id) != row:
+            forget_ticket(event_id, row['ticket_number'])
+            stale += 1
+    return stale
+
+
+def render_tickets(tickets, executor=None):
+    """Render ticket dicts (pdf_generator.render_batch's format) in PDF_CHUNK_SIZE chunks; returns the count"""
+    chunks = [tickets[i:i + PDF_CHUNK_SIZE] for i in range(0, len(tickets), PDF_CHUNK_SIZE)]
+
+    if executor is None:
+        import pdf_generator
+        return sum(pdf_generator.render_batch(chunk) for chunk in chunks)
+
+    from pdf_generator import render_batch
+    return sum(executor.map(render_batch, chunks))
+
+
+def forget_ticket(event_id, ticket_number):
+    """Delete a ticket's stored PDF (it no longer matches the ticket)"""
+    try:
+        os.remove(pdf_path(event_id, ticket_number))
+    except FileNotFoundError:
+        pass
+
+
+def forget_event(event_id):
+    """Delete every stored PDF of an event"""
+    shutil.rmtree(os.path.join(PDF_STORAGE_DIR, str(int(event_id))), ignore_errors=True)
+
+
+def _prepare_backgrounds(event_id, shard):
+    """Cached background path per md5 of the stored image, for the event's tickets and its banner"""
+    import pdf_generator
+
+    backgrounds = {}
+    images = execute_query('''
+        SELECT DISTINCT ON (md5(ticket_bg_image)) md5(ticket_bg_image) AS digest, ticket_bg_image AS image
+        FROM tickets
+        WHERE event_id = %s AND ticket_bg_image IS NOT NULL AND status != 'cancelled'
+        UNION ALL
+        SELECT md5(banner_image), banner_image FROM events
+        WHERE id = %s AND banner_image IS NOT NULL
+    ''', (event_id, event_id), shard=shard) or []
+
+    for image in images:
+        if image['digest'] not in backgrounds:
+            backgrounds[image['digest']] = pdf_generator.prepare_background(image['image'], BACKGROUND_DIR)
+    return backgrounds
+
+
+def _executor():
+    """A process pool for one job, or None when PDF_WORKERS is 0 (render on the job's thread)"""
+    if PDF_WORKERS <= 0:
+        return None
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context('spawn'))
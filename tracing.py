@@ -0,0 +1,249 @@
+"""
+In-process request tracing.
+
+Every request (or a TRACE_SAMPLE_RATE share of them) gets a trace whose id
+is the request id, so a trace can be matched to its log lines. The trace
+starts with a root span for the route. Spans nest through a ContextVar, so
+a span opened while another is open becomes its child. That includes
+spans from shard fan-out threads, which run in a copy of the request's
+context.
+
+Where the spans come from:
+  db.statement   every statement on any pooled connection (execute_query and
+                 the hand-rolled cursor blocks alike), via query_observers
+  db.pool        waiting for a pooled connection, via pool_observers
+  db.connection  how long a connection was held, checkout to release, which
+                 is the span of one execute_query or one cursor block
+  qr, email      render_qr_base64 / qrcode.make, send_ticket_email and the
+                 provider call
+  auth           bcrypt hash/verify and the role-check decorators
+  pdf            a ticket PDF rendered on demand (download, email attachment)
+  image          normalizing an uploaded banner or ticket background
+
+Finished traces go into a per-process ring buffer of the last TRACE_BUFFER
+traces. /api/admin/traces shows the slowest of them, for the worker that
+answers. Nothing leaves the process, so no collector is needed.
+
+Cost: a span is one small object and a ContextVar set/reset, one to two
+microseconds. benchmarks/microbench.py has trace_span_off and trace_request to
+keep an eye on that. Outside a trace, a span is a single ContextVar read.
+"""
+import os
+import time
+import random
+import itertools
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from database import db, query_budget
+
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+TRACE_BUFFER = int(os.getenv('TRACE_BUFFER', '500'))
+MAX_SPANS = 500
+
+_current = ContextVar('trace_span', default=None)
+_recent = deque(maxlen=TRACE_BUFFER)
+_recent_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start', 'duration', 'attrs')
+
+    def __init__(self, trace, parent_id, name, kind, start, attrs):
+        self.trace = trace
+        self.span_id = next(trace.ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = start
+        self.duration = None
+        self.attrs = attrs
+
+    def to_dict(self):
+        span = {
+            'id': self.span_id,
+            'parentId': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startMs': round((self.start - self.trace.started) * 1000, 3),
+            'durationMs': round(self.duration * 1000, 3) if self.duration is not None else None,
+        }
+        if self.attrs:
+            span.update(self.attrs)
+        return span
+
+
+class Trace:
+    """One request: the root span plus every finished span under it"""
+
+    def __init__(self, trace_id, name):
+        self.trace_id = trace_id
+        self.ids = itertools.count()
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.spans = []
+        self.dropped_spans = 0
+        self.root = Span(self, None, name, 'http', self.started, {})
+
+    def add(self, span):
+        # list.append is atomic, so fan-out threads can add spans too
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+        else:
+            self.spans.append(span)
+
+    def span_dicts(self):
+        return [self.root.to_dict()] + [span.to_dict() for span in sorted(self.spans, key=lambda s: s.start)]
+
+    def summary(self, with_spans=True):
+        summary = {
+            'traceId': self.trace_id,
+            'name': self.root.name,
+            'status': self.root.attrs.get('status'),
+            'startedAt': self.started_at.isoformat(),
+            'durationMs': round(self.root.duration * 1000, 3) if self.root.duration is not None else None,
+            'spanCount': len(self.spans) + 1,
+            'droppedSpans': self.dropped_spans,
+        }
+        if with_spans:
+            summary['spans'] = self.span_dicts()
+        return summary
+
+
+def start_trace(trace_id, name, force=False):
+    """Open a trace for the current request (sampled unless force); returns it or None"""
+    if not force and (TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE):
+        _current.set(None)
+        return None
+
+    trace = Trace(trace_id, name)
+    _current.set(trace.root)
+    return trace
+
+
+def trace_name(request):
+    """Root span name: method plus URL rule, so /api/events/7 and /api/events/8 group together"""
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return f'{request.method} {rule}'
+
+
+def current_trace():
+    span = _current.get()
+    return span.trace if span is not None else None
+
+
+def end_trace(status=None):
+    """Close the current request's trace and keep it in the ring buffer"""
+    span = _current.get()
+    _current.set(None)
+    if span is None:
+        return None
+
+    trace = span.trace
+    trace.root.duration = time.perf_counter() - trace.started
+    trace.root.attrs['status'] = status
+    with _recent_lock:
+        _recent.append(trace)
+    return trace
+
+
+def discard():
+    """Drop an unfinished trace (the request failed before it could be ended)"""
+    _current.set(None)
+
+
+class span:
+    """
+    Context manager timing a block as a child of the current span, or doing
+    nothing when there is no trace. Extra keyword arguments become span
+    attributes.
+    """
+    __slots__ = ('name', 'kind', 'attrs', '_span', '_token')
+
+    def __init__(self, name, kind='internal', **attrs):
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is None:
+            self._span = None
+            return None
+        self._span = Span(parent.trace, parent.span_id, self.name, self.kind, time.perf_counter(), self.attrs)
+        self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        child = self._span
+        if child is None:
+            return False
+        child.duration = time.perf_counter() - child.start
+        if exc_type is not None:
+            child.attrs['error'] = exc_type.__name__
+        _current.reset(self._token)
+        child.trace.add(child)
+        return False
+
+
+def traced(name, kind='internal'):
+    """Decorator form of span()"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, kind, seconds, **attrs):
+    """Add a span that just ended, seconds long, under the current span (for observer callbacks)"""
+    parent = _current.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, parent.span_id, name, kind, time.perf_counter() - seconds, attrs)
+    child.duration = seconds
+    parent.trace.add(child)
+
+
+def slowest(limit=10, min_ms=0, with_spans=True):
+    """The slowest traces in this process's ring buffer, slowest first"""
+    with _recent_lock:
+        traces = list(_recent)
+    traces = [trace for trace in traces if trace.root.duration * 1000 >= min_ms]
+    traces.sort(key=lambda trace: trace.root.duration, reverse=True)
+    return [trace.summary(with_spans) for trace in traces[:limit]]
+
+
+def find(trace_id):
+    with _recent_lock:
+        traces = list(_recent)
+    for trace in reversed(traces):
+        if trace.trace_id == trace_id:
+            return trace.summary()
+    return None
+
+
+def buffered():
+    return len(_recent)
+
+
+def _on_query(query, seconds, rows):
+    if _current.get() is not None:
+        record('db.statement', 'db', seconds, sql=query_budget.normalize_sql(query), rows=max(rows, 0))
+
+
+def _on_pool(event, pool, seconds):
+    if _current.get() is None:
+        return
+    if event == 'checkout':
+        record('db.pool', 'db', seconds, pool=pool)
+    elif event == 'release':
+        record('db.connection', 'db', seconds, pool=pool)
+
+
+db.pool_observers.append(_on_pool)
+query_budget.query_observers.append(_on_query)
@@ -0,0 +1,397 @@
+"""
+Shared-memory validation index.
+
+One memory-mapped open-addressing hash table per event, stored under
+VALIDATION_INDEX_DIR (tmpfs by default), so every gunicorn worker on the
+host reads the same pages instead of keeping its own copy. Each slot holds
+the first 8 bytes of the QR payload digest, the ticket id and a status byte.
+
+validate_ticket asks check() before touching Postgres: a payload that is
+not in the table, or whose ticket is cancelled, is rejected without a DB
+round trip. Anything else still goes through the normal DB path, so the
+index can only ever save work, never accept a ticket on its own.
+
+The table is built by activate_event (or lazily by the first scan on a
+host that missed the activation), updated in place by the routes on this
+host, and refreshed from Postgres every VALIDATION_INDEX_REFRESH_SECONDS
+to pick up tickets issued, cancelled or re-activated on other hosts.
+Refreshes pull by tickets.updated_at (kept current by a trigger, see
+database/migrate.py), re-reading VALIDATION_INDEX_REFRESH_OVERLAP_SECONDS
+before the last change seen so rows committed late by a long transaction
+are not skipped.
+
+A miss forces a refresh (at most once per
+VALIDATION_INDEX_MISS_REFRESH_SECONDS) before the scan is rejected, which
+bounds how stale a rejection can be. If another worker holds the refresh
+lock for longer than VALIDATION_INDEX_MISS_WAIT_SECONDS, the scan goes to
+Postgres instead of being rejected.
+
+Event ids come from untrusted QR payloads, so nothing is created on disk
+for an event until Postgres confirms it exists and is active.
+"""
+import os
+import time
+import mmap
+import fcntl
+import logging
+import struct
+import tempfile
+import threading
+from database.db import execute_query
+from database.shards import shard_for_event
+from ticket_codes import event_id_from_payload, qr_digest
+
+INDEX_ENABLED = os.getenv('VALIDATION_INDEX_ENABLED', 'true').lower() == 'true'
+INDEX_DIR = os.getenv(
+    'VALIDATION_INDEX_DIR',
+    '/dev/shm/ticket9ja' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'ticket9ja')
+)
+REFRESH_SECONDS = float(os.getenv('VALIDATION_INDEX_REFRESH_SECONDS', '5'))
+MISS_REFRESH_SECONDS = float(os.getenv('VALIDATION_INDEX_MISS_REFRESH_SECONDS', '1'))
+MISS_WAIT_SECONDS = float(os.getenv('VALIDATION_INDEX_MISS_WAIT_SECONDS', '0.2'))
+REFRESH_OVERLAP_SECONDS = float(os.getenv('VALIDATION_INDEX_REFRESH_OVERLAP_SECONDS', '30'))
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'T9JIDX02'
+# magic, capacity, count, changed_until (latest tickets.updated_at seen, epoch), refreshed_at
+HEADER = struct.Struct('<8sQQdd')
+HEADER_SIZE = 64
+# key hash, ticket id, status
+SLOT = struct.Struct('<QIB3x')
+MAX_LOAD = 0.7
+
+STATUS_CODES = {'active': 1, 'used': 2, 'cancelled': 3, 'deleted': 4}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+# events.id is an INTEGER; larger ids in a payload can't be real
+MAX_EVENT_ID = 2 ** 31 - 1
+MAX_INACTIVE = 10000
+
+_readers = {}          # event_id -> (inode, mmap)
+_inactive = {}         # event_id -> time we last saw it was not an active event
+_local = threading.Lock()
+
+
+def _path(event_id):
+    return os.path.join(INDEX_DIR, f"event_{int(event_id)}.idx")
+
+
+def _lock_path(event_id):
+    return os.path.join(INDEX_DIR, f"event_{int(event_id)}.lock")
+
+
+def _key(qr_payload):
+    key = struct.unpack('<Q', qr_digest(qr_payload)[:8])[0]
+    return key or 1  # 0 marks an empty slot
+
+
+class _FileLock:
+    """
+    Exclusive flock on a per-event lock file (the index file itself gets
+    replaced). wait=None blocks, otherwise gives up after `wait` seconds.
+    """
+
+    def __init__(self, event_id, wait=None):
+        self.event_id = event_id
+        self.wait = wait
+        self.fd = None
+
+    def __enter__(self):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        self.fd = os.open(_lock_path(self.event_id), os.O_CREAT | os.O_RDWR, 0o644)
+        if self.wait is None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            return True
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    os.close(self.fd)
+                    self.fd = None
+                    return False
+                time.sleep(0.01)
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+
+
+def _capacity_for(count):
+    capacity = 64
+    while capacity * MAX_LOAD < count:
+        capacity *= 2
+    return capacity
+
+
+def _probe(buf, capacity, key):
+    """Return the slot index holding key, or the first empty slot"""
+    mask = capacity - 1
+    slot = key & mask
+    while True:
+        offset = HEADER_SIZE + slot * SLOT.size
+        slot_key, ticket_id, status = SLOT.unpack_from(buf, offset)
+        if slot_key == key or slot_key == 0:
+            return offset, slot_key, ticket_id, status
+        slot = (slot + 1) & mask
+
+
+def build_index(event_id):
+    """Build (or rebuild) the index for an event from Postgres and publish it atomically"""
+    if not INDEX_ENABLED:
+        return False
+
+    with _FileLock(event_id):
+        return _build(event_id)
+
+
+def _build(event_id):
+    """build_index with the event's lock already held"""
+    event = execute_query('SELECT capacity FROM events WHERE id = %s', (event_id,), shard=shard_for_event(event_id))
+    if not event:
+        return False
+
+    tickets = execute_query(
+        'SELECT id, qr_code, status, EXTRACT(EPOCH FROM updated_at) AS changed FROM tickets WHERE event_id = %s',
+        (event_id,),
+        shard=shard_for_event(event_id)
+    ) or []
+
+    # Leave room for the tickets still to be issued so incremental
+    # inserts rarely force a rebuild
+    expected = max(len(tickets), event[0]['capacity'] or 0) + 1024
+    _write_table(event_id, tickets, _capacity_for(expected))
+
+    logger.info("Validation index built", extra={'event_id': event_id, 'tickets': len(tickets)})
+    return True
+
+
+def _write_table(event_id, tickets, capacity):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    size = HEADER_SIZE + capacity * SLOT.size
+    buf = bytearray(size)
+
+    changed_until = 0.0
+    for ticket in tickets:
+        key = _key(ticket['qr_code'])
+        offset, _, _, _ = _probe(buf, capacity, key)
+        SLOT.pack_into(buf, offset, key, ticket['id'], STATUS_CODES.get(ticket['status'], 1))
+        changed_until = max(changed_until, float(ticket['changed'] or 0))
+
+    HEADER.pack_into(buf, 0, MAGIC, capacity, len(tickets), changed_until, time.time())
+
+    tmp = f"{_path(event_id)}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(buf)
+    os.replace(tmp, _path(event_id))
+
+
+def drop_index(event_id):
+    """Remove an event's index (event closed or deleted)"""
+    try:
+        os.unlink(_path(event_id))
+    except FileNotFoundError:
+        pass
+    with _local:
+        _readers.pop(event_id, None)
+
+
+def _reader(event_id):
+    """Read-only mapping of the current index file, reopened when it is replaced"""
+    try:
+        inode = os.stat(_path(event_id)).st_ino
+    except FileNotFoundError:
+        return None
+
+    cached = _readers.get(event_id)
+    if cached and cached[0] == inode:
+        return cached[1]
+
+    try:
+        with open(_path(event_id), 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+    if HEADER.unpack_from(mapped, 0)[0] != MAGIC:
+        mapped.close()
+        return None
+
+    with _local:
+        _readers[event_id] = (inode, mapped)
+    return mapped
+
+
+def _update(event_id, updates):
+    """Apply (qr_payload, ticket_id, status) updates in place; rebuild if the table fills up"""
+    with _FileLock(event_id):
+        if _apply_updates(event_id, updates):
+            return
+        # Ran out of room: rebuild from Postgres with a bigger table
+        _build(event_id)
+
+
+def _apply_updates(event_id, updates, changed_until=None, refreshed_at=None):
+    """
+    Write updates into the table with the event's lock held, optionally
+    moving the refresh marks too. Returns False when the table is full.
+    """
+    try:
+        f = open(_path(event_id), 'r+b')
+    except FileNotFoundError:
+        return True
+    with f:
+        mapped = mmap.mmap(f.fileno(), 0)
+        try:
+            magic, capacity, count, marked_until, marked_at = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC:
+                return True
+            for qr_payload, ticket_id, status in updates:
+                key = _key(qr_payload)
+                offset, slot_key, _, _ = _probe(mapped, capacity, key)
+                if slot_key == 0:
+                    if status == 'deleted':
+                        continue
+                    if (count + 1) > capacity * MAX_LOAD:
+                        return False
+                    count += 1
+                # Key goes in last so readers never see a key with a stale body
+                struct.pack_into('<IB', mapped, offset + 8, ticket_id, STATUS_CODES[status])
+                struct.pack_into('<Q', mapped, offset, key)
+
+            if changed_until is not None:
+                marked_until = max(marked_until, changed_until)
+            if refreshed_at is not None:
+                marked_at = refreshed_at
+            HEADER.pack_into(mapped, 0, magic, capacity, count, marked_until, marked_at)
+            return True
+        finally:
+            mapped.close()
+
+
+def upsert_ticket(event_id, qr_payload, ticket_id, status):
+    """Record a ticket's current status (called after the DB commit)"""
+    if INDEX_ENABLED and event_id is not None:
+        _update(int(event_id), [(qr_payload, ticket_id, status)])
+
+
+def remove_ticket(event_id, qr_payload, ticket_id):
+    """Tombstone a deleted ticket so it reads as unknown"""
+    if INDEX_ENABLED and event_id is not None:
+        _update(int(event_id), [(qr_payload, ticket_id, 'deleted')])
+
+
+def refresh(event_id, force=False):
+    """
+    Pull tickets changed since the last refresh, from any host. Returns
+    False when the index can't be vouched for: there is none, or on a forced
+    refresh another worker held the lock for longer than MISS_WAIT_SECONDS.
+    """
+    mapped = _reader(event_id)
+    if mapped is None:
+        return False
+
+    interval = MISS_REFRESH_SECONDS if force else REFRESH_SECONDS
+    if time.time() - HEADER.unpack_from(mapped, 0)[4] < interval:
+        return True
+
+    with _FileLock(event_id, wait=MISS_WAIT_SECONDS if force else 0) as acquired:
+        if not acquired:
+            # Periodic refresh: another worker is on it. Forced: don't reject on a stale table.
+            return not force
+
+        # Whoever held the lock may have just refreshed
+        mapped = _reader(event_id)
+        if mapped is None:
+            return False
+        _, _, _, changed_until, refreshed_at = HEADER.unpack_from(mapped, 0)
+        if time.time() - refreshed_at < interval:
+            return True
+
+        started = time.time()
+        changed = execute_query('''
+            SELECT id, qr_code, status, EXTRACT(EPOCH FROM updated_at) AS changed
+            FROM tickets
+            WHERE event_id = %s AND updated_at > TIMESTAMP 'epoch' + %s * INTERVAL '1 second'
+        ''', (event_id, changed_until - REFRESH_OVERLAP_SECONDS), shard=shard_for_event(event_id)) or []
+
+        latest = max((float(t['changed']) for t in changed), default=changed_until)
+        updates = [(t['qr_code'], t['id'], t['status']) for t in changed]
+        if not _apply_updates(event_id, updates, changed_until=latest, refreshed_at=started):
+            _build(event_id)
+    return True
+
+
+def check(qr_payload):
+    """
+    Look a scanned payload up without going to Postgres.
+
+    Returns 'unknown' or 'cancelled' when the scan can be rejected right
+    away, a status name for known tickets, or None when there is no index
+    for the payload and the caller must ask the database.
+    """
+    if not INDEX_ENABLED:
+        return None
+
+    event_id = event_id_from_payload(qr_payload)
+    if event_id is None:
+        return None
+    if not 0 < event_id <= MAX_EVENT_ID:
+        return 'unknown'
+
+    mapped = _reader(event_id)
+    if mapped is None:
+        _build_missing(event_id)
+        return None
+
+    refresh(event_id)
+    mapped = _reader(event_id)
+    if mapped is None:
+        return None
+    status = _lookup(mapped, qr_payload)
+
+    if status in (None, 'deleted'):
+        # Could be a ticket issued on another host since the last refresh
+        if not refresh(event_id, force=True):
+            return None
+        mapped = _reader(event_id)
+        if mapped is None:
+            return None
+        status = _lookup(mapped, qr_payload)
+
+    if status in (None, 'deleted'):
+        return 'unknown'
+    return status
+
+
+def _lookup(mapped, qr_payload):
+    capacity = HEADER.unpack_from(mapped, 0)[1]
+    key = _key(qr_payload)
+    _, slot_key, _, status = _probe(mapped, capacity, key)
+    if slot_key == 0:
+        return None
+    return STATUS_NAMES.get(status)
+
+
+def _build_missing(event_id):
+    """First scan on a host that never saw activate_event: build once, others use the DB meanwhile"""
+    last = _inactive.get(event_id)
+    if last and time.time() - last < REFRESH_SECONDS:
+        return
+
+    # The id comes from the payload: ask Postgres before creating any file for it
+    event = execute_query('SELECT status FROM events WHERE id = %s', (event_id,), shard=shard_for_event(event_id))
+    if not event or event[0]['status'] != 'active':
+        if len(_inactive) >= MAX_INACTIVE:
+            _inactive.clear()
+        _inactive[event_id] = time.time()
+        return
+
+    with _FileLock(event_id, wait=0) as acquired:
+        # Also replaces a table left in an older format
+        if acquired and _reader(event_id) is None:
+            _build(event_id)